@@ -3,15 +3,42 @@ Main Customer Service Agent
 Orchestrates all modules to handle user queries
 """
 
-import httpx
-from typing import Dict, List, Optional
+import asyncio
+import json
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 from config import Config
 from safety_guard import SafetyGuard
 from intent_classifier import IntentClassifier
-from knowledge_base import KnowledgeBase
+from knowledge_base import create_knowledge_base
 from rag_retriever import RAGRetriever
 from validator_agent import ValidatorAgent
 from observer import Observer
+from llm_client import LLMTransport
+from kb_watcher import KnowledgeBaseWatcher
+from query_context import current_query, span, start_query
+from semantic_cache import SemanticAnswerCache
+from session_store import SessionStore
+from prompt_builder import PromptBuilder
+from profiling import QueryProfiler, should_profile
+
+
+# Appended to the system prompt in fused mode
+FUSED_RESPONSE_FORMAT = """
+
+Respond ONLY with a JSON object:
+{
+    "answer": "your answer to the user, citing sources as [Source: FAQ-X]",
+    "cited_faq_ids": [ids of the FAQs the answer relies on],
+    "grounded": true/false (is every statement supported by the cited FAQs?),
+    "confidence": 0.0-1.0
+}"""
+
+NUMBER_PATTERN = re.compile(r'\d+(?:[.:,]\d+)*')
+CITATION_PATTERN = re.compile(r'\[Source:[^\]]*\]')
 
 
 class CustomerServiceAgent:
@@ -21,17 +48,54 @@ class CustomerServiceAgent:
         # Initialize all modules
         self.safety_guard = SafetyGuard()
         self.intent_classifier = IntentClassifier()
-        self.knowledge_base = KnowledgeBase()
-        self.rag_retriever = RAGRetriever(self.knowledge_base)
-        self.validator = ValidatorAgent()
+        self.rag_retriever = RAGRetriever(create_knowledge_base())
+        # Build the FAQ matrix (and ANN index) now rather than in the first requests
+        self.rag_retriever.refresh()
+        self.llm = LLMTransport.shared()
         self.observer = Observer()
+        self.validator = ValidatorAgent(self.llm, self.observer)
+        self.observer.register_cache('query_embeddings', self.rag_retriever.embeddings_cache)
+        if self.llm.cache is not None:
+            self.observer.register_cache('llm_responses', self.llm.cache)
+        self.semantic_cache = None
+        if Config.SEMANTIC_CACHE_ENABLED:
+            self.semantic_cache = SemanticAnswerCache(self.rag_retriever.embedder.dim)
+            self.observer.register_cache('semantic_answers', self.semantic_cache)
+        
+        # Optionally pick up FAQ edits without restarting
+        self.kb_watcher = None
+        if Config.KB_HOT_RELOAD:
+            self.kb_watcher = KnowledgeBaseWatcher(self.rag_retriever, self.observer)
+            self.kb_watcher.start()
         
-        # Conversation history
-        self.conversation_history: List[Dict] = []
+        # Conversation history of every user, keyed by session id
+        self.sessions = SessionStore()
+        self.observer.register_cache('sessions', self.sessions)
+        
+        # Keeps retrieved context and history within their token budgets
+        self.prompt_builder = PromptBuilder()
+        
+        # Per-query cProfile/tracemalloc, on request or sampled (PROFILE_SAMPLE_RATE)
+        self.profiler = QueryProfiler()
+        
+        # Async pipeline: CPU-bound steps run on a small thread pool; the sync
+        # process_query() drives the pipeline on a background event loop
+        self._cpu_executor = ThreadPoolExecutor(
+            max_workers=Config.ASYNC_CPU_WORKERS, thread_name_prefix="agent-cpu"
+        )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
         
         print("Agent initialized successfully!")
     
-    def _call_llm(self, messages: list, temperature: float = None) -> tuple:
+    @property
+    def knowledge_base(self):
+        """Knowledge base of the retriever's current snapshot (changes on hot reload)"""
+        return self.rag_retriever.kb
+    
+    def _call_llm(self, messages: list, temperature: float = None,
+                  stage: str = 'generate') -> tuple:
         """
         Call LLM API
         Returns: (response_text, input_tokens, output_tokens)
@@ -39,45 +103,50 @@ class CustomerServiceAgent:
         if temperature is None:
             temperature = Config.LLM_TEMPERATURE
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {Config.LLM_API_KEY}"
-        }
-        
-        payload = {
-            "model": Config.LLM_MODEL,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": Config.LLM_MAX_TOKENS
-        }
+        try:
+            result = self.llm.chat(messages, temperature, Config.LLM_MAX_TOKENS, stage=stage)
+            return self._parse_llm_result(result)
+        except Exception as e:
+            print(f"LLM API Error: {e}")
+            self._record_llm_error()
+            return f"I apologize, but I'm experiencing technical difficulties. Please try again later.", 0, 0
+    
+    async def _call_llm_async(self, messages: list, temperature: float = None,
+                              stage: str = 'generate', json_mode: bool = False) -> tuple:
+        """Async version of _call_llm()"""
+        if temperature is None:
+            temperature = Config.LLM_TEMPERATURE
         
         try:
-            response = httpx.post(
-                Config.LLM_API_URL,
-                json=payload,
-                headers=headers,
-                timeout=60.0
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            content = result['choices'][0]['message']['content']
-            usage = result.get('usage', {})
-            input_tokens = usage.get('prompt_tokens', 0)
-            output_tokens = usage.get('completion_tokens', 0)
-            
-            # Track in observer
-            self.observer.track_llm_call(Config.LLM_MODEL, input_tokens, output_tokens)
-            
-            return content, input_tokens, output_tokens
-            
+            result = await self.llm.achat(messages, temperature, Config.LLM_MAX_TOKENS,
+                                          stage=stage, json_mode=json_mode)
+            return self._parse_llm_result(result)
         except Exception as e:
             print(f"LLM API Error: {e}")
+            self._record_llm_error()
             return f"I apologize, but I'm experiencing technical difficulties. Please try again later.", 0, 0
     
-    def _generate_response(self, query: str, intent: str, 
-                          context: str, sources: List[str]) -> str:
-        """Generate response using LLM"""
+    @staticmethod
+    def _record_llm_error():
+        context = current_query()
+        if context is not None:
+            context.record_llm_error()
+    
+    def _parse_llm_result(self, result: Dict) -> tuple:
+        content = result['choices'][0]['message']['content']
+        usage = result.get('usage', {})
+        input_tokens = usage.get('prompt_tokens', 0)
+        output_tokens = usage.get('completion_tokens', 0)
+        
+        # Track in observer (cache hits cost nothing; the cache reports the savings)
+        if not result.get('cached'):
+            self.observer.track_llm_call(Config.LLM_MODEL, input_tokens, output_tokens)
+        
+        return content, input_tokens, output_tokens
+    
+    def _build_messages(self, query: str, intent: str, context: str,
+                        history: List[Dict] = None) -> list:
+        """Build the generation prompt"""
         
         # Build system prompt based on intent
         if intent == 'chitchat':
@@ -105,41 +174,265 @@ Remember to cite sources and be honest about limitations."""
             {"role": "user", "content": user_prompt}
         ]
         
-        # Add conversation history (last 3 turns)
-        if self.conversation_history:
+        # Add conversation history (last few turns of the session)
+        if history:
             history_context = "\n\nRecent conversation history:\n"
-            for turn in self.conversation_history[-3:]:
+            for turn in history:
                 history_context += f"User: {turn['user']}\nAssistant: {turn['assistant']}\n"
             messages[1]['content'] = history_context + "\n" + messages[1]['content']
         
-        response, _, _ = self._call_llm(messages)
+        return messages
+    
+    def _generate_response(self, query: str, intent: str, 
+                          context: str, sources: List[str],
+                          history: List[Dict] = None) -> str:
+        """Generate response using LLM"""
+        response, _, _ = self._call_llm(self._build_messages(query, intent, context, history))
+        return response
+    
+    async def _generate_response_async(self, query: str, intent: str,
+                                       context: str, sources: List[str],
+                                       history: List[Dict] = None) -> str:
+        """Async version of _generate_response()"""
+        response, _, _ = await self._call_llm_async(
+            self._build_messages(query, intent, context, history)
+        )
         return response
     
-    def process_query(self, query: str) -> Dict:
+    async def _run_cpu(self, func, *args):
+        """Run a CPU-bound step on the agent's thread pool"""
+        context = current_query()
+        if context is not None and context.profiling:
+            # cProfile only sees the loop thread
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._cpu_executor, func, *args)
+    
+    async def _session_io(self, func, *args):
+        """Session store calls read/write SQLite when spilling is on: keep them off the loop"""
+        if self.sessions.spill_file:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+    
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the background event loop used by the sync API"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, name="agent-loop", daemon=True
+                )
+                self._loop_thread.start()
+            return self._loop
+    
+    def process_query(self, session_id: str, query: str, profile: Optional[bool] = None) -> Dict:
         """
-        Main method to process user query
+        Main method to process a user query within a conversation session
+        Blocking wrapper around process_query_async()
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.process_query_async(session_id, query, profile), self._ensure_loop()
+        )
+        return future.result()
+    
+    async def process_query_async(self, session_id: str, query: str,
+                                  profile: Optional[bool] = None) -> Dict:
+        """
+        Process a user query without blocking the event loop
+        profile: True/False to force profiling on or off, None to sample
         Returns response dictionary with answer and metadata
         """
+        context = start_query(Config.RESPONSE_MODE, Config.QUERY_BUDGET)
+        if not should_profile(profile):
+            return await self._answer_async(session_id, query)
+        
+        context.profiling = True
+        try:
+            with self.profiler.profile(context.trace_id) as report:
+                result = await self._answer_async(session_id, query)
+        finally:
+            context.profiling = False
+        if report:
+            result['metadata']['profile'] = report
+            self.observer.log_profile(dict(report, trace_id=context.trace_id))
+            print(f"Profile written to {report['collapsed']}")
+        return result
+    
+    async def _answer_async(self, session_id: str, query: str) -> Dict:
+        """Steps 1-6 of the pipeline for the current query"""
+        turn = await self._prepare_turn_async(session_id, query)
+        if 'blocked_result' in turn:
+            return turn['blocked_result']
+        
+        direct = await self._fast_path_async(turn)
+        if direct is not None:
+            return direct
+        
+        cached = await self._semantic_lookup_async(turn)
+        if cached is not None:
+            return cached
+        
+        if Config.RESPONSE_MODE == 'fused' and self._needs_validation(turn):
+            # Steps 4+5 in one call; the validator only runs on disagreement
+            response, validation_passed, validation_feedback = await self._generate_fused_async(turn)
+        else:
+            # Step 4: Generate Response
+            with span('generate'):
+                response = await self._generate_response_async(
+                    turn['query'], turn['intent'], turn['context'], turn['sources'], turn['history']
+                )
+            print(f"\nGenerated Response: {response[:100]}...")
+            
+            # Step 5: Validate Response (if not chitchat)
+            response, validation_passed, validation_feedback = await self._validate_async(turn, response)
+        
+        # Step 6: Safety Guard - Output Filter
+        with span('safety_output'):
+            response, was_filtered = await self._run_cpu(self.safety_guard.filter_output, response)
+        self.observer.log_safety_check(True, was_filtered, "Output check completed")
+        
+        result = await self._finish_turn_async(turn, response, validation_passed, validation_feedback,
+                                               was_filtered)
+        self._semantic_store(turn, result)
+        return result
+    
+    def stream_query(self, session_id: str, query: str) -> Iterator[Dict]:
+        """Blocking iterator over stream_query_async() events"""
+        events = queue.Queue()
+        
+        async def pump():
+            # One task drives the whole stream, so the query context (a
+            # contextvar) is the same for every step
+            try:
+                async for event in self.stream_query_async(session_id, query):
+                    events.put(event)
+            except Exception as e:
+                events.put(e)
+            finally:
+                events.put(None)
+        
+        future = asyncio.run_coroutine_threadsafe(pump(), self._ensure_loop())
+        try:
+            while True:
+                event = events.get()
+                if event is None:
+                    break
+                if isinstance(event, Exception):
+                    raise event
+                yield event
+        finally:
+            future.cancel()
+    
+    async def stream_query_async(self, session_id: str, query: str) -> AsyncIterator[Dict]:
+        """
+        Process a user query, streaming the answer as it is generated
+        Yields events:
+            {'type': 'token', 'text': ...}     filtered answer text, in order
+            {'type': 'revision', 'text': ...}  replacement answer if validation failed
+            {'type': 'done', 'result': ...}    same dictionary as process_query()
+        """
+        start_query('stream', Config.QUERY_BUDGET)
+        turn = await self._prepare_turn_async(session_id, query)
+        if 'blocked_result' in turn:
+            yield {'type': 'done', 'result': turn['blocked_result']}
+            return
+        
+        cached = await self._fast_path_async(turn)
+        if cached is None:
+            cached = await self._semantic_lookup_async(turn)
+        if cached is not None:
+            yield {'type': 'token', 'text': cached['answer']}
+            yield {'type': 'done', 'result': cached}
+            return
+        
+        # Step 4: Generate Response, filtering output incrementally (step 6)
+        stream_filter = self.safety_guard.stream_filter()
+        messages = self._build_messages(turn['query'], turn['intent'], turn['context'], turn['history'])
+        parts = []
+        with span('generate'):
+            async for delta in self._stream_llm_async(messages):
+                parts.append(delta)
+                text = stream_filter.feed(delta)
+                if text:
+                    yield {'type': 'token', 'text': text}
+        text = stream_filter.flush()
+        if text:
+            yield {'type': 'token', 'text': text}
+        raw_response = "".join(parts)
+        
+        # Step 5: Validate Response once the whole answer is known
+        response, validation_passed, validation_feedback = await self._validate_async(turn, raw_response)
+        was_filtered = stream_filter.was_filtered
+        if response is raw_response:
+            response = stream_filter.text
+        else:
+            with span('safety_output'):
+                response, revision_filtered = await self._run_cpu(self.safety_guard.filter_output, response)
+            was_filtered = was_filtered or revision_filtered
+            yield {'type': 'revision', 'text': response}
+        self.observer.log_safety_check(True, was_filtered, "Output check completed")
+        
+        result = await self._finish_turn_async(turn, response, validation_passed,
+                                               validation_feedback, was_filtered)
+        self._semantic_store(turn, result)
+        yield {'type': 'done', 'result': result}
+    
+    async def _stream_llm_async(self, messages: list, temperature: float = None,
+                                stage: str = 'generate') -> AsyncIterator[str]:
+        """Stream completion text deltas; usage is tracked from the final chunk"""
+        if temperature is None:
+            temperature = Config.LLM_TEMPERATURE
+        
+        input_tokens = output_tokens = 0
+        try:
+            async for chunk in self.llm.stream_chat(messages, temperature,
+                                                    Config.LLM_MAX_TOKENS, stage=stage):
+                usage = chunk.get('usage')
+                if usage:
+                    input_tokens = usage.get('prompt_tokens', 0)
+                    output_tokens = usage.get('completion_tokens', 0)
+                for choice in chunk.get('choices', []):
+                    delta = choice.get('delta', {}).get('content')
+                    if delta:
+                        yield delta
+        except Exception as e:
+            print(f"LLM API Error: {e}")
+            self._record_llm_error()
+            yield "I apologize, but I'm experiencing technical difficulties. Please try again later."
+            return
+        
+        # Track in observer
+        self.observer.track_llm_call(Config.LLM_MODEL, input_tokens, output_tokens)
+    
+    async def _prepare_turn_async(self, session_id: str, query: str) -> Dict:
+        """
+        Steps 1-3: input safety check, intent classification and retrieval
+        Returns the turn state ('blocked_result' is set if the input was rejected)
+        """
         print(f"\n{'='*60}")
         print(f"Processing Query: {query}")
         print(f"{'='*60}")
         
         # Step 1: Safety Guard - Input Check
-        input_safe, safety_message = self.safety_guard.check_input(query)
+        with span('safety_input'):
+            input_safe, safety_message = self.safety_guard.check_input(query)
         if not input_safe:
             self.observer.log_safety_check(False, False, safety_message)
-            return {
+            return {'blocked_result': {
                 'answer': "I cannot process this request due to safety concerns.",
                 'sources': [],
                 'validation_passed': False,
                 'metadata': {'safety_blocked': True}
-            }
+            }}
         
         # Sanitize input
-        query = self.safety_guard.sanitize_input(query)
+        with span('sanitize_input'):
+            query = self.safety_guard.sanitize_input(query)
+        current_query().kb_version = self.knowledge_base.content_version()
         
         # Step 2: Intent Classification
-        intent, confidence = self.intent_classifier.classify(query)
+        with span('intent'):
+            intent, confidence = self.intent_classifier.classify(query)
+        current_query().intent = intent
         print(f"Intent: {intent} (confidence: {confidence:.2f})")
         self.observer.log_intent_classification(query, intent, confidence)
         
@@ -147,69 +440,241 @@ Remember to cite sources and be honest about limitations."""
         context = ""
         sources = []
         retrieved_items = []
+        context_report = None
         
         if self.intent_classifier.should_use_rag(intent, confidence):
-            retrieved_items = self.rag_retriever.retrieve(query)
+            with span('retrieve'):
+                retrieved_items = await self._run_cpu(self.rag_retriever.retrieve, query)
             if retrieved_items:
-                context = self.rag_retriever.format_context(retrieved_items)
-                sources = self.rag_retriever.get_sources(retrieved_items)
+                with span('pack_context'):
+                    context_items, context_report = self.prompt_builder.pack_context(retrieved_items)
+                    context = self.rag_retriever.format_context(context_items)
+                sources = self.rag_retriever.get_sources(context_items)
                 print(f"Retrieved {len(retrieved_items)} relevant FAQs")
                 self.observer.log_rag_retrieval(query, len(retrieved_items), sources)
             else:
                 print("No relevant FAQs found")
         
-        # Step 4: Generate Response
-        response = self._generate_response(query, intent, context, sources)
+        # Condense older turns to fit the history budget
+        with span('pack_history'):
+            history = await self._session_io(
+                self.sessions.history, session_id, Config.SESSION_HISTORY_TURNS
+            )
+            history, history_report = self.prompt_builder.pack_history(history)
+        self.observer.log_prompt_packing(context_report, history_report)
+        
+        return {
+            'session_id': session_id,
+            'history': history,
+            'query': query,
+            'intent': intent,
+            'confidence': confidence,
+            'context': context,
+            'sources': sources,
+            'retrieved_items': retrieved_items
+        }
+    
+    async def _fast_path_async(self, turn: Dict) -> Optional[Dict]:
+        """
+        Answer without the LLM: the verified answer of a near-identical FAQ,
+        or a canned reply to pure small talk
+        Returns: result dictionary, or None if the query needs the LLM
+        """
+        if not Config.FAST_PATH_ENABLED:
+            return None
+        
+        with span('fast_path'):
+            response = None
+            if turn['intent'] == 'chitchat':
+                kind = self.intent_classifier.small_talk_type(turn['query'])
+                response = Config.CHITCHAT_REPLIES.get(kind)
+            elif turn['retrieved_items']:
+                # Retrieval scores are query/question cosine similarities in every mode
+                faq, similarity = turn['retrieved_items'][0]
+                if faq.get('verified') and similarity >= Config.FAST_PATH_MIN_SIMILARITY:
+                    response = Config.FAST_PATH_FAQ_TEMPLATE.format(answer=faq['answer'], id=faq['id'])
+                    turn['sources'] = [f"FAQ-{faq['id']}"]
+                    turn['metadata'] = {'fast_path_similarity': round(similarity, 3)}
+        if response is None:
+            return None
+        
+        print("Answered on the fast path (no LLM call)")
+        current_query().mode = 'fast_path'
+        with span('safety_output'):
+            response, was_filtered = self.safety_guard.filter_output(response)
+        self.observer.log_safety_check(True, was_filtered, "Output check completed")
+        return await self._finish_turn_async(turn, response, True, "", was_filtered)
+    
+    async def _semantic_lookup_async(self, turn: Dict) -> Optional[Dict]:
+        """
+        Answer from the semantic cache if a near-identical query retrieved the
+        same FAQs under the same KB version
+        Returns: result dictionary on a hit, None otherwise
+        """
+        if self.semantic_cache is None or not turn['retrieved_items']:
+            return None
+        
+        context = current_query()
+        with span('semantic_cache'):
+            turn['query_vector'] = self.rag_retriever.embed_query(turn['query'])
+            entry, similarity = self.semantic_cache.lookup(
+                turn['query_vector'], self._faq_ids(turn), context.kb_version
+            )
+        if entry is None:
+            return None
+        
+        print(f"Semantic cache hit (similarity {similarity:.2f})")
+        context.mode = 'semantic_cache'
+        turn['metadata'] = {'semantic_cache_similarity': round(similarity, 3)}
+        return await self._finish_turn_async(turn, entry['answer'], True, "", entry['was_filtered'])
+    
+    def _semantic_store(self, turn: Dict, result: Dict):
+        """Cache validated answers that were produced without failed LLM calls"""
+        context = current_query()
+        if ('query_vector' not in turn or not result['validation_passed']
+                or context.failed_calls or turn.get('metadata', {}).get('validation_skipped')):
+            return
+        self.semantic_cache.store(
+            turn['query_vector'], self._faq_ids(turn), context.kb_version,
+            result['answer'], result['metadata']['output_filtered'], context.tokens
+        )
+    
+    @staticmethod
+    def _faq_ids(turn: Dict) -> List:
+        return [faq['id'] for faq, _ in turn['retrieved_items']]
+    
+    @staticmethod
+    def _needs_validation(turn: Dict) -> bool:
+        """Only grounded (non-chitchat, with context) answers are validated"""
+        return turn['intent'] != 'chitchat' and bool(turn['context'])
+    
+    async def _generate_fused_async(self, turn: Dict) -> tuple:
+        """
+        Fused mode: generate the answer, cited FAQ ids and a grounding verdict in
+        one call. The validator agent only runs if the model reports the answer
+        as ungrounded, the JSON is unusable, or the local check finds issues.
+        Returns: (response, validation_passed, validation_feedback)
+        """
+        messages = self._build_messages(turn['query'], turn['intent'], turn['context'], turn['history'])
+        messages[0]['content'] += FUSED_RESPONSE_FORMAT
+        with span('generate'):
+            content, _, _ = await self._call_llm_async(messages, json_mode=True)
+        
+        try:
+            data = json.loads(content)
+            response = str(data['answer'])
+            cited_ids = [str(faq_id) for faq_id in data.get('cited_faq_ids') or []]
+            grounded = data.get('grounded') is True
+        except (ValueError, KeyError, TypeError, AttributeError):
+            print("Fused response was not valid JSON, falling back to validator")
+            return await self._validate_async(turn, content)
         print(f"\nGenerated Response: {response[:100]}...")
         
-        # Step 5: Validate Response (if not chitchat)
+        issues = self._check_grounding(turn, response, cited_ids)
+        if grounded and not issues:
+            print("Validation: PASSED (self-check)")
+            return response, True, ""
+        
+        print(f"Self-check disagrees ({'; '.join(issues) or 'reported ungrounded'}), running validator")
+        return await self._validate_async(turn, response)
+    
+    @staticmethod
+    def _check_grounding(turn: Dict, response: str, cited_ids: List[str]) -> List[str]:
+        """
+        Cheap local grounding check for fused answers
+        Returns: list of issues (empty if none found)
+        """
+        issues = []
+        retrieved_ids = {str(faq['id']) for faq, _ in turn['retrieved_items']}
+        if not cited_ids:
+            issues.append("no FAQ cited")
+        unknown = [faq_id for faq_id in cited_ids if faq_id not in retrieved_ids]
+        if unknown:
+            issues.append(f"cites FAQs that were not retrieved: {', '.join(unknown)}")
+        
+        # Numbers (prices, times, days) are the most common hallucination
+        context_numbers = set(NUMBER_PATTERN.findall(turn['context']))
+        text = CITATION_PATTERN.sub('', response)
+        unsupported = [n for n in NUMBER_PATTERN.findall(text) if n not in context_numbers]
+        if unsupported:
+            issues.append(f"numbers not in context: {', '.join(unsupported)}")
+        return issues
+    
+    async def _validate_async(self, turn: Dict, response: str) -> tuple:
+        """
+        Step 5: validate grounded answers and ask for an improvement on failure
+        Returns: (response, validation_passed, validation_feedback)
+        """
         validation_passed = True
         validation_feedback = ""
         
-        if intent != 'chitchat' and context:
+        if self._needs_validation(turn):
+            # Degrade instead of blowing the latency budget
+            context = current_query()
+            if context.remaining() < Config.VALIDATION_MIN_BUDGET:
+                print("\nSkipping validation: latency budget nearly used up")
+                turn.setdefault('metadata', {})['validation_skipped'] = True
+                return response, validation_passed, validation_feedback
+            
             print("\nValidating response...")
-            validation_passed, validation_feedback, _ = self.validator.validate_response(
-                query, response, context, sources
-            )
+            with span('validate'):
+                validation_passed, validation_feedback, _ = await self.validator.validate_response_async(
+                    turn['query'], response, turn['context'], turn['sources']
+                )
             print(f"Validation: {'PASSED' if validation_passed else 'FAILED'}")
             
             # If validation failed, try to improve
             if not validation_passed:
-                print("Attempting to improve response...")
-                response = self.validator.suggest_improvement(
-                    query, response, validation_feedback
-                )
-        
-        # Step 6: Safety Guard - Output Filter
-        response, was_filtered = self.safety_guard.filter_output(response)
-        self.observer.log_safety_check(True, was_filtered, "Output check completed")
+                if context.remaining() < Config.IMPROVEMENT_MIN_BUDGET:
+                    print("Skipping improvement: latency budget nearly used up")
+                    turn.setdefault('metadata', {})['improvement_skipped'] = True
+                else:
+                    print("Attempting to improve response...")
+                    with span('improve'):
+                        response = await self.validator.suggest_improvement_async(
+                            turn['query'], response, validation_feedback
+                        )
         
-        # Step 7: Log Response
-        self.observer.log_response(query, response, sources, validation_passed)
+        return response, validation_passed, validation_feedback
+    
+    async def _finish_turn_async(self, turn: Dict, response: str, validation_passed: bool,
+                                 validation_feedback: str, was_filtered: bool) -> Dict:
+        """Step 7: log the response, update history and build the result"""
+        query = turn['query']
+        self.observer.log_response(query, response, turn['sources'], validation_passed)
         
         # Update conversation history
-        self.conversation_history.append({
-            'user': query,
-            'assistant': response
-        })
+        with span('session_update'):
+            await self._session_io(self.sessions.append, turn['session_id'], query, response)
+        
+        context = current_query()
+        latency_ms = context.elapsed_ms()
+        self.observer.record_query(context)
         
         # Return result
         return {
             'answer': response,
-            'sources': sources,
-            'intent': intent,
-            'confidence': confidence,
+            'sources': turn['sources'],
+            'intent': turn['intent'],
+            'confidence': turn['confidence'],
             'validation_passed': validation_passed,
             'validation_feedback': validation_feedback if not validation_passed else None,
             'metadata': {
-                'num_retrieved': len(retrieved_items),
-                'output_filtered': was_filtered
+                'num_retrieved': len(turn['retrieved_items']),
+                'output_filtered': was_filtered,
+                'response_mode': context.mode,
+                'llm_round_trips': context.round_trips,
+                'llm_retries': context.retries,
+                'llm_hedges': context.hedges,
+                'latency_ms': round(latency_ms, 1),
+                'trace_id': context.trace_id,
+                **turn.get('metadata', {})
             }
         }
     
-    def reset_conversation(self):
-        """Reset conversation history"""
-        self.conversation_history = []
+    def reset_conversation(self, session_id: str):
+        """Reset conversation history of a session"""
+        self.sessions.reset(session_id)
         print("Conversation history reset.")
     
     def get_session_summary(self):
@@ -219,3 +684,20 @@ Remember to cite sources and be honest about limitations."""
     def print_session_summary(self):
         """Print session summary"""
         self.observer.print_summary()
+    
+    def close(self):
+        """Stop background work and release pooled connections"""
+        if self.kb_watcher is not None:
+            self.kb_watcher.stop()
+        if self.sessions.spill_file:
+            self.sessions.flush()
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.llm.aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop_thread.join()
+            loop.close()
+        self._cpu_executor.shutdown(wait=False)
+        self.llm.close()
+        self.observer.close()
@@ -0,0 +1,167 @@
+"""
+Approximate Nearest Neighbour Module
+Pure-NumPy IVF (inverted file) index over unit-norm embeddings
+Vectors are clustered with spherical k-means; a query only scans the
+rows of its nprobe closest clusters instead of the whole matrix
+"""
+
+import json
+import os
+import tempfile
+import numpy as np
+from typing import Optional, Tuple
+
+
+class IVFIndex:
+    def __init__(self, nlist: int, nprobe: int = 8):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids: Optional[np.ndarray] = None  # (nlist x D)
+        self.order: Optional[np.ndarray] = None  # row ids grouped by cluster
+        self.offsets: Optional[np.ndarray] = None  # (nlist + 1) list boundaries
+        self.vectors: Optional[np.ndarray] = None  # matrix[order], contiguous per list
+        self._positions: Optional[np.ndarray] = None  # inverse of order, built on demand
+    
+    @property
+    def num_indexed(self) -> int:
+        """Rows 0..num_indexed-1 of the matrix are covered by the index"""
+        return 0 if self.order is None else self.order.size
+    
+    @staticmethod
+    def default_nlist(num_vectors: int) -> int:
+        """Rule of thumb: about 4 * sqrt(N) lists"""
+        return max(1, int(4 * np.sqrt(num_vectors)))
+    
+    def build(self, matrix: np.ndarray, iterations: int = 10,
+              train_size: int = 65536, seed: int = 0):
+        """Train centroids on a sample of rows, then assign every row to a list"""
+        rng = np.random.default_rng(seed)
+        num_vectors = matrix.shape[0]
+        self.nlist = max(1, min(self.nlist, num_vectors))
+        
+        if num_vectors > train_size:
+            sample = matrix[np.sort(rng.choice(num_vectors, train_size, replace=False))]
+        else:
+            sample = np.asarray(matrix)
+        sample = np.ascontiguousarray(sample, dtype=np.float32)
+        
+        self.centroids = sample[rng.choice(sample.shape[0], self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = self._assign(sample)
+            self._update_centroids(sample, assign, rng)
+        
+        self._fill_lists(matrix, self._assign(matrix))
+    
+    def _assign(self, matrix: np.ndarray) -> np.ndarray:
+        """Nearest centroid (max inner product) per row, in memory-bounded chunks"""
+        chunk = max(1024, (1 << 24) // self.nlist)
+        assign = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], chunk):
+            scores = np.asarray(matrix[start:start + chunk], dtype=np.float32) @ self.centroids.T
+            assign[start:start + chunk] = scores.argmax(axis=1)
+        return assign
+    
+    def _update_centroids(self, sample: np.ndarray, assign: np.ndarray,
+                          rng: np.random.Generator):
+        """Spherical k-means step: mean direction of each cluster"""
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=self.nlist)
+        nonempty = np.flatnonzero(counts)
+        sums = np.add.reduceat(sample[order], np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty])
+        self.centroids[nonempty] = sums
+        
+        # Re-seed empty clusters with random sample rows
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            self.centroids[empty] = sample[rng.choice(sample.shape[0], empty.size)]
+        
+        norms = np.linalg.norm(self.centroids, axis=1, keepdims=True)
+        np.divide(self.centroids, norms, out=self.centroids, where=norms > 0)
+    
+    def _fill_lists(self, matrix: np.ndarray, assign: np.ndarray):
+        """Group row ids by list and keep a cluster-contiguous copy of the vectors"""
+        self.order = np.argsort(assign, kind='stable')
+        self._positions = None
+        counts = np.bincount(assign, minlength=self.nlist)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.vectors = np.ascontiguousarray(np.asarray(matrix, dtype=np.float32)[self.order])
+    
+    def update_vectors(self, rows: np.ndarray, vectors: np.ndarray):
+        """
+        Refresh vectors of already indexed rows in place
+        Rows keep their list; recall degrades slightly until the next build
+        """
+        if self._positions is None:
+            self._positions = np.argsort(self.order)
+        rows = np.asarray(rows, dtype=np.int64)
+        indexed = rows < self.num_indexed
+        self.vectors[self._positions[rows[indexed]]] = vectors[indexed]
+    
+    def search(self, query: np.ndarray, k: int, nprobe: int = None,
+               exclude: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k by inner product
+        exclude: optional boolean row mask of rows to skip
+        Returns: (row ids, scores) sorted by descending score
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.nlist)
+        
+        # Score each probed list on its contiguous slice
+        positions, scores = [], []
+        for list_id in probe:
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start == end:
+                continue
+            positions.append(np.arange(start, end))
+            scores.append(self.vectors[start:end] @ query)
+        if not positions:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        
+        rows = self.order[np.concatenate(positions)]
+        scores = np.concatenate(scores)
+        if exclude is not None:
+            allowed = ~exclude[rows]
+            rows, scores = rows[allowed], scores[allowed]
+        
+        if rows.size > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return rows[order], scores[order]
+    
+    def save(self, path: str, meta: dict = None):
+        """Save centroids and lists (vectors are re-gathered from the matrix on load)"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Unique temp name: several processes may save the same index
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                         meta=np.array(json.dumps(meta or {})))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    @classmethod
+    def load(cls, path: str, matrix: np.ndarray, nprobe: int = 8) -> Tuple["IVFIndex", dict]:
+        """
+        Load an index saved with save() for the given embedding matrix
+        The matrix may have extra rows appended after the indexed ones
+        """
+        with np.load(path) as data:
+            index = cls(nlist=data['centroids'].shape[0], nprobe=nprobe)
+            index.centroids = data['centroids']
+            index.order = data['order']
+            index.offsets = data['offsets']
+            meta = json.loads(str(data['meta']))
+        if matrix.shape[0] < index.num_indexed:
+            raise ValueError("Embedding matrix is smaller than the saved index")
+        indexed = np.asarray(matrix[:index.num_indexed], dtype=np.float32)
+        index.vectors = np.ascontiguousarray(indexed[index.order])
+        return index, meta
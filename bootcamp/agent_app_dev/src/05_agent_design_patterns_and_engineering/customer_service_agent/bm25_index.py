@@ -0,0 +1,135 @@
+"""
+Keyword Index Module
+Inverted index with BM25 scoring over FAQ text
+Query cost grows with the postings of the query terms, not the corpus size
+"""
+
+import bisect
+import math
+import re
+import numpy as np
+from typing import Dict, List, Tuple
+
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens"""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> ([doc rows], [term frequencies])
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        # Document lengths in a growable buffer, so queries never copy it
+        self._doc_lengths = np.zeros(64, dtype=np.float64)
+        self.num_docs = 0
+        self.total_length = 0
+        # term -> (rows array, tf array), rebuilt lazily after a term changes
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    
+    def build(self, texts: List[str]):
+        """Index all documents; row i is texts[i]"""
+        self.__init__(self.k1, self.b)
+        for text in texts:
+            self.add_document(text)
+    
+    @staticmethod
+    def _term_counts(text: str) -> Tuple[Dict[str, int], int]:
+        tokens = tokenize(text)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        return counts, len(tokens)
+    
+    def add_document(self, text: str) -> int:
+        """Append a document and return its row"""
+        row = self.num_docs
+        counts, length = self._term_counts(text)
+        
+        # Rows only grow, so appending keeps every postings list sorted
+        for term, tf in counts.items():
+            rows, tfs = self.postings.setdefault(term, ([], []))
+            rows.append(row)
+            tfs.append(tf)
+            self._arrays.pop(term, None)
+        
+        if row == self._doc_lengths.size:
+            self._doc_lengths = np.concatenate([self._doc_lengths, np.zeros_like(self._doc_lengths)])
+        self._doc_lengths[row] = length
+        self.num_docs += 1
+        self.total_length += length
+        return row
+    
+    def update_document(self, row: int, old_text: str, new_text: str):
+        """Re-index one document in place; only the postings of its terms are touched"""
+        old_counts, old_length = self._term_counts(old_text)
+        for term in old_counts:
+            rows, tfs = self.postings[term]
+            i = bisect.bisect_left(rows, row)
+            if i < len(rows) and rows[i] == row:
+                del rows[i], tfs[i]
+            if not rows:
+                del self.postings[term]
+            self._arrays.pop(term, None)
+        
+        new_counts, new_length = self._term_counts(new_text)
+        for term, tf in new_counts.items():
+            rows, tfs = self.postings.setdefault(term, ([], []))
+            i = bisect.bisect_left(rows, row)
+            rows.insert(i, row)
+            tfs.insert(i, tf)
+            self._arrays.pop(term, None)
+        
+        self._doc_lengths[row] = new_length
+        self.total_length += new_length - old_length
+    
+    def _term_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            rows, tfs = self.postings[term]
+            arrays = (np.asarray(rows, dtype=np.int64), np.asarray(tfs, dtype=np.float64))
+            self._arrays[term] = arrays
+        return arrays
+    
+    def search(self, query: str, top_k: int = None,
+               require_all: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score documents containing any query term (or all, if require_all)
+        Returns: (rows, scores) sorted by descending BM25 score
+        """
+        terms = set(tokenize(query))
+        present = [term for term in terms if term in self.postings]
+        if not present or (require_all and len(present) < len(terms)):
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        
+        num_docs = self.num_docs
+        avg_length = self.total_length / num_docs if num_docs else 0.0
+        
+        all_rows, all_scores = [], []
+        for term in present:
+            rows, tfs = self._term_arrays(term)
+            df = rows.size
+            idf = math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self._doc_lengths[rows] / (avg_length or 1.0))
+            all_rows.append(rows)
+            all_scores.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+        
+        # Sum per-term contributions for each matching document
+        rows, inverse, matched = np.unique(
+            np.concatenate(all_rows), return_inverse=True, return_counts=True
+        )
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        if require_all:
+            keep = matched == len(present)
+            rows, scores = rows[keep], scores[keep]
+        
+        if top_k is not None and rows.size > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return rows[order], scores[order]
@@ -10,12 +10,125 @@ class Config:
     LLM_TEMPERATURE = 0.7
     LLM_MAX_TOKENS = 1000
     
+    # LLM HTTP transport (one pooled client shared by all agents)
+    LLM_HTTP2 = True  # Needs the 'h2' package, falls back to HTTP/1.1 without it
+    LLM_MAX_CONNECTIONS = 100  # Upper bound on concurrent in-flight LLM requests
+    LLM_MAX_KEEPALIVE = 20
+    LLM_KEEPALIVE_EXPIRY = 60.0  # Seconds an idle connection is kept open
+    LLM_CONNECT_TIMEOUT = 5.0
+    LLM_POOL_TIMEOUT = 5.0  # Seconds to wait for a free pooled connection
+    LLM_DEFAULT_TIMEOUT = 60.0
+    LLM_STREAM_USAGE = True  # Ask for token usage in the final stream chunk (OpenAI-style stream_options)
+    STREAM_RESPONSES = False  # Interactive mode prints tokens as they are generated
+    LLM_STAGE_TIMEOUTS = {  # Read timeout per pipeline stage, in seconds
+        'generate': 60.0,
+        'validate': 30.0,
+        'improve': 60.0
+    }
+    
+    # Latency budget and resilience of LLM calls
+    QUERY_BUDGET = 25.0  # Seconds per query end to end; LLM timeouts shrink to fit
+    LLM_MAX_RETRIES = 2  # On timeouts, connection errors, 429 and 5xx
+    LLM_RETRY_BASE_DELAY = 0.5  # Seconds; exponential backoff with full jitter
+    LLM_RETRY_MAX_DELAY = 4.0
+    LLM_HEDGING = False  # Send a duplicate request once a call is slower than the stage p95
+    LLM_HEDGE_PERCENTILE = 95
+    LLM_HEDGE_MIN_SAMPLES = 20  # Latency samples per stage before hedging starts
+    VALIDATION_MIN_BUDGET = 5.0  # Skip validation when less budget (seconds) is left
+    IMPROVEMENT_MIN_BUDGET = 8.0  # Keep the unvalidated answer instead of improving it
+    
+    # LLM response cache (memory LRU + SQLite), keyed by model, temperature,
+    # max_tokens, messages and KB version
+    LLM_CACHE_ENABLED = True
+    LLM_CACHE_SIZE = 2000  # Responses kept in memory
+    LLM_CACHE_TTL = 86400  # Seconds, None to keep until the KB changes
+    LLM_CACHE_FILE = "data/llm_cache.db"  # None for a memory-only cache
+    
+    # Semantic answer cache: reuse the final answer of a near-identical query
+    # that retrieved the same FAQs (no generation or validation call)
+    SEMANTIC_CACHE_ENABLED = True
+    SEMANTIC_CACHE_SIZE = 5000  # Max cached answers (least recently used evicted)
+    SEMANTIC_CACHE_THRESHOLD = 0.85  # Min cosine similarity between queries
+    
+    # Direct-answer fast path: no LLM call for strong verified FAQ matches and
+    # pure small talk (output filtering and logging still run)
+    FAST_PATH_ENABLED = True
+    FAST_PATH_MIN_SIMILARITY = 0.9  # Query/question cosine similarity of a verified FAQ
+    FAST_PATH_FAQ_TEMPLATE = "{answer}\n\n[Source: FAQ-{id}]"
+    CHITCHAT_REPLIES = {
+        'greeting': "Hello! How can I help you today?",
+        'thanks': "You're welcome! Is there anything else I can help you with?",
+        'goodbye': "Goodbye! Have a great day."
+    }
+    
+    # Async pipeline
+    ASYNC_CPU_WORKERS = 4  # Threads for CPU-bound steps (retrieval, output filtering)
+    
+    # Response mode: 'serial' (generate, then validator agent) or 'fused' (one
+    # JSON call that also cites FAQ ids and self-assesses grounding; the
+    # validator only runs when that verdict or a local check fails)
+    RESPONSE_MODE = "serial"
+    LLM_JSON_MODE = True  # Send response_format=json_object for structured calls
+    
     # For validator agent, use lower temperature for more accurate validation
     VALIDATOR_TEMPERATURE = 0.3
     
     # RAG Configuration
     RAG_TOP_K = 3  # Number of knowledge base items to retrieve
     RAG_SIMILARITY_THRESHOLD = 0.6  # Minimum similarity score
+    RAG_RETRIEVAL_MODE = "vector"  # 'vector', 'keyword' (BM25) or 'hybrid' (fused)
+    RAG_RRF_K = 60  # Reciprocal-rank fusion constant for hybrid mode
+    RAG_FUSION_DEPTH = 4  # Hybrid mode fuses top_k * depth candidates per ranker
+    EMBEDDING_DIM = 300  # Hashing embedder dimensions
+    PERSIST_EMBEDDINGS = True  # Save FAQ embeddings as .npy next to the FAQ file
+    EMBEDDING_CACHE_SIZE = 10000  # Max cached query embeddings (LRU)
+    EMBEDDING_CACHE_TTL = 3600  # Seconds, None to disable expiry
+    
+    # Vector index: 'exact' (brute force) or 'ivf' (approximate, pure NumPy)
+    RAG_INDEX_TYPE = "exact"
+    ANN_MIN_VECTORS = 20000  # Below this size, exact search is used anyway
+    ANN_NLIST = None  # Number of IVF lists, None = about 4 * sqrt(N)
+    ANN_NPROBE = 8  # Lists scanned per query: higher = better recall, slower
+    ANN_KMEANS_ITERATIONS = 10
+    ANN_REBUILD_FRACTION = 0.2  # Rebuild once FAQs added since the build exceed this fraction
+    
+    # Knowledge Base storage: 'json' (snapshot + change log) or 'sqlite' (WAL + FTS5)
+    KB_BACKEND = "json"
+    KB_FAQ_FILE = "data/faq.json"
+    KB_SQLITE_FILE = "data/faq.db"
+    
+    KB_HOT_RELOAD = False  # Watch the KB storage and swap in changes without a restart
+    KB_RELOAD_INTERVAL = 2.0  # Seconds between change checks
+    
+    # JSON Knowledge Base persistence: changes go to an append-only log that is
+    # compacted into the snapshot once it reaches max(MIN_ENTRIES, RATIO * N)
+    KB_COMPACT_MIN_ENTRIES = 1000
+    KB_COMPACT_RATIO = 0.5
+    
+    # Conversation sessions (one shared agent serves many users)
+    SESSION_MAX_TURNS = 10  # Turns kept per session (oldest dropped first)
+    SESSION_HISTORY_TURNS = 3  # Most recent turns included in the prompt
+    SESSION_MAX_SESSIONS = 50000  # In memory; least recently active are evicted first
+    SESSION_MAX_MEMORY_MB = 256  # Approximate memory cap for all session histories
+    SESSION_IDLE_TTL = 1800  # Seconds of inactivity before a session expires
+    SESSION_SPILL_FILE = None  # e.g. "data/sessions.db" to keep evicted sessions on disk
+    
+    # Prompt assembly: token budgets (approximate tokens, None = unlimited)
+    PROMPT_CONTEXT_TOKENS = 600  # Retrieved FAQs, packed by relevance
+    PROMPT_HISTORY_TOKENS = 300  # Conversation history
+    PROMPT_VERBATIM_TURNS = 1  # Newest turns kept verbatim; older ones are condensed
+    PROMPT_CONDENSED_TURN_TOKENS = 40  # Per question/answer of a condensed turn
+    PROMPT_DEDUPE_THRESHOLD = 0.8  # Word overlap (Jaccard) above which a lower-ranked FAQ is skipped
+    PROMPT_MIN_ANSWER_TOKENS = 30  # Leave an FAQ out rather than truncate its answer below this
+    
+    # Profiling: cProfile around single queries, written to PROFILE_DIR as
+    # collapsed stacks (flamegraph input), a pstats dump and, with
+    # PROFILE_MEMORY, the top tracemalloc allocation sites
+    PROFILE_SAMPLE_RATE = 0.0  # Fraction of queries profiled (0 = only when requested per query)
+    PROFILE_MEMORY = False  # Also trace allocations (slows the profiled query down a lot)
+    PROFILE_MEMORY_FRAMES = 5  # Stack frames kept per allocation
+    PROFILE_TOP_ALLOCATIONS = 20
+    PROFILE_DIR = "profiles"
     
     # Safety Guard Configuration
     SENSITIVE_WORDS_FILE = "data/sensitive_words.txt"
@@ -26,6 +139,19 @@ class Config:
     
     # Observer Configuration
     LOG_FILE = "logs/agent.log"
+    LOG_ASYNC_WRITER = True  # Write log entries from a background thread in batches
+    LOG_BATCH_SIZE = 256  # Entries per write
+    LOG_FLUSH_INTERVAL = 0.5  # Seconds a queued entry may wait for its batch
+    LOG_QUEUE_SIZE = 10000  # Entries waiting to be written
+    LOG_QUEUE_FULL_POLICY = "drop"  # 'drop' (discard and count) or 'block' (wait up to LOG_BLOCK_TIMEOUT)
+    LOG_BLOCK_TIMEOUT = 1.0
+    LOG_MAX_BYTES = 10 * 1024 * 1024  # Rotate the log at this size (None = never)
+    LOG_BACKUP_COUNT = 5  # Rotated files kept: agent.log.1 (newest) ... agent.log.5
+    LOG_COMPRESS_ROTATED = True  # gzip rotated files (agent.log.1.gz)
+    OBSERVER_RECENT_EVENTS = 1000  # Events kept in memory (ring buffer); older ones are only in the log file
+    TRACE_LOG_SPANS = True  # Include each query's spans in its 'query_completed' log entry
+    METRICS_FILE = None  # e.g. "logs/metrics.prom": Prometheus text file, written on close
+    METRICS_PORT = None  # e.g. 9464 to serve Prometheus metrics at /metrics (0 = any free port)
     ENABLE_COST_TRACKING = True
     
     # Token cost (adjust based on your LLM provider)
@@ -0,0 +1,132 @@
+"""
+Embedding Module
+Deterministic hashing embedder (character n-grams + position-weighted words)
+Hashes are stable across processes, so embeddings can be persisted and shared
+"""
+
+import hashlib
+from functools import lru_cache
+import numpy as np
+from typing import List
+from config import Config
+
+
+# FNV-1a 64-bit constants, used for vectorized character n-gram hashing
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+
+
+@lru_cache(maxsize=65536)
+def stable_hash64(token: str) -> int:
+    """Process-independent 64-bit hash of a string (unlike built-in hash())"""
+    digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _mix64(h: np.ndarray) -> np.ndarray:
+    """SplitMix64 finalizer, spreads FNV output before taking the modulus"""
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xbf58476d1ce4e5b9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+class HashingEmbedder:
+    # Bump when the feature extraction changes, so persisted matrices are rebuilt
+    VERSION = 1
+    NGRAM_SIZES = (2, 3)
+    NGRAM_WEIGHT = 0.5
+    MAX_WORDS = 100
+    
+    def __init__(self, dim: int = None):
+        self.dim = dim or Config.EMBEDDING_DIM
+    
+    @property
+    def signature(self) -> str:
+        """Identifies embeddings produced by this embedder, e.g. 'hash-v1-d300'"""
+        return f"hash-v{self.VERSION}-d{self.dim}"
+    
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a single text into a unit-norm vector"""
+        return self.embed_batch([text])[0]
+    
+    def embed_batch(self, texts: List[str], chunk_size: int = 4096) -> np.ndarray:
+        """
+        Embed many texts at once
+        Returns: (len(texts) x dim) float32 matrix of unit-norm rows
+        """
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), chunk_size):
+            chunk = texts[start:start + chunk_size]
+            matrix[start:start + len(chunk)] = self._embed_chunk(chunk)
+        return matrix
+    
+    def _embed_chunk(self, texts: List[str]) -> np.ndarray:
+        """Accumulate word and n-gram features for a chunk with one bincount"""
+        texts = [text.lower() for text in texts]
+        num_rows = len(texts)
+        
+        # Word-level features (hashed per word, weighted by position)
+        word_rows, word_buckets, word_weights = [], [], []
+        for row, text in enumerate(texts):
+            for i, word in enumerate(text.split()[:self.MAX_WORDS]):
+                word_rows.append(row)
+                word_buckets.append(stable_hash64(word) % self.dim)
+                word_weights.append(1.0 / (i + 1))
+        
+        # Character n-gram features, hashed over all texts at once
+        ngram_rows, ngram_buckets = self._ngram_buckets(texts)
+        
+        flat_index = np.concatenate([
+            np.asarray(word_rows, dtype=np.int64) * self.dim + np.asarray(word_buckets, dtype=np.int64),
+            ngram_rows * self.dim + ngram_buckets,
+        ])
+        weights = np.concatenate([
+            np.asarray(word_weights, dtype=np.float64),
+            np.full(ngram_rows.size, self.NGRAM_WEIGHT),
+        ])
+        vectors = np.bincount(
+            flat_index, weights=weights, minlength=num_rows * self.dim
+        ).reshape(num_rows, self.dim)
+        
+        # Normalize
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+    
+    def _ngram_buckets(self, texts: List[str]):
+        """
+        Hash every character n-gram of every text without a Python loop per char
+        Returns: (row index, bucket) arrays with one entry per n-gram
+        """
+        lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+        if lengths.sum() == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        
+        codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        row_of_char = np.repeat(np.arange(len(texts)), lengths)
+        # Offset of each character within its own text
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        pos_in_text = np.arange(codes.size) - np.repeat(starts, lengths)
+        
+        rows, buckets = [], []
+        for n in self.NGRAM_SIZES:
+            count = codes.size - n + 1
+            if count <= 0:
+                continue
+            h = np.full(count, _FNV_OFFSET, dtype=np.uint64)
+            for j in range(n):
+                h = (h ^ codes[j:j + count]) * _FNV_PRIME
+            # Salt with n so 2-grams and 3-grams land in different buckets
+            h = _mix64(h ^ np.uint64(n))
+            # Keep only n-grams that do not cross a text boundary
+            valid = pos_in_text[:count] + n <= lengths[row_of_char[:count]]
+            rows.append(row_of_char[:count][valid])
+            buckets.append((h[valid] % np.uint64(self.dim)).astype(np.int64))
+        
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        return np.concatenate(rows), np.concatenate(buckets)
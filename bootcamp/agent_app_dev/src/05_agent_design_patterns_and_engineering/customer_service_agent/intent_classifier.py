@@ -3,7 +3,8 @@ Intent Classifier Module
 Classifies user intent: FAQ, General Question, or Chitchat
 """
 
-from typing import Tuple
+import re
+from typing import Optional, Tuple
 from config import Config
 
 
@@ -22,6 +23,18 @@ class IntentClassifier:
             'how are you', 'thanks', 'thank you', 'bye', 'goodbye',
             'nice', 'great', 'awesome', 'cool'
         ]
+        
+        # Words a pure small-talk message may consist of, per kind
+        # (checked in order; a kind needs at least one of its trigger words)
+        self.small_talk = [
+            ('goodbye', {'bye', 'goodbye'},
+             {'bye', 'goodbye', 'see', 'you', 'later', 'have', 'a', 'nice', 'good', 'great', 'day'}),
+            ('thanks', {'thanks', 'thank'},
+             {'thanks', 'thank', 'you', 'so', 'very', 'much', 'a', 'lot', 'great', 'awesome', 'cool'}),
+            ('greeting', {'hello', 'hi', 'hey', 'morning', 'afternoon', 'evening', 'how'},
+             {'hello', 'hi', 'hey', 'there', 'good', 'morning', 'afternoon', 'evening',
+              'how', 'are', 'you', 'doing', 'today'}),
+        ]
     
     def classify(self, text: str) -> Tuple[str, float]:
         """
@@ -65,3 +78,21 @@ class IntentClassifier:
         if intent == 'general':
             return True
         return True
+    
+    def small_talk_type(self, text: str) -> Optional[str]:
+        """
+        Kind of a message that is nothing but small talk
+        Returns: 'greeting', 'thanks', 'goodbye' or None (e.g. if it also asks something)
+        """
+        words = set(re.findall(r"[a-z']+", text.lower()))
+        if not words:
+            return None
+        vocabulary = set()
+        for _, _, allowed in self.small_talk:
+            vocabulary |= allowed
+        if not words <= vocabulary:
+            return None
+        for kind, triggers, _ in self.small_talk:
+            if words & triggers:
+                return kind
+        return None
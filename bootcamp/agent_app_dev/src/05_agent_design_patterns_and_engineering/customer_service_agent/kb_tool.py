@@ -0,0 +1,191 @@
+"""
+Knowledge Base Bulk Tool
+Stream FAQ records from JSONL/CSV into the knowledge base in one commit
+
+Usage:
+    python kb_tool.py import faqs.jsonl
+    python kb_tool.py update changes.csv
+    python kb_tool.py delete --ids 3,4,5
+    python kb_tool.py migrate --faq-file data/faq.json --sqlite data/faq.db
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+from typing import Dict, Iterator, List
+
+from config import Config
+from knowledge_base import KnowledgeBase
+from rag_retriever import RAGRetriever
+from sqlite_knowledge_base import SQLiteKnowledgeBase
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def read_records(path: str) -> Iterator[Dict]:
+    """Stream records from a .jsonl or .csv file ('-' reads JSONL from stdin)"""
+    if path == '-':
+        source = sys.stdin
+    else:
+        source = open(path, 'r', encoding='utf-8', newline='')
+    try:
+        if path.lower().endswith('.csv'):
+            for record in csv.DictReader(source):
+                yield csv_record(record)
+        else:
+            for line in source:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def csv_record(row: Dict) -> Dict:
+    """
+    Fields of a CSV row that have a value: a blank cell means 'not given',
+    so a partial update leaves that field unchanged
+    """
+    return {field: value for field, value in row.items()
+            if field is not None and value is not None and value.strip() != ''}
+
+
+def chunked(records: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def peak_memory_mb() -> float:
+    """Peak resident set size of this process in MB (0 if unknown)"""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def open_knowledge_base(faq_file: str, sqlite_file: str = None) -> KnowledgeBase:
+    if sqlite_file:
+        return SQLiteKnowledgeBase(sqlite_file)
+    return KnowledgeBase(faq_file)
+
+
+def migrate(faq_file: str, sqlite_file: str) -> Dict:
+    """Copy a JSON knowledge base (snapshot + change log) into SQLite, keeping ids"""
+    start = time.perf_counter()
+    source = KnowledgeBase(faq_file)
+    target = SQLiteKnowledgeBase(sqlite_file)
+    target.import_faqs(source.faqs, next_id=source.next_id)
+    
+    # Embed once so the BLOB column is filled for the next cold start
+    retriever = RAGRetriever(target)
+    retriever.refresh()
+    target.save_embeddings(retriever.embedder.signature)
+    
+    elapsed = time.perf_counter() - start
+    return {
+        'rows': len(source.faqs),
+        'applied': len(target.faqs),
+        'invalid': 0,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(len(source.faqs) / elapsed) if elapsed > 0 else 0,
+        'peak_memory_mb': round(peak_memory_mb(), 1),
+        'total_faqs': len(target.faqs)
+    }
+
+
+def run(command: str, path: str, ids: str, kb: KnowledgeBase, chunk_size: int) -> Dict:
+    """Apply one bulk operation and return its statistics"""
+    retriever = RAGRetriever(kb)
+    retriever.refresh()
+    
+    start = time.perf_counter()
+    stats = {'rows': 0, 'applied': 0, 'invalid': 0}
+    
+    if command == 'delete' and ids:
+        records = ({'id': faq_id} for faq_id in ids.split(','))
+    else:
+        records = read_records(path)
+    
+    for chunk in chunked(records, chunk_size):
+        # Validate per record so one bad row does not reject the whole chunk
+        valid = []
+        for record in chunk:
+            try:
+                if command == 'add':
+                    kb.validate_record(record)
+                else:
+                    record['id'] = int(record['id'])
+                    if command == 'update':
+                        kb.validate_record(record, partial=True)
+                valid.append(record)
+            except (ValueError, KeyError, TypeError) as e:
+                stats['invalid'] += 1
+                print(f"Skipping invalid record {record!r}: {e}")
+        stats['rows'] += len(chunk)
+        
+        if command == 'add':
+            stats['applied'] += len(kb.add_faqs(valid, commit=False))
+        elif command == 'update':
+            stats['applied'] += len(kb.update_faqs(valid, commit=False))
+        else:
+            stats['applied'] += len(kb.delete_faqs([r['id'] for r in valid], commit=False))
+        
+        # Embed this chunk's new or changed questions in one vectorized pass
+        retriever.refresh()
+    
+    kb.commit()
+    if Config.PERSIST_EMBEDDINGS and kb.embeddings is not None:
+        kb.save_embeddings(retriever.embedder.signature)
+    
+    elapsed = time.perf_counter() - start
+    stats['seconds'] = round(elapsed, 3)
+    stats['rows_per_second'] = round(stats['rows'] / elapsed) if elapsed > 0 else 0
+    stats['peak_memory_mb'] = round(peak_memory_mb(), 1)
+    stats['total_faqs'] = len(kb.faqs)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/update/delete FAQs")
+    parser.add_argument('command', choices=['import', 'update', 'delete', 'migrate'])
+    parser.add_argument('source', nargs='?', default='-',
+                        help="JSONL or CSV file ('-' for JSONL on stdin)")
+    parser.add_argument('--ids', help="Comma-separated FAQ ids (delete only)")
+    parser.add_argument('--faq-file', default=Config.KB_FAQ_FILE)
+    parser.add_argument('--sqlite', help="Use (or, for migrate, create) this SQLite database")
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+    
+    if args.command == 'migrate':
+        stats = migrate(args.faq_file, args.sqlite or Config.KB_SQLITE_FILE)
+    else:
+        command = 'add' if args.command == 'import' else args.command
+        kb = open_knowledge_base(args.faq_file, args.sqlite)
+        stats = run(command, args.source, args.ids, kb, args.chunk_size)
+    
+    print("\n" + "="*50)
+    print(f"BULK {args.command.upper()} COMPLETE")
+    print("="*50)
+    print(f"Rows read: {stats['rows']} ({stats['invalid']} invalid)")
+    print(f"Rows applied: {stats['applied']}")
+    print(f"Total FAQs: {stats['total_faqs']}")
+    print(f"Time: {stats['seconds']}s ({stats['rows_per_second']} rows/s)")
+    print(f"Peak memory: {stats['peak_memory_mb']} MB")
+    print("="*50 + "\n")
+
+
+if __name__ == "__main__":
+    main()
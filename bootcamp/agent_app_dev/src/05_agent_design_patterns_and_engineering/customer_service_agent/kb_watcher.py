@@ -0,0 +1,64 @@
+"""
+Knowledge Base Hot Reload
+Background thread that polls the FAQ storage for changes, rebuilds the
+knowledge base and its retrieval indexes off the request path, and swaps
+the new snapshot into the RAGRetriever
+"""
+
+import threading
+import time
+from typing import Callable, Optional
+
+from config import Config
+from knowledge_base import KnowledgeBase, create_knowledge_base
+from rag_retriever import RAGRetriever
+
+
+class KnowledgeBaseWatcher:
+    def __init__(self, retriever: RAGRetriever, observer=None,
+                 kb_factory: Callable[[], KnowledgeBase] = create_knowledge_base,
+                 interval: float = None):
+        self.retriever = retriever
+        self.observer = observer
+        self.kb_factory = kb_factory
+        self.interval = interval or Config.KB_RELOAD_INTERVAL
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        """Start polling in a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="kb-watcher", daemon=True
+            )
+            self._thread.start()
+    
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check_now()
+            except Exception as e:
+                # Keep serving the current snapshot; retry on the next poll
+                print(f"Knowledge base reload failed: {e}")
+    
+    def check_now(self) -> bool:
+        """Reload if the storage changed; returns True if a new snapshot was swapped in"""
+        if not self.retriever.kb.has_external_changes():
+            return False
+        
+        start = time.perf_counter()
+        new_kb = self.kb_factory()
+        version = self.retriever.swap_knowledge_base(new_kb)
+        duration_ms = (time.perf_counter() - start) * 1000
+        
+        print(f"Knowledge base reloaded: snapshot v{version}, "
+              f"{len(new_kb.faqs)} FAQs in {duration_ms:.0f} ms")
+        if self.observer is not None:
+            self.observer.log_kb_reload(version, len(new_kb.faqs), duration_ms)
+        return True
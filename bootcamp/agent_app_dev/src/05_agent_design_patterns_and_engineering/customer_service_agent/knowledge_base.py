@@ -3,17 +3,74 @@ Knowledge Base Management Module
 Handles FAQ and document storage/retrieval
 """
 
+import hashlib
 import json
+import os
+import tempfile
+from contextlib import contextmanager
 import numpy as np
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set
+from bm25_index import BM25Index
+from config import Config
+
+
+@contextmanager
+def _atomic_file(path: str, mode: str):
+    """
+    Write to a uniquely named temp file in path's directory, then rename it
+    over path (concurrent writers never share a temp file)
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 
 class KnowledgeBase:
     def __init__(self, faq_file: str = "data/faq.json"):
         self.faq_file = faq_file
+        # Append-only change log, compacted periodically into faq_file
+        self.log_file = self.artifact_path("log.jsonl")
         self.faqs: List[Dict] = []
-        self.embeddings: Optional[np.ndarray] = None
+        self.keyword_index = BM25Index()
+        self._id_index: Dict[int, int] = {}  # FAQ id -> row in self.faqs
+        self._category_ids: Dict[str, Set[int]] = {}  # category -> FAQ ids
+        self._verified_buffer = np.zeros(64, dtype=bool)  # row-aligned, see verified_mask
+        # Derived views (filtered lists, row masks), dropped whenever version changes
+        self._views: Dict = {}
+        self._views_version = -1
+        self._next_id = 1
+        self._log_entries = 0
+        self._log_handle = None
+        # FAQ embeddings live in a growable buffer; self.embeddings is a view
+        self._embedding_buffer: Optional[np.ndarray] = None
+        self._num_embedded = 0
+        self.stale_rows: Set[int] = set()  # rows whose question changed since embedding
+        self.embedding_signature: Optional[str] = None
+        self.version = 0  # bumped on every change, lets derived indexes detect staleness
+        self.layout_version = 0  # bumped when rows are removed and later rows shift
+        self._pending_log: List[Dict] = []
         self._load_faqs()
+        self._replay_log()
+        self._build_indexes()
+        self.synced_signature = self.storage_signature()
+    
+    @property
+    def embeddings(self) -> Optional[np.ndarray]:
+        """(N x D) matrix of FAQ question embeddings, row i is self.faqs[i]"""
+        if self._embedding_buffer is None:
+            return None
+        return self._embedding_buffer[:self._num_embedded]
+    
+    @embeddings.setter
+    def embeddings(self, matrix: Optional[np.ndarray]):
+        self._embedding_buffer = matrix
+        self._num_embedded = 0 if matrix is None else len(matrix)
+        self.stale_rows = set()
     
     def _load_faqs(self):
         """Load FAQs from JSON file"""
@@ -21,11 +78,66 @@ class KnowledgeBase:
             with open(self.faq_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 self.faqs = data.get('faqs', [])
+                self._next_id = data.get('next_id', 1)
                 print(f"Loaded {len(self.faqs)} FAQs")
         except FileNotFoundError:
             print(f"FAQ file not found: {self.faq_file}")
             self._create_default_faqs()
     
+    def _replay_log(self):
+        """Apply changes appended to the log since the last snapshot"""
+        try:
+            with open(self.log_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        
+        id_index = {faq['id']: row for row, faq in enumerate(self.faqs)}
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn last line from a crash mid-write; everything before it is intact
+                continue
+            if entry['op'] == 'add':
+                id_index[entry['faq']['id']] = len(self.faqs)
+                self.faqs.append(entry['faq'])
+                # Ids are never reused, even if this FAQ is deleted later in the log
+                self._next_id = max(self._next_id, entry['faq']['id'] + 1)
+            elif entry['op'] == 'update' and entry['id'] in id_index:
+                self.faqs[id_index[entry['id']]].update(entry['fields'])
+            elif entry['op'] == 'delete':
+                deleted = set(entry['ids'])
+                self.faqs = [faq for faq in self.faqs if faq['id'] not in deleted]
+                id_index = {faq['id']: row for row, faq in enumerate(self.faqs)}
+            self._log_entries += 1
+        if self._log_entries:
+            print(f"Replayed {self._log_entries} FAQ changes from {self.log_file}")
+    
+    def _build_indexes(self):
+        """Build id, category, verified and keyword indexes from self.faqs"""
+        self._id_index = {faq['id']: row for row, faq in enumerate(self.faqs)}
+        self._next_id = max(self._next_id, max(self._id_index, default=0) + 1)
+        self._category_ids = {}
+        for faq in self.faqs:
+            self._category_ids.setdefault(faq.get('category'), set()).add(faq['id'])
+        self._verified_buffer = np.zeros(max(64, 2 * len(self.faqs)), dtype=bool)
+        self._verified_buffer[:len(self.faqs)] = [
+            bool(faq.get('verified', False)) for faq in self.faqs
+        ]
+        self._build_keyword_index()
+    
+    def _index_new_row(self, row: int, faq: Dict):
+        """Add an appended FAQ to the secondary indexes"""
+        self._id_index[faq['id']] = row
+        self._category_ids.setdefault(faq.get('category'), set()).add(faq['id'])
+        if row == self._verified_buffer.size:
+            self._verified_buffer = np.concatenate(
+                [self._verified_buffer, np.zeros_like(self._verified_buffer)]
+            )
+        self._verified_buffer[row] = bool(faq.get('verified', False))
+        self.keyword_index.add_document(self._keyword_text(faq))
+    
     def _create_default_faqs(self):
         """Create default FAQ data"""
         self.faqs = [
@@ -68,27 +180,331 @@ class KnowledgeBase:
         # Save default FAQs
         self.save_faqs()
     
+    @staticmethod
+    def _keyword_text(faq: Dict) -> str:
+        """Text indexed for keyword search"""
+        return f"{faq['question']} {faq['answer']}"
+    
+    def _build_keyword_index(self):
+        """(Re)build the BM25 inverted index; row i is self.faqs[i]"""
+        self.keyword_index.build([self._keyword_text(faq) for faq in self.faqs])
+    
     def save_faqs(self):
-        """Save FAQs to JSON file"""
-        import os
-        os.makedirs('data', exist_ok=True)
-        with open(self.faq_file, 'w', encoding='utf-8') as f:
-            json.dump({'faqs': self.faqs}, f, ensure_ascii=False, indent=2)
-    
-    def add_faq(self, question: str, answer: str, category: str, verified: bool = False):
-        """Add new FAQ entry"""
-        faq_id = max([faq['id'] for faq in self.faqs], default=0) + 1
-        new_faq = {
-            'id': faq_id,
+        """Save a full snapshot of the FAQs to the JSON file and truncate the change log"""
+        os.makedirs(os.path.dirname(self.faq_file) or '.', exist_ok=True)
+        tmp_file = self.faq_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            # One FAQ per line: still easy to read and diff, but uses the fast C encoder
+            f.write('{"faqs": [\n')
+            f.write(',\n'.join(json.dumps(faq, ensure_ascii=False) for faq in self.faqs))
+            f.write(f'\n], "next_id": {self._next_id}}}\n')
+        os.replace(tmp_file, self.faq_file)
+        
+        self._close_log()
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self._log_entries = 0
+        self._pending_log = []
+        self.synced_signature = self.storage_signature()
+        
+        # Keep the persisted embeddings in step with the snapshot
+        if (self.embedding_signature and self.embeddings is not None
+                and self._num_embedded == len(self.faqs) and not self.stale_rows):
+            self.save_embeddings(self.embedding_signature)
+    
+    def _append_log(self, entries: List[Dict]):
+        """Append change entries to the log, compacting it once it outgrows the snapshot"""
+        if self._log_handle is None:
+            os.makedirs(os.path.dirname(self.log_file) or '.', exist_ok=True)
+            torn = self._log_has_torn_tail()
+            self._log_handle = open(self.log_file, 'a', encoding='utf-8')
+            if torn:
+                # Start on a fresh line, or the next entry would be glued onto
+                # the torn one and skipped with it on every replay
+                self._log_handle.write('\n')
+        self._log_handle.write(''.join(
+            json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries
+        ))
+        self._log_handle.flush()
+        self._log_entries += len(entries)
+        self.synced_signature = self.storage_signature()
+    
+    def _log_has_torn_tail(self) -> bool:
+        """True if the log ends in a partial line (a crash mid-write)"""
+        try:
+            with open(self.log_file, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return False
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) != b'\n'
+        except FileNotFoundError:
+            return False
+    
+    def _record_changes(self, entries: List[Dict], commit: bool):
+        self.version += 1
+        self._pending_log.extend(entries)
+        if commit:
+            self.commit()
+    
+    def commit(self):
+        """
+        Persist pending changes with a single write: appended to the change log,
+        or as a new snapshot once the log would outgrow a fraction of the KB
+        """
+        if not self._pending_log:
+            return
+        # Compacting after the log grows by a fraction of the KB keeps adds O(1) amortized
+        threshold = max(Config.KB_COMPACT_MIN_ENTRIES, Config.KB_COMPACT_RATIO * len(self.faqs))
+        if self._log_entries + len(self._pending_log) >= threshold:
+            self.save_faqs()
+        else:
+            self._append_log(self._pending_log)
+            self._pending_log = []
+    
+    def _storage_files(self) -> List[str]:
+        return [self.faq_file, self.log_file]
+    
+    def storage_signature(self) -> tuple:
+        """(mtime, size) of the backing files; changes whenever they are written"""
+        signature = []
+        for path in self._storage_files():
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+    
+    def content_version(self) -> str:
+        """Short id of the stored KB content; changes on every write"""
+        return hashlib.blake2b(repr(self.storage_signature()).encode(), digest_size=8).hexdigest()
+    
+    def has_external_changes(self) -> bool:
+        """True if the backing files changed since this instance last loaded or wrote them"""
+        return self.storage_signature() != self.synced_signature
+    
+    def _close_log(self):
+        if self._log_handle is not None:
+            self._log_handle.close()
+            self._log_handle = None
+    
+    @staticmethod
+    def validate_record(record: Dict, partial: bool = False) -> Dict:
+        """
+        Normalize an FAQ record (question, answer, category, verified)
+        partial: only validate the fields present (for updates)
+        Raises ValueError for invalid records
+        """
+        faq = {}
+        for field in ('question', 'answer'):
+            if field in record:
+                value = record[field]
+                if not isinstance(value, str) or not value.strip():
+                    raise ValueError(f"'{field}' must be a non-empty string")
+                faq[field] = value.strip()
+            elif not partial:
+                raise ValueError(f"Missing required field '{field}'")
+        
+        if 'category' in record or not partial:
+            category = record.get('category') or 'general'
+            if not isinstance(category, str):
+                raise ValueError("'category' must be a string")
+            faq['category'] = category.strip()
+        
+        if 'verified' in record or not partial:
+            verified = record.get('verified', False)
+            if isinstance(verified, str):
+                text = verified.strip().lower()
+                if text in ('1', 'true', 'yes', 'y'):
+                    verified = True
+                elif text in ('0', 'false', 'no', 'n', ''):
+                    verified = False
+                else:
+                    raise ValueError(f"'verified' must be true or false, got {verified!r}")
+            faq['verified'] = bool(verified)
+        return faq
+    
+    def add_faq(self, question: str, answer: str, category: str, verified: bool = False) -> int:
+        """Add new FAQ entry, returns its id"""
+        return self.add_faqs([{
             'question': question,
             'answer': answer,
             'category': category,
             'verified': verified
-        }
-        self.faqs.append(new_faq)
-        self.save_faqs()
-        # Reset embeddings to force recalculation
-        self.embeddings = None
+        }])[0]
+    
+    def add_faqs(self, records: List[Dict], commit: bool = True) -> List[int]:
+        """
+        Add many FAQ entries; all records are validated before any is added
+        commit=False leaves the change log write to a later commit()
+        Returns: the new ids
+        """
+        validated = [self.validate_record(record) for record in records]
+        ids = []
+        entries = []
+        for fields in validated:
+            faq = {'id': self._next_id, **fields}
+            self._next_id += 1
+            self._index_new_row(len(self.faqs), faq)
+            self.faqs.append(faq)
+            ids.append(faq['id'])
+            entries.append({'op': 'add', 'faq': faq})
+        self._record_changes(entries, commit)
+        return ids
+    
+    def update_faq(self, faq_id: int, **fields) -> bool:
+        """
+        Update fields of an existing FAQ in place
+        Returns: False if the id does not exist
+        """
+        return bool(self.update_faqs([{'id': faq_id, **fields}]))
+    
+    def update_faqs(self, records: List[Dict], commit: bool = True) -> List[int]:
+        """
+        Update existing FAQs from records carrying an 'id' and the fields to change
+        Returns: ids that were updated (unknown ids are skipped)
+        """
+        validated = []
+        for record in records:
+            if 'id' not in record:
+                raise ValueError("Update records need an 'id'")
+            validated.append((int(record['id']), self.validate_record(record, partial=True)))
+        
+        updated = []
+        entries = []
+        for faq_id, fields in validated:
+            row = self._id_index.get(faq_id)
+            if row is None:
+                continue
+            faq = self.faqs[row]
+            old_text = self._keyword_text(faq)
+            old_question = faq['question']
+            old_category = faq.get('category')
+            faq.update(fields)
+            
+            self.keyword_index.update_document(row, old_text, self._keyword_text(faq))
+            self._verified_buffer[row] = bool(faq.get('verified', False))
+            if faq.get('category') != old_category:
+                self._category_ids[old_category].discard(faq_id)
+                self._category_ids.setdefault(faq.get('category'), set()).add(faq_id)
+            if faq['question'] != old_question and row < self._num_embedded:
+                self.stale_rows.add(row)
+            updated.append(faq_id)
+            entries.append({'op': 'update', 'id': faq_id, 'fields': fields})
+        if entries:
+            self._record_changes(entries, commit)
+        return updated
+    
+    def delete_faqs(self, faq_ids: List[int], commit: bool = True) -> List[int]:
+        """
+        Delete FAQs by id; rows after them shift up, so row-aligned indexes are rebuilt once
+        Returns: ids that were deleted (unknown ids are skipped)
+        """
+        rows = sorted({self._id_index[faq_id] for faq_id in faq_ids if faq_id in self._id_index})
+        if not rows:
+            return []
+        deleted = [self.faqs[row]['id'] for row in rows]
+        keep = np.ones(len(self.faqs), dtype=bool)
+        keep[rows] = False
+        self.faqs = [faq for faq, kept in zip(self.faqs, keep) if kept]
+        
+        if self._embedding_buffer is not None:
+            num_embedded = self._num_embedded
+            new_rows = np.cumsum(keep) - 1
+            stale_rows = {int(new_rows[row]) for row in self.stale_rows if keep[row]}
+            self.embeddings = np.ascontiguousarray(self._embedding_buffer[:num_embedded][keep[:num_embedded]])
+            self.stale_rows = stale_rows
+        
+        self._build_indexes()
+        self.layout_version += 1
+        self._record_changes([{'op': 'delete', 'ids': deleted}], commit)
+        return deleted
+    
+    def _writable_embeddings(self, capacity: int) -> np.ndarray:
+        """Make the embedding buffer writable (it may be memory-mapped) with room for capacity rows"""
+        buffer = self._embedding_buffer
+        if buffer.flags.writeable and len(buffer) >= capacity:
+            return buffer
+        new_capacity = max(capacity, 2 * len(buffer), 64)
+        new_buffer = np.zeros((new_capacity, buffer.shape[1]), dtype=np.float32)
+        new_buffer[:self._num_embedded] = buffer[:self._num_embedded]
+        self._embedding_buffer = new_buffer
+        return new_buffer
+    
+    def append_embeddings(self, vectors: np.ndarray):
+        """Append embeddings for the next rows (amortized O(1) per row)"""
+        end = self._num_embedded + len(vectors)
+        self._writable_embeddings(end)[self._num_embedded:end] = vectors
+        self._num_embedded = end
+    
+    def set_embeddings(self, rows: List[int], vectors: np.ndarray):
+        """Overwrite embeddings of existing rows"""
+        self._writable_embeddings(self._num_embedded)[rows] = vectors
+        self.stale_rows.difference_update(rows)
+    
+    def artifact_path(self, suffix: str) -> str:
+        """Path of a derived file next to the FAQ file, e.g. data/faq.<suffix>"""
+        base, _ = os.path.splitext(self.faq_file)
+        return f"{base}.{suffix}"
+    
+    def _embeddings_path(self, signature: str) -> str:
+        """Versioned .npy path next to the FAQ file, e.g. data/faq.hash-v1-d300.npy"""
+        return self.artifact_path(f"{signature}.npy")
+    
+    def questions_fingerprint(self, count: int = None) -> str:
+        """Hash of the first count (default: all) FAQ questions, to detect stale embeddings"""
+        digest = hashlib.sha256()
+        for faq in self.faqs[:count]:
+            question = faq['question']
+            digest.update(question.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def load_embeddings(self, signature: str) -> bool:
+        """
+        Load persisted FAQ embeddings (memory-mapped) if they match the current FAQs
+        A matrix covering only the first rows is accepted; the rest must be appended
+        Returns: True if self.embeddings was loaded from disk
+        """
+        path = self._embeddings_path(signature)
+        meta_path = path[:-len('.npy')] + '.json'
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            count = meta.get('count', -1)
+            if (not 0 <= count <= len(self.faqs) or
+                    meta.get('fingerprint') != self.questions_fingerprint(count)):
+                return False
+            self.embeddings = np.load(path, mmap_mode='r')
+            self.embedding_signature = signature
+        except (FileNotFoundError, ValueError, OSError):
+            return False
+        return True
+    
+    def save_embeddings(self, signature: str):
+        """Persist self.embeddings atomically, with a sidecar metadata file"""
+        if self.embeddings is None:
+            return
+        path = self._embeddings_path(signature)
+        meta_path = path[:-len('.npy')] + '.json'
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        
+        with _atomic_file(path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.embeddings, dtype=np.float32))
+        self.embedding_signature = signature
+        with _atomic_file(meta_path, 'w') as f:
+            json.dump({
+                'signature': signature,
+                'count': self._num_embedded,
+                'fingerprint': self.questions_fingerprint(self._num_embedded)
+            }, f)
+    
+    def save_embedding_rows(self, signature: str, rows):
+        """
+        Persist the embeddings of rows that were just (re)computed
+        No-op here: the matrix file is only rewritten by save_embeddings()
+        """
     
     def get_all_questions(self) -> List[str]:
         """Get all questions for embedding"""
@@ -96,21 +512,77 @@ class KnowledgeBase:
     
     def get_faq_by_id(self, faq_id: int) -> Optional[Dict]:
         """Get FAQ by ID"""
-        for faq in self.faqs:
-            if faq['id'] == faq_id:
-                return faq
-        return None
+        row = self._id_index.get(faq_id)
+        return None if row is None else self.faqs[row]
+    
+    def _cached_view(self, key, build):
+        """Return a derived view, rebuilding it only after the KB changed"""
+        if self._views_version != self.version:
+            self._views = {}
+            self._views_version = self.version
+        view = self._views.get(key)
+        if view is None:
+            view = self._views[key] = build()
+        return view
+    
+    @property
+    def next_id(self) -> int:
+        """Id the next added FAQ will get (ids are never reused)"""
+        return self._next_id
+    
+    @property
+    def verified_mask(self) -> np.ndarray:
+        """Boolean mask of verified rows, aligned with self.faqs and the embedding matrix"""
+        return self._verified_buffer[:len(self.faqs)]
     
     def get_verified_faqs(self) -> List[Dict]:
         """Get only verified FAQs (to avoid AI hallucination)"""
-        return [faq for faq in self.faqs if faq.get('verified', False)]
+        return self._cached_view('verified_faqs', lambda: [
+            faq for faq, verified in zip(self.faqs, self.verified_mask) if verified
+        ])
+    
+    def get_faqs_by_category(self, category: str) -> List[Dict]:
+        """Get FAQs of one category, in row order"""
+        return self._cached_view(('category', category), lambda: [
+            self.faqs[row] for row in sorted(
+                self._id_index[faq_id] for faq_id in self._category_ids.get(category, ())
+            )
+        ])
+    
+    def excluded_rows_mask(self, category: str = None, verified_only: bool = None) -> np.ndarray:
+        """
+        Boolean mask of rows retrieval must skip, cached until the KB changes
+        verified_only: True = verified rows only, False = all rows,
+                       None = verified rows, or all rows if none is verified
+        """
+        def build():
+            include = np.ones(len(self.faqs), dtype=bool)
+            if verified_only or (verified_only is None and self.verified_mask.any()):
+                include &= self.verified_mask
+            if category is not None:
+                in_category = np.zeros(len(self.faqs), dtype=bool)
+                in_category[[self._id_index[faq_id]
+                             for faq_id in self._category_ids.get(category, ())]] = True
+                include &= in_category
+            return ~include
+        return self._cached_view(('excluded', category, verified_only), build)
     
     def search_by_keyword(self, keyword: str) -> List[Dict]:
-        """Simple keyword search"""
+        """Simple keyword search: case-insensitive substring of question or answer"""
         keyword_lower = keyword.lower()
-        results = []
-        for faq in self.faqs:
-            if (keyword_lower in faq['question'].lower() or 
-                keyword_lower in faq['answer'].lower()):
-                results.append(faq)
-        return results
+        return [faq for faq in self.faqs
+                if keyword_lower in faq['question'].lower() or keyword_lower in faq['answer'].lower()]
+    
+    def search_ranked(self, query: str) -> List[Dict]:
+        """Full-text search: FAQs containing every query term (whole words), best BM25 score first"""
+        rows, _ = self.keyword_index.search(query, require_all=True)
+        return [self.faqs[row] for row in rows]
+
+
+def create_knowledge_base() -> KnowledgeBase:
+    """Create the knowledge base selected by Config.KB_BACKEND ('json' or 'sqlite')"""
+    if Config.KB_BACKEND == 'sqlite':
+        # Imported here because the SQLite backend subclasses KnowledgeBase
+        from sqlite_knowledge_base import SQLiteKnowledgeBase
+        return SQLiteKnowledgeBase(Config.KB_SQLITE_FILE)
+    return KnowledgeBase(Config.KB_FAQ_FILE)
@@ -0,0 +1,165 @@
+"""
+LLM Response Cache
+Content-addressed cache for chat completions with an in-memory LRU tier and
+an on-disk SQLite tier. Keys cover model, temperature, max_tokens, the
+canonical messages and the knowledge base version, so answers built on old
+FAQ content are never served after the KB changes.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from cache import LRUCache
+from config import Config
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    kb_version TEXT,
+    created REAL NOT NULL,
+    response TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_kb_version ON responses(kb_version);
+"""
+
+
+class LLMResponseCache:
+    def __init__(self, db_file: Optional[str] = None, max_size: int = None,
+                 ttl: Optional[float] = None):
+        self.ttl = ttl if ttl is not None else Config.LLM_CACHE_TTL
+        self.memory = LRUCache(max_size or Config.LLM_CACHE_SIZE, self.ttl)
+        self.db_file = db_file
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.kb_version: Optional[str] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_tokens = {'input': 0, 'output': 0}
+        
+        if self.db_file:
+            os.makedirs(os.path.dirname(self.db_file) or '.', exist_ok=True)
+            with self.conn:
+                self.conn.executescript(_SCHEMA)
+                if self.ttl:
+                    self.conn.execute("DELETE FROM responses WHERE created < ?",
+                                      (time.time() - self.ttl,))
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection for the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    @staticmethod
+    def make_key(payload: Dict, kb_version: Optional[str] = None) -> str:
+        """SHA-256 of the canonical JSON request payload plus the KB version"""
+        canonical = json.dumps(
+            {'payload': payload, 'kb_version': kb_version},
+            sort_keys=True, ensure_ascii=False, separators=(',', ':')
+        )
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def set_kb_version(self, kb_version: str):
+        """Drop entries built on other KB versions once the KB changes"""
+        if kb_version == self.kb_version:
+            return
+        with self._lock:
+            if kb_version == self.kb_version:
+                return
+            previous, self.kb_version = self.kb_version, kb_version
+            if previous is None:
+                return
+            self.memory.clear()
+        if self.db_file:
+            with self.conn:
+                self.conn.execute("DELETE FROM responses WHERE kb_version != ?", (kb_version,))
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Cached response for key, memory tier first"""
+        response = self.get_memory(key)
+        if response is None:
+            response = self.get_disk(key)
+        return response
+    
+    def get_memory(self, key: str) -> Optional[Dict]:
+        """Memory tier only (a miss here is not counted, get_disk() follows)"""
+        response = self.memory.get(key)
+        if response is not None:
+            self._record_hit(response, disk=False)
+        return response
+    
+    def get_disk(self, key: str) -> Optional[Dict]:
+        """SQLite tier only (blocking: call off the event loop); counts the miss"""
+        if self.db_file:
+            row = self.conn.execute(
+                "SELECT created, response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and (not self.ttl or row[0] >= time.time() - self.ttl):
+                response = json.loads(row[1])
+                self.memory.put(key, response)
+                self._record_hit(response, disk=True)
+                return response
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, key: str, response: Dict, kb_version: Optional[str] = None):
+        self.memory.put(key, response)
+        self.put_disk(key, response, kb_version)
+    
+    def put_disk(self, key: str, response: Dict, kb_version: Optional[str] = None):
+        """SQLite tier only (blocking: call off the event loop)"""
+        if self.db_file:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, kb_version, created, response) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, kb_version, time.time(), json.dumps(response, ensure_ascii=False))
+                )
+    
+    def _record_hit(self, response: Dict, disk: bool):
+        usage = response.get('usage') or {}
+        with self._lock:
+            if disk:
+                self.disk_hits += 1
+            else:
+                self.memory_hits += 1
+            self.saved_tokens['input'] += usage.get('prompt_tokens', 0)
+            self.saved_tokens['output'] += usage.get('completion_tokens', 0)
+    
+    def clear(self):
+        self.memory.clear()
+        if self.db_file:
+            with self.conn:
+                self.conn.execute("DELETE FROM responses")
+    
+    def stats(self) -> Dict:
+        """Counters for observability (same core keys as LRUCache.stats())"""
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        memory_stats = self.memory.stats()
+        return {
+            'size': memory_stats['size'],
+            'max_size': memory_stats['max_size'],
+            'hits': hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'evictions': memory_stats['evictions'],
+            'expirations': memory_stats['expirations'],
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'saved_tokens': dict(self.saved_tokens)
+        }
@@ -0,0 +1,412 @@
+"""
+LLM Transport Module
+Shared, pooled HTTP clients for all LLM calls (keep-alive, optional HTTP/2,
+connection limits and per-stage timeouts from Config), with retries, hedging
+and per-query latency budgets
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+import weakref
+from collections import deque
+import httpx
+from typing import AsyncIterator, Dict, Optional
+from config import Config
+from llm_cache import LLMResponseCache
+from prompt_builder import estimate_messages_tokens
+from query_context import current_query, span
+
+
+def _http2_available() -> bool:
+    """HTTP/2 in httpx needs the optional 'h2' package"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits, server errors
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class LLMDeadlineExceeded(Exception):
+    """The query's latency budget is used up"""
+
+
+class LatencyTracker:
+    """Recent request latencies of one stage, for hedging delays"""
+    
+    def __init__(self, window: int = 500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def percentile(self, pct: float, min_samples: int = 1) -> Optional[float]:
+        """Latency percentile in seconds, None until min_samples are recorded"""
+        with self._lock:
+            if len(self._samples) < max(min_samples, 1):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class LLMTransport:
+    """
+    Owns one httpx.Client (plus one httpx.AsyncClient per event loop) so that
+    connections and their TLS sessions are reused across queries and agents
+    """
+    
+    _shared: Optional['LLMTransport'] = None
+    _shared_lock = threading.Lock()
+    
+    def __init__(self, api_url: str = None, api_key: str = None,
+                 cache: Optional[LLMResponseCache] = None):
+        self.api_url = api_url or Config.LLM_API_URL
+        self.api_key = api_key or Config.LLM_API_KEY
+        self.cache = cache
+        self.http2 = Config.LLM_HTTP2 and _http2_available()
+        if Config.LLM_HTTP2 and not self.http2:
+            print("HTTP/2 requested but 'h2' is not installed, using HTTP/1.1")
+        
+        self._client: Optional[httpx.Client] = None
+        # Async connections are bound to the loop that opened them; each loop
+        # also gets a semaphore so excess requests wait here instead of in
+        # httpcore's pool queue, which is rescanned on every assignment
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.latency: Dict[str, LatencyTracker] = {}
+    
+    @classmethod
+    def shared(cls) -> 'LLMTransport':
+        """Process-wide transport used by default by all agents"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cache = None
+                if Config.LLM_CACHE_ENABLED:
+                    cache = LLMResponseCache(Config.LLM_CACHE_FILE)
+                cls._shared = cls(cache=cache)
+            return cls._shared
+    
+    def _client_options(self) -> Dict:
+        return {
+            'http2': self.http2,
+            'limits': httpx.Limits(
+                max_connections=Config.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.LLM_MAX_KEEPALIVE,
+                keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY
+            ),
+            # Static default only: the query budget is applied per request
+            'timeout': self.base_timeout(),
+            'headers': {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}"
+            }
+        }
+    
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(**self._client_options())
+        return self._client
+    
+    def _loop_state(self) -> tuple:
+        """(AsyncClient, Semaphore) for the running event loop"""
+        loop = asyncio.get_running_loop()
+        state = self._async_clients.get(loop)
+        if state is None:
+            state = (httpx.AsyncClient(**self._client_options()),
+                     asyncio.Semaphore(Config.LLM_MAX_CONNECTIONS))
+            self._async_clients[loop] = state
+        return state
+    
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """Async client for the running event loop"""
+        return self._loop_state()[0]
+    
+    @staticmethod
+    def _make_timeout(read: float) -> httpx.Timeout:
+        return httpx.Timeout(read, connect=min(Config.LLM_CONNECT_TIMEOUT, read),
+                             pool=min(Config.LLM_POOL_TIMEOUT, read))
+    
+    @classmethod
+    def base_timeout(cls, stage: str = None) -> httpx.Timeout:
+        """Configured timeout for a pipeline stage, independent of any query budget"""
+        return cls._make_timeout(Config.LLM_STAGE_TIMEOUTS.get(stage, Config.LLM_DEFAULT_TIMEOUT))
+    
+    @classmethod
+    def timeout(cls, stage: str = None) -> httpx.Timeout:
+        """
+        Timeout for a pipeline stage ('generate', 'validate', 'improve'),
+        shortened to the remaining budget of the current query
+        """
+        read = Config.LLM_STAGE_TIMEOUTS.get(stage, Config.LLM_DEFAULT_TIMEOUT)
+        context = current_query()
+        if context is not None:
+            remaining = context.remaining()
+            if remaining <= 0:
+                raise LLMDeadlineExceeded("latency budget used up")
+            read = min(read, remaining)
+        return cls._make_timeout(read)
+    
+    def _tracker(self, stage: str) -> LatencyTracker:
+        tracker = self.latency.get(stage)
+        if tracker is None:
+            tracker = self.latency.setdefault(stage, LatencyTracker())
+        return tracker
+    
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> Optional[float]:
+        """
+        Backoff before retry number attempt + 1 (exponential, full jitter)
+        Returns: None if the error is not retryable or no retry fits the budget
+        """
+        if attempt >= Config.LLM_MAX_RETRIES:
+            return None
+        retry_after = None
+        if isinstance(error, httpx.HTTPStatusError):
+            if error.response.status_code not in RETRYABLE_STATUS:
+                return None
+            try:
+                retry_after = float(error.response.headers.get('retry-after', ''))
+            except ValueError:
+                pass
+        elif not isinstance(error, httpx.TransportError):
+            return None
+        
+        delay = random.uniform(0, min(Config.LLM_RETRY_MAX_DELAY,
+                                      Config.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        context = current_query()
+        if context is not None:
+            if delay >= context.remaining():
+                return None
+            context.retries += 1
+        print(f"LLM call failed ({error.__class__.__name__}), retrying in {delay:.2f}s")
+        return delay
+    
+    def _payload(self, messages: list, temperature: float, max_tokens: int,
+                 model: str = None, json_mode: bool = False) -> Dict:
+        payload = {
+            "model": model or Config.LLM_MODEL,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        if json_mode and Config.LLM_JSON_MODE:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+    
+    @staticmethod
+    def _record(result: Dict, payload: Dict, stage: str = None) -> Dict:
+        """Count the round-trip against the current query, if any"""
+        context = current_query()
+        if context is not None:
+            context.record_llm_call(result.get('usage'), estimate_messages_tokens(payload['messages']),
+                                    payload.get('model'), stage)
+        return result
+    
+    def _cached(self, payload: Dict) -> tuple:
+        """
+        Look the request up in the response cache
+        Returns: (cache_key or None if caching is off, cached response or None)
+        """
+        if self.cache is None:
+            return None, None
+        kb_version = self._cache_kb_version()
+        if kb_version is not None:
+            self.cache.set_kb_version(kb_version)
+        key = self.cache.make_key(payload, kb_version)
+        return key, self._cache_hit(self.cache.get(key))
+    
+    async def _acached(self, payload: Dict) -> tuple:
+        """_cached() for the event loop: the SQLite tier is read on a worker thread"""
+        if self.cache is None:
+            return None, None
+        kb_version = self._cache_kb_version()
+        if kb_version is not None and kb_version != self.cache.kb_version:
+            # Drops the entries of the old KB version from disk
+            await asyncio.to_thread(self.cache.set_kb_version, kb_version)
+        key = self.cache.make_key(payload, kb_version)
+        response = self.cache.get_memory(key)
+        if response is None:
+            response = await asyncio.to_thread(self.cache.get_disk, key)
+        return key, self._cache_hit(response)
+    
+    @staticmethod
+    def _cache_kb_version() -> Optional[str]:
+        context = current_query()
+        return context.kb_version if context is not None else None
+    
+    @staticmethod
+    def _cache_hit(response: Optional[Dict]) -> Optional[Dict]:
+        if response is None:
+            return None
+        context = current_query()
+        if context is not None:
+            context.cache_hits += 1
+        return dict(response, cached=True)
+    
+    def _store(self, key: Optional[str], payload: Dict, result: Dict, stage: str = None) -> Dict:
+        if key is not None:
+            self.cache.put(key, result, self._cache_kb_version())
+        return self._record(result, payload, stage)
+    
+    async def _astore(self, key: Optional[str], payload: Dict, result: Dict, stage: str = None) -> Dict:
+        """_store() for the event loop: the SQLite tier is written on a worker thread"""
+        if key is not None:
+            kb_version = self._cache_kb_version()
+            self.cache.memory.put(key, result)
+            await asyncio.to_thread(self.cache.put_disk, key, result, kb_version)
+        return self._record(result, payload, stage)
+    
+    def chat(self, messages: list, temperature: float, max_tokens: int,
+             stage: str = None, model: str = None, json_mode: bool = False) -> Dict:
+        """
+        POST a chat completion request on the pooled client (or serve it from the cache)
+        Returns: parsed JSON response, with 'cached': True if no request was made
+        (raises on HTTP errors)
+        """
+        payload = self._payload(messages, temperature, max_tokens, model, json_mode)
+        key, cached = self._cached(payload)
+        if cached is not None:
+            return cached
+        
+        attempt = 0
+        while True:
+            try:
+                started = time.perf_counter()
+                with span(f"llm.{stage or 'default'}"):
+                    response = self.client.post(self.api_url, json=payload, timeout=self.timeout(stage))
+                response.raise_for_status()
+                self._tracker(stage).add(time.perf_counter() - started)
+                return self._store(key, payload, response.json(), stage)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+    
+    async def achat(self, messages: list, temperature: float, max_tokens: int,
+                    stage: str = None, model: str = None, json_mode: bool = False) -> Dict:
+        """Async version of chat(); optionally hedged (see LLM_HEDGING)"""
+        payload = self._payload(messages, temperature, max_tokens, model, json_mode)
+        key, cached = await self._acached(payload)
+        if cached is not None:
+            return cached
+        
+        attempt = 0
+        while True:
+            try:
+                if Config.LLM_HEDGING:
+                    result = await self._hedged_post(payload, stage)
+                else:
+                    result = await self._post_async(payload, stage)
+                return await self._astore(key, payload, result, stage)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+    
+    async def _post_async(self, payload: Dict, stage: str) -> Dict:
+        client, slots = self._loop_state()
+        timeout = self.timeout(stage)
+        started = time.perf_counter()
+        try:
+            # httpx timeouts apply per network operation; cap the whole request
+            async with slots:
+                with span(f"llm.{stage or 'default'}"):
+                    response = await asyncio.wait_for(
+                        client.post(self.api_url, json=payload, timeout=timeout), timeout.read
+                    )
+        except asyncio.TimeoutError:
+            raise httpx.ReadTimeout(f"LLM request exceeded {timeout.read:.1f}s")
+        response.raise_for_status()
+        self._tracker(stage).add(time.perf_counter() - started)
+        return response.json()
+    
+    async def _hedged_post(self, payload: Dict, stage: str) -> Dict:
+        """
+        Send the request; if it is still running after the stage's p95 latency,
+        send a duplicate and take whichever succeeds first
+        """
+        hedge_after = self._tracker(stage).percentile(
+            Config.LLM_HEDGE_PERCENTILE, Config.LLM_HEDGE_MIN_SAMPLES
+        )
+        first = asyncio.ensure_future(self._post_async(payload, stage))
+        if hedge_after is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+        
+        context = current_query()
+        if context is not None:
+            context.hedges += 1
+        pending = {first, asyncio.ensure_future(self._post_async(payload, stage))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def stream_chat(self, messages: list, temperature: float, max_tokens: int,
+                          stage: str = None, model: str = None) -> AsyncIterator[Dict]:
+        """
+        Streamed chat completion (SSE, stream: true)
+        Yields: parsed chunks; with LLM_STREAM_USAGE the last one carries 'usage'
+        """
+        payload = self._payload(messages, temperature, max_tokens, model)
+        payload["stream"] = True
+        if Config.LLM_STREAM_USAGE:
+            payload["stream_options"] = {"include_usage": True}
+        
+        client, slots = self._loop_state()
+        usage = None
+        async with slots:
+            async with client.stream("POST", self.api_url, json=payload,
+                                     timeout=self.timeout(stage)) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get('usage') or usage
+                    yield chunk
+        self._record({'usage': usage}, payload, stage)
+    
+    def close(self):
+        """Close the sync client (async clients are closed by aclose())"""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+    
+    async def aclose(self):
+        """Close the async client of the running event loop"""
+        state = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].aclose()
@@ -0,0 +1,519 @@
+"""
+Log Analytics
+Stream the Observer's JSONL logs (including rotated and gzipped files) in
+constant memory: per-event-type and per-intent aggregates, LLM cost per
+intent and pipeline stage, latency/token/cost percentiles and the most
+frequent queries
+
+Usage:
+    python log_analytics.py                       # logs/agent.log and its rotated files
+    python log_analytics.py --since 7d            # last week only
+    python log_analytics.py logs/*.log* --workers 4 --json
+"""
+
+import argparse
+import glob
+import gzip
+import heapq
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from metrics import LatencyHistogram
+
+try:
+    import orjson  # Optional: several times faster JSON decoding
+except ImportError:
+    orjson = None
+
+
+READ_CHUNK = 1 << 20  # Bytes per read
+TOKEN_BUCKETS = (50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000, 20000, 50000)
+COST_BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+PERCENTILES = (50, 95, 99)
+
+_TIMESTAMP_PREFIX = b'{"timestamp": "'
+_EVENT_TYPE_PREFIX = b'", "event_type": "'
+# Event types whose data is aggregated; the rest are only counted, without
+# decoding the JSON
+PARSED_EVENTS = frozenset({'query_completed', 'intent_classification', 'response', 'safety_check'})
+_decode = json.JSONDecoder().decode
+
+
+def _loads(line: bytes):
+    if orjson is not None:
+        return orjson.loads(line)
+    return _decode(line.decode('utf-8'))
+
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class SpaceSaving:
+    """
+    Approximate top-k counter (Space-Saving): keeps at most `capacity`
+    items; an item's count may be overestimated by at most its 'error'
+    """
+    
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []  # Lazy min-heap; entries may be stale
+    
+    def add(self, item: str):
+        if item in self.counts:
+            self.counts[item] += 1
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = 1
+            self.errors[item] = 0
+            heapq.heappush(self._heap, (1, item))
+            return
+        
+        # Replace the item with the smallest count
+        while True:
+            count, victim = heapq.heappop(self._heap)
+            if self.counts[victim] == count:
+                break
+            heapq.heappush(self._heap, (self.counts[victim], victim))
+        del self.counts[victim], self.errors[victim]
+        self.counts[item] = count + 1
+        self.errors[item] = count
+        heapq.heappush(self._heap, (count + 1, item))
+    
+    def merge(self, other: 'SpaceSaving'):
+        """Combine two summaries (counts add up; the top `capacity` are kept)"""
+        counts = dict(self.counts)
+        errors = dict(self.errors)
+        for item, count in other.counts.items():
+            counts[item] = counts.get(item, 0) + count
+            errors[item] = errors.get(item, 0) + other.errors[item]
+        top = heapq.nlargest(self.capacity, counts.items(), key=lambda pair: pair[1])
+        self.counts = dict(top)
+        self.errors = {item: errors[item] for item in self.counts}
+        self._heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
+    
+    def top(self, n: int) -> List[Tuple[str, int, int]]:
+        """Most frequent items as (item, count, max overestimate)"""
+        top = heapq.nlargest(n, self.counts.items(), key=lambda pair: pair[1])
+        return [(item, count, self.errors[item]) for item, count in top]
+
+
+def _usage_totals() -> Dict:
+    return {'calls': 0, 'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0}
+
+
+class LogStats:
+    """Constant-memory aggregates over Observer log events (mergeable across processes)"""
+    
+    def __init__(self, since: str = None, until: str = None, top_capacity: int = 1000,
+                 input_cost: float = None, output_cost: float = None):
+        self.since = since
+        self.until = until
+        self.input_cost = Config.COST_PER_1K_INPUT_TOKENS if input_cost is None else input_cost
+        self.output_cost = Config.COST_PER_1K_OUTPUT_TOKENS if output_cost is None else output_cost
+        
+        self.lines = 0
+        self.bad_lines = 0
+        self.skipped = 0  # Outside the time window
+        self.bytes = 0
+        self.first_timestamp: Optional[str] = None
+        self.last_timestamp: Optional[str] = None
+        self._current_timestamp: Optional[str] = None  # Of the last timestamped line read
+        self.event_counts: Dict[str, int] = {}
+        self.intents: Dict[str, Dict] = {}
+        self.models: Dict[str, Dict] = {}
+        self.modes: Dict[str, int] = {}
+        self.latency: Dict[str, LatencyHistogram] = {}  # 'query' end-to-end, then per stage
+        self.query_tokens = LatencyHistogram(TOKEN_BUCKETS, thread_safe=False)
+        self.query_cost = LatencyHistogram(COST_BUCKETS, thread_safe=False)
+        self.validation = {'responses': 0, 'passed': 0}
+        self.safety = {'blocked_inputs': 0, 'output_checks': 0, 'filtered_outputs': 0}
+        self.top_queries = SpaceSaving(top_capacity)
+    
+    def _cost(self, input_tokens: int, output_tokens: int) -> float:
+        return input_tokens / 1000 * self.input_cost + output_tokens / 1000 * self.output_cost
+    
+    def _intent(self, intent: Optional[str]) -> Dict:
+        stats = self.intents.get(intent)
+        if stats is None:
+            stats = self.intents[intent] = {
+                'classified': 0, 'queries': 0, 'cost': 0.0,
+                'input_tokens': 0, 'output_tokens': 0, 'stages': {}
+            }
+        return stats
+    
+    def _outside_window(self, timestamp: Optional[str]) -> bool:
+        if timestamp is None:
+            return False
+        return bool((self.since and timestamp < self.since) or (self.until and timestamp >= self.until))
+    
+    def _observe(self, name: str, value_ms: float):
+        histogram = self.latency.get(name)
+        if histogram is None:
+            histogram = self.latency[name] = LatencyHistogram(thread_safe=False)
+        histogram.observe(value_ms)
+    
+    def add_line(self, line: bytes):
+        line = line.strip()
+        if not line:
+            return
+        self.lines += 1
+        self.bytes += len(line) + 1
+        
+        # Observer lines start with the timestamp and event type: read them
+        # from the raw bytes (ISO timestamps compare as strings)
+        if line.startswith(_TIMESTAMP_PREFIX):
+            end = line.find(b'"', len(_TIMESTAMP_PREFIX))
+            timestamp = self._current_timestamp = line[len(_TIMESTAMP_PREFIX):end].decode('ascii', 'replace')
+            if self._outside_window(timestamp):
+                self.skipped += 1
+                return
+            if line.startswith(_EVENT_TYPE_PREFIX, end):
+                type_start = end + len(_EVENT_TYPE_PREFIX)
+                event_type = line[type_start:line.find(b'"', type_start)].decode('utf-8', 'replace')
+                if event_type not in PARSED_EVENTS:
+                    self.add_event(timestamp, event_type, None)
+                    return
+        
+        try:
+            entry = _loads(line)
+            timestamp = str(entry['timestamp'])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            # Continuation or foreign line: it belongs to the last timestamped line
+            if self._outside_window(self._current_timestamp):
+                self.skipped += 1
+            else:
+                self.bad_lines += 1
+            return
+        if not line.startswith(_TIMESTAMP_PREFIX):
+            self._current_timestamp = timestamp
+            if self._outside_window(timestamp):
+                self.skipped += 1
+                return
+        try:
+            self.add_event(timestamp, entry['event_type'], entry.get('data') or {})
+        except (KeyError, TypeError, AttributeError):
+            self.bad_lines += 1
+    
+    def add_event(self, timestamp: str, event_type: str, data: Optional[Dict]):
+        if self.first_timestamp is None or timestamp < self.first_timestamp:
+            self.first_timestamp = timestamp
+        if self.last_timestamp is None or timestamp > self.last_timestamp:
+            self.last_timestamp = timestamp
+        self.event_counts[event_type] = self.event_counts.get(event_type, 0) + 1
+        
+        if event_type == 'query_completed':
+            self._add_query(data)
+        elif event_type == 'intent_classification':
+            self._intent(data.get('intent') or 'unknown')['classified'] += 1
+            query = data.get('query')
+            if query:
+                self.top_queries.add(_WHITESPACE.sub(' ', str(query).strip().lower())[:200])
+        elif event_type == 'response':
+            self.validation['responses'] += 1
+            self.validation['passed'] += bool(data.get('validation_passed'))
+        elif event_type == 'safety_check':
+            if not data.get('input_safe', True):
+                self.safety['blocked_inputs'] += 1
+            else:
+                self.safety['output_checks'] += 1
+                self.safety['filtered_outputs'] += bool(data.get('output_filtered'))
+    
+    def _add_query(self, data: Dict):
+        mode = data.get('mode') or 'unknown'
+        self.modes[mode] = self.modes.get(mode, 0) + 1
+        if 'latency_ms' in data:
+            self._observe('query', data['latency_ms'])
+        for span in data.get('spans') or ():
+            self._observe(span['name'], span['duration_ms'])
+        
+        tokens = data.get('tokens') or {}
+        input_tokens, output_tokens = tokens.get('input', 0), tokens.get('output', 0)
+        cost = self._cost(input_tokens, output_tokens)
+        self.query_tokens.observe(input_tokens + output_tokens)
+        self.query_cost.observe(cost)
+        
+        intent = self._intent(data.get('intent') or 'unknown')
+        intent['queries'] += 1
+        intent['input_tokens'] += input_tokens
+        intent['output_tokens'] += output_tokens
+        intent['cost'] += cost
+        for stage, usage in (data.get('stage_usage') or {}).items():
+            totals = intent['stages'].get(stage)
+            if totals is None:
+                totals = intent['stages'][stage] = _usage_totals()
+            self._add_usage(totals, usage)
+        for model, usage in (data.get('model_usage') or {}).items():
+            totals = self.models.get(model)
+            if totals is None:
+                totals = self.models[model] = _usage_totals()
+            self._add_usage(totals, usage)
+    
+    def _add_usage(self, totals: Dict, usage: Dict):
+        totals['calls'] += usage.get('calls', 0)
+        totals['input_tokens'] += usage.get('input', 0)
+        totals['output_tokens'] += usage.get('output', 0)
+        totals['cost'] += self._cost(usage.get('input', 0), usage.get('output', 0))
+    
+    def merge(self, other: 'LogStats'):
+        for name in ('lines', 'bad_lines', 'skipped', 'bytes'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for timestamp in (other.first_timestamp, other.last_timestamp):
+            if timestamp is not None:
+                self.first_timestamp = min(self.first_timestamp or timestamp, timestamp)
+                self.last_timestamp = max(self.last_timestamp or timestamp, timestamp)
+        _add_counts(self.event_counts, other.event_counts)
+        _add_counts(self.modes, other.modes)
+        _add_counts(self.validation, other.validation)
+        _add_counts(self.safety, other.safety)
+        for intent, stats in other.intents.items():
+            mine = self._intent(intent)
+            for stage, usage in stats['stages'].items():
+                _add_counts(mine['stages'].setdefault(stage, _usage_totals()), usage)
+            _add_counts(mine, {key: value for key, value in stats.items() if key != 'stages'})
+        for model, usage in other.models.items():
+            _add_counts(self.models.setdefault(model, _usage_totals()), usage)
+        for name, histogram in other.latency.items():
+            self.latency.setdefault(name, LatencyHistogram(thread_safe=False)).merge(histogram)
+        self.query_tokens.merge(other.query_tokens)
+        self.query_cost.merge(other.query_cost)
+        self.top_queries.merge(other.top_queries)
+    
+    def report(self, top: int = 10) -> Dict:
+        def percentiles(histogram: LatencyHistogram, digits: int) -> Dict:
+            return {f"p{pct}": _round(histogram.percentile(pct), digits) for pct in PERCENTILES}
+        
+        def usage(totals: Dict) -> Dict:
+            return dict(totals, cost=round(totals['cost'], 6))
+        
+        return {
+            'lines': self.lines,
+            'bad_lines': self.bad_lines,
+            'skipped_outside_window': self.skipped,
+            'first_timestamp': self.first_timestamp,
+            'last_timestamp': self.last_timestamp,
+            'event_counts': dict(sorted(self.event_counts.items(), key=lambda pair: -pair[1])),
+            'queries_by_mode': self.modes,
+            'total_cost': round(sum(stats['cost'] for stats in self.intents.values()), 6),
+            'intents': {
+                intent: {
+                    'classified': stats['classified'],
+                    'queries': stats['queries'],
+                    'input_tokens': stats['input_tokens'],
+                    'output_tokens': stats['output_tokens'],
+                    'cost': round(stats['cost'], 6),
+                    'stages': {stage: usage(totals) for stage, totals in stats['stages'].items()}
+                }
+                for intent, stats in sorted(self.intents.items(), key=lambda pair: -pair[1]['cost'])
+            },
+            'models': {model: usage(totals) for model, totals in self.models.items()},
+            'latency_ms': {name: dict(percentiles(histogram, 1), count=histogram.count)
+                           for name, histogram in self.latency.items()},
+            'tokens_per_query': percentiles(self.query_tokens, 0),
+            'cost_per_query': percentiles(self.query_cost, 6),
+            'validation': dict(self.validation, pass_rate=_rate(
+                self.validation['passed'], self.validation['responses'])),
+            'safety': dict(self.safety, filter_rate=_rate(
+                self.safety['filtered_outputs'], self.safety['output_checks'])),
+            'top_queries': [{'query': query, 'count': count, 'max_error': error}
+                            for query, count, error in self.top_queries.top(top)]
+        }
+
+
+def _add_counts(target: Dict, source: Dict):
+    for key, value in source.items():
+        target[key] = target.get(key, 0) + value
+
+
+def _round(value: Optional[float], digits: int) -> Optional[float]:
+    return round(value, digits) if value is not None else None
+
+
+def _rate(count: int, total: int) -> Optional[float]:
+    return round(count / total, 4) if total else None
+
+
+def iter_lines(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Stream the lines of a log file in READ_CHUNK reads (gzip if it ends in .gz)
+    With a byte range, yields exactly the lines that start in [start, end)
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        if start:
+            # The line running into `start` belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        pending = b''
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                if pending and (end is None or position < end):
+                    yield pending
+                return
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                if end is not None and position >= end:
+                    return
+                yield line
+                position += len(line) + 1
+
+
+def log_files(path: str) -> List[str]:
+    """A log file followed by its rotated backups (path.1[.gz], path.2[.gz], ...)"""
+    def index(name: str) -> int:
+        suffix = name[len(path) + 1:].split('.')[0]
+        return int(suffix) if suffix.isdigit() else -1
+
+    rotated = [name for name in glob.glob(glob.escape(path) + '.*') if index(name) >= 0]
+    files = [path] if os.path.exists(path) else []
+    return files + sorted(rotated, key=index)
+
+
+def plan_tasks(files: List[str], split_bytes: int) -> List[Tuple[str, int, Optional[int]]]:
+    """
+    Split large uncompressed files into byte ranges (gzip streams cannot be split)
+    split_bytes <= 0 keeps every file whole
+    """
+    tasks = []
+    for path in files:
+        size = os.path.getsize(path)
+        if path.endswith('.gz') or split_bytes <= 0 or size <= split_bytes:
+            tasks.append((path, 0, None))
+            continue
+        for start in range(0, size, split_bytes):
+            tasks.append((path, start, min(start + split_bytes, size)))
+    return tasks
+
+
+def analyze_range(task: Tuple[str, int, Optional[int]], options: Dict) -> LogStats:
+    path, start, end = task
+    stats = LogStats(**options)
+    for line in iter_lines(path, start, end):
+        stats.add_line(line)
+    return stats
+
+
+def _analyze_task(args) -> LogStats:
+    return analyze_range(*args)
+
+
+def analyze(files: List[str], workers: int = 1, split_bytes: int = 256 << 20, **options) -> LogStats:
+    """Aggregate the given log files, optionally across worker processes"""
+    tasks = plan_tasks(files, split_bytes)
+    total = LogStats(**options)
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            total.merge(analyze_range(task, options))
+        return total
+
+    with Pool(min(workers, len(tasks))) as pool:
+        for stats in pool.imap_unordered(_analyze_task, [(task, options) for task in tasks]):
+            total.merge(stats)
+    return total
+
+
+def parse_time(value: Optional[str]) -> Optional[str]:
+    """'7d', '12h', '30m' (relative to now) or an ISO date/time -> ISO string"""
+    if not value:
+        return None
+    match = re.fullmatch(r'(\d+)([dhm])', value)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        delta = {'d': timedelta(days=amount), 'h': timedelta(hours=amount),
+                 'm': timedelta(minutes=amount)}[unit]
+        return (datetime.now() - delta).isoformat()
+    return datetime.fromisoformat(value).isoformat()
+
+
+def print_report(report: Dict, files: List[str], elapsed: float, total_bytes: int):
+    print("\n" + "="*50)
+    print("LOG ANALYTICS")
+    print("="*50)
+    print(f"Files: {len(files)}, {report['lines']} lines ({report['bad_lines']} unreadable, "
+          f"{report['skipped_outside_window']} outside the time window)")
+    print(f"Period: {report['first_timestamp']} .. {report['last_timestamp']}")
+    mb = total_bytes / 2**20
+    print(f"Read {mb:.1f} MB in {elapsed:.2f}s ({mb / elapsed if elapsed > 0 else 0:.0f} MB/s)")
+
+    print("\nEvents:")
+    for event_type, count in report['event_counts'].items():
+        print(f"  {event_type:<24} {count}")
+
+    print(f"\nCost: ${report['total_cost']:.4f}")
+    for intent, stats in report['intents'].items():
+        print(f"  [{intent}] {stats['queries']} queries, {stats['input_tokens']} input / "
+              f"{stats['output_tokens']} output tokens, ${stats['cost']:.4f}")
+        for stage, usage in stats['stages'].items():
+            print(f"      {stage:<12} {usage['calls']} calls, ${usage['cost']:.4f}")
+    for model, usage in report['models'].items():
+        print(f"  model {model}: {usage['calls']} calls, ${usage['cost']:.4f}")
+
+    tokens, cost = report['tokens_per_query'], report['cost_per_query']
+    if tokens['p50'] is not None:
+        print(f"\nPer query (p50 / p95 / p99): {tokens['p50']:.0f} / {tokens['p95']:.0f} / "
+              f"{tokens['p99']:.0f} tokens, ${cost['p50']:.5f} / ${cost['p95']:.5f} / ${cost['p99']:.5f}")
+    if report['latency_ms']:
+        print("\nLatency ms (p50 / p95 / p99):")
+        for name, stats in report['latency_ms'].items():
+            print(f"  {name:<16} {stats['p50']:>9.1f} {stats['p95']:>9.1f} {stats['p99']:>9.1f}  ({stats['count']})")
+
+    validation, safety = report['validation'], report['safety']
+    if validation['pass_rate'] is not None:
+        print(f"\nValidation pass rate: {validation['pass_rate']:.1%} of {validation['responses']}")
+    if safety['filter_rate'] is not None:
+        print(f"Output filter rate: {safety['filter_rate']:.1%}, {safety['blocked_inputs']} inputs blocked")
+
+    if report['top_queries']:
+        print("\nTop queries:")
+        for entry in report['top_queries']:
+            print(f"  {entry['count']:>8}  {entry['query']}")
+    print("="*50 + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate the agent's JSONL logs")
+    parser.add_argument('files', nargs='*',
+                        help="Log files (default: Config.LOG_FILE and its rotated files)")
+    parser.add_argument('--since', help="Only events at/after this time: ISO date/time or 7d, 12h, 30m")
+    parser.add_argument('--until', help="Only events before this time")
+    parser.add_argument('--workers', type=int, default=1, help="Processes for many or large files")
+    parser.add_argument('--split-mb', type=int, default=256,
+                        help="Split uncompressed files into ranges of this size across workers (0: don't split)")
+    parser.add_argument('--top', type=int, default=10, help="Most frequent queries to show")
+    parser.add_argument('--top-capacity', type=int, default=1000,
+                        help="Distinct queries tracked for the top list (memory bound)")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    files = args.files or log_files(Config.LOG_FILE)
+    if not files:
+        print(f"No log files found at {Config.LOG_FILE}", file=sys.stderr)
+        sys.exit(1)
+
+    start = time.perf_counter()
+    stats = analyze(files, workers=args.workers, split_bytes=args.split_mb << 20,
+                    since=parse_time(args.since), until=parse_time(args.until),
+                    top_capacity=args.top_capacity)
+    elapsed = time.perf_counter() - start
+    report = stats.report(args.top)
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report, files, elapsed, stats.bytes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Background Log Writer
+Queue-backed writer thread for the Observer's JSON-lines log: request threads
+only enqueue a line; the writer keeps the file open, writes in batches,
+rotates by size (optionally gzipping rotated files) and flushes on shutdown
+"""
+
+import atexit
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import Config
+
+
+_STOP = object()
+
+
+class BackgroundLogWriter:
+    def __init__(self, path: str, batch_size: int = None, flush_interval: float = None,
+                 queue_size: int = None, full_policy: str = None,
+                 max_bytes: Optional[int] = None, backup_count: int = None,
+                 compress: bool = None):
+        self.path = path
+        self.batch_size = batch_size or Config.LOG_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.LOG_FLUSH_INTERVAL
+        self.full_policy = full_policy or Config.LOG_QUEUE_FULL_POLICY
+        if self.full_policy not in ('drop', 'block'):
+            raise ValueError(f"Unknown log queue policy: {self.full_policy}")
+        self.max_bytes = max_bytes if max_bytes is not None else Config.LOG_MAX_BYTES  # 0 = never rotate
+        self.backup_count = backup_count if backup_count is not None else Config.LOG_BACKUP_COUNT
+        self.compress = compress if compress is not None else Config.LOG_COMPRESS_ROTATED
+        
+        self._queue: queue.Queue = queue.Queue(queue_size or Config.LOG_QUEUE_SIZE)
+        self._file = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+        self.errors = 0
+        
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        # Daemon threads die with the interpreter: make sure queued lines get out
+        atexit.register(self.close)
+    
+    def write(self, line: str):
+        """Queue one log line (without the trailing newline)"""
+        # Under the lock, so no line can be queued behind close()'s stop marker
+        with self._lock:
+            if self._closed:
+                self.dropped += 1
+                return
+            try:
+                if self.full_policy == 'block':
+                    # Backpressure: slow the caller down, but never hang it
+                    self._queue.put(line, timeout=Config.LOG_BLOCK_TIMEOUT)
+                else:
+                    self._queue.put_nowait(line)
+            except queue.Full:
+                self.dropped += 1
+    
+    def _run(self):
+        batch: List[str] = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                # Drain whatever is already queued without waiting
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        self._flush(batch)
+                        return
+                    batch.append(item)
+            
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+    
+    def _flush(self, batch: List[str]):
+        if not batch:
+            return
+        try:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write('\n'.join(batch) + '\n')
+            self._file.flush()
+            self.written += len(batch)
+            self.batches += 1
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            self.errors += 1
+            print(f"Warning: Could not write to log file: {e}")
+    
+    def _backup_name(self, index: int) -> str:
+        return f"{self.path}.{index}" + (".gz" if self.compress else "")
+    
+    def _rotate(self):
+        """agent.log -> agent.log.1[.gz], shifting older backups up to backup_count"""
+        self._file.close()
+        self._file = None
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            self.rotations += 1
+            return
+        
+        for index in range(self.backup_count - 1, 0, -1):
+            source = self._backup_name(index)
+            if os.path.exists(source):
+                os.replace(source, self._backup_name(index + 1))
+        if self.compress:
+            tmp_path = self._backup_name(1) + ".tmp"
+            with open(self.path, 'rb') as source, gzip.open(tmp_path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.replace(tmp_path, self._backup_name(1))
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self._backup_name(1))
+        self.rotations += 1
+    
+    def close(self, timeout: float = 10.0):
+        """Flush everything queued so far and stop the writer thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        # Writes after this point are rejected, so the stop marker is queued
+        # last; it must get in even if the queue is full
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        atexit.unregister(self.close)
+    
+    def stats(self) -> Dict:
+        return {
+            'written': self.written,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize(),
+            'batches': self.batches,
+            'rotations': self.rotations,
+            'errors': self.errors
+        }
@@ -5,6 +5,7 @@ Run this to test the Customer Service Agent
 
 import os
 from agent import CustomerServiceAgent
+from config import Config
 
 
 def print_response(result: dict):
@@ -67,12 +68,28 @@ def demo_mode():
     ]
     
     for query in demo_queries:
-        result = agent.process_query(query)
+        result = agent.process_query("demo", query)
         print_response(result)
         input("Press Enter to continue...")
     
     # Print session summary
     agent.print_session_summary()
+    agent.close()
+
+
+def stream_answer(agent: CustomerServiceAgent, session_id: str, query: str) -> dict:
+    """Print the answer as it is generated; returns the final result"""
+    print("\nAgent: ", end="", flush=True)
+    result = {}
+    for event in agent.stream_query(session_id, query):
+        if event['type'] == 'token':
+            print(event['text'], end="", flush=True)
+        elif event['type'] == 'revision':
+            print(f"\n\n[Revised answer]\n{event['text']}", end="")
+        else:
+            result = event['result']
+    print()
+    return result
 
 
 def interactive_mode():
@@ -84,6 +101,7 @@ def interactive_mode():
     print("  'quit' or 'exit' - Exit the program")
     print("  'reset' - Reset conversation history")
     print("  'summary' - Show session summary")
+    print("  'profile <question>' - Answer with profiling on (output in profiles/)")
     print("="*60 + "\n")
     
     # Create sample data
@@ -91,6 +109,7 @@ def interactive_mode():
     
     # Initialize agent
     agent = CustomerServiceAgent()
+    session_id = "cli"
     
     while True:
         try:
@@ -102,19 +121,26 @@ def interactive_mode():
             if query.lower() in ['quit', 'exit']:
                 print("\nThank you for using Customer Service Agent!")
                 agent.print_session_summary()
+                agent.close()
                 break
             
             if query.lower() == 'reset':
-                agent.reset_conversation()
+                agent.reset_conversation(session_id)
                 continue
             
             if query.lower() == 'summary':
                 agent.print_session_summary()
                 continue
             
+            if query.lower().startswith('profile '):
+                result = agent.process_query(session_id, query[len('profile '):].strip(), profile=True)
+                print(f"\nAgent: {result['answer']}")
             # Process query
-            result = agent.process_query(query)
-            print(f"\nAgent: {result['answer']}")
+            elif Config.STREAM_RESPONSES:
+                result = stream_answer(agent, session_id, query)
+            else:
+                result = agent.process_query(session_id, query)
+                print(f"\nAgent: {result['answer']}")
             
             if result.get('sources'):
                 print(f"\n[Sources: {', '.join(result['sources'])}]")
@@ -122,6 +148,7 @@ def interactive_mode():
         except KeyboardInterrupt:
             print("\n\nInterrupted by user.")
             agent.print_session_summary()
+            agent.close()
             break
         except Exception as e:
             print(f"\nError: {e}")
@@ -135,7 +162,6 @@ def main():
     print("="*60)
     
     # Check if API key is configured
-    from config import Config
     if Config.LLM_API_KEY == "your-api-key-here":
         print("\n⚠️  WARNING: Please configure your LLM API key in config.py")
         print("   Set Config.LLM_API_KEY to your actual API key")
@@ -0,0 +1,195 @@
+"""
+Metrics Module
+Fixed-bucket latency histograms and Prometheus text exposition
+(written to a file or served over HTTP)
+"""
+
+import bisect
+import contextlib
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# Upper bounds in milliseconds; the last bucket is +Inf
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000,
+                      2500, 5000, 10000, 30000, 60000)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS_MS, thread_safe: bool = True):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.thread_safe = thread_safe
+        self._lock = self._new_lock()
+    
+    def _new_lock(self):
+        return threading.Lock() if self.thread_safe else contextlib.nullcontext()
+    
+    def observe(self, value_ms: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+            self.count += 1
+            self.sum_ms += value_ms
+            self.max_ms = max(self.max_ms, value_ms)
+    
+    def merge(self, other: 'LatencyHistogram'):
+        """Add another histogram with the same buckets into this one"""
+        if other.buckets != self.buckets:
+            raise ValueError("Cannot merge histograms with different buckets")
+        counts, count, sum_ms, max_ms = other.snapshot()
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += count
+            self.sum_ms += sum_ms
+            self.max_ms = max(self.max_ms, max_ms)
+    
+    def __getstate__(self):
+        # Picklable (for multiprocessing) without the lock
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = self._new_lock()
+    
+    def snapshot(self) -> Tuple[List[int], int, float, float]:
+        """Consistent copy of (bucket counts, count, sum_ms, max_ms)"""
+        with self._lock:
+            return list(self.counts), self.count, self.sum_ms, self.max_ms
+    
+    def percentile(self, pct: float) -> Optional[float]:
+        """Estimated percentile in ms (linear within the bucket it falls in)"""
+        counts, count, _, max_ms = self.snapshot()
+        if not count:
+            return None
+        rank = pct / 100 * count
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else max_ms
+                upper = min(upper, max_ms)
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return max_ms
+    
+    def summary(self) -> Dict:
+        _, count, sum_ms, max_ms = self.snapshot()
+        return {
+            'count': count,
+            'avg_ms': round(sum_ms / count, 2) if count else None,
+            'p50_ms': self._rounded(50),
+            'p95_ms': self._rounded(95),
+            'p99_ms': self._rounded(99),
+            'max_ms': round(max_ms, 2)
+        }
+    
+    def _rounded(self, pct: float) -> Optional[float]:
+        value = self.percentile(pct)
+        return round(value, 2) if value is not None else None
+
+
+def _label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def _le(bound_ms: float) -> str:
+    return f"{bound_ms / 1000:g}"
+
+
+def format_prometheus(histograms: Dict[str, Dict[Tuple, LatencyHistogram]],
+                      counters: Dict[str, Dict[Tuple, float]],
+                      help_texts: Dict[str, str] = None) -> str:
+    """
+    Render metrics in the Prometheus text exposition format
+    histograms/counters: metric name -> {tuple of (label, value) pairs: metric}
+    Histograms are exported in seconds
+    """
+    help_texts = help_texts or {}
+    lines = []
+    for name, series in counters.items():
+        if name in help_texts:
+            lines.append(f"# HELP {name} {help_texts[name]}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in series.items():
+            lines.append(f"{name}{_labels(dict(labels))} {value:g}")
+
+    for name, series in histograms.items():
+        if name in help_texts:
+            lines.append(f"# HELP {name} {help_texts[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in series.items():
+            labels = dict(labels)
+            counts, count, sum_ms, _ = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': _le(bound)})} {cumulative}")
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {sum_ms / 1000:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path: str, text: str):
+    """Atomically replace the metrics file (for node_exporter's textfile collector)"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class MetricsServer:
+    """Serves render() at /metrics from a daemon thread"""
+    
+    def __init__(self, render: Callable[[], str], port: int, host: str = "127.0.0.1"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+    
+            def log_message(self, format, *args):
+                pass
+    
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="metrics-server", daemon=True
+        )
+    
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -5,17 +5,43 @@ Implements observability for the agent system
 
 import json
 import os
+from collections import deque
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from config import Config
+from metrics import LatencyHistogram, MetricsServer, format_prometheus, write_metrics_file
+from log_writer import BackgroundLogWriter
 
 
 class Observer:
     def __init__(self):
-        self.session_logs = []
+        # Recent events only; everything else is kept as running aggregates so
+        # memory stays flat however long the process runs
+        self.session_logs = deque(maxlen=Config.OBSERVER_RECENT_EVENTS)
+        self.total_interactions = 0
+        self.event_counts: Dict[str, int] = {}
+        self.session_start: Optional[str] = None
+        self.session_end: Optional[str] = None
+        self.usage_by_intent: Dict[str, Dict] = {}  # Intent -> queries and per-model calls/tokens/cost
+        self.validation = {'responses': 0, 'passed': 0}
+        self.safety = {'blocked_inputs': 0, 'output_checks': 0, 'filtered_outputs': 0}
         self.total_cost = 0.0
         self.total_tokens = {'input': 0, 'output': 0}
+        self.caches = {}
+        self.response_modes = {}
+        self.stage_latency: Dict[str, LatencyHistogram] = {}  # Span name -> histogram; 'query' is end-to-end
+        self.prompt_tokens = {'estimated': 0, 'actual': 0}
+        self.prompt_packing = {'context_tokens': 0, 'history_tokens': 0, 'deduped': 0,
+                               'truncated': 0, 'dropped_faqs': 0, 'condensed_turns': 0,
+                               'dropped_turns': 0}
         self._ensure_log_dir()
+        self.log_writer = BackgroundLogWriter(Config.LOG_FILE) if Config.LOG_ASYNC_WRITER else None
+        
+        self.metrics_server = None
+        if Config.METRICS_PORT is not None:
+            self.metrics_server = MetricsServer(self.export_prometheus, Config.METRICS_PORT)
+            self.metrics_server.start()
+            print(f"Serving metrics on http://127.0.0.1:{self.metrics_server.port}/metrics")
     
     def _ensure_log_dir(self):
         """Ensure log directory exists"""
@@ -31,12 +57,20 @@ class Observer:
             'data': data
         }
         self.session_logs.append(log_entry)
+        self.total_interactions += 1
+        self.event_counts[event_type] = self.event_counts.get(event_type, 0) + 1
+        if self.session_start is None:
+            self.session_start = log_entry['timestamp']
+        self.session_end = log_entry['timestamp']
         
         # Write to file
         self._write_to_file(log_entry)
     
     def _write_to_file(self, log_entry: Dict):
         """Write log entry to file"""
+        if self.log_writer is not None:
+            self.log_writer.write(json.dumps(log_entry, ensure_ascii=False))
+            return
         try:
             with open(Config.LOG_FILE, 'a', encoding='utf-8') as f:
                 f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
@@ -49,10 +83,7 @@ class Observer:
         self.total_tokens['output'] += output_tokens
         
         if Config.ENABLE_COST_TRACKING:
-            cost = (
-                (input_tokens / 1000) * Config.COST_PER_1K_INPUT_TOKENS +
-                (output_tokens / 1000) * Config.COST_PER_1K_OUTPUT_TOKENS
-            )
+            cost = self._token_cost(input_tokens, output_tokens)
             self.total_cost += cost
             
             self.log_interaction('llm_call', {
@@ -62,8 +93,111 @@ class Observer:
                 'cost': cost
             })
     
+    @staticmethod
+    def _token_cost(input_tokens: int, output_tokens: int) -> float:
+        return (
+            (input_tokens / 1000) * Config.COST_PER_1K_INPUT_TOKENS +
+            (output_tokens / 1000) * Config.COST_PER_1K_OUTPUT_TOKENS
+        )
+    
+    def _cache_stats(self, cache) -> Dict:
+        stats = cache.stats()
+        saved = stats.get('saved_tokens')
+        if saved is not None:
+            stats['saved_cost'] = round(self._token_cost(saved['input'], saved['output']), 4)
+        return stats
+    
+    def record_query(self, query_context):
+        """Record latency, LLM round-trips/retries/hedges and tokens of a finished query per response mode"""
+        mode = query_context.mode
+        latency_ms = query_context.elapsed_ms()
+        stats = self.response_modes.setdefault(mode, {
+            'queries': 0, 'latency_ms': 0.0, 'round_trips': 0,
+            'input_tokens': 0, 'output_tokens': 0, 'retries': 0, 'hedges': 0
+        })
+        stats['queries'] += 1
+        stats['latency_ms'] += latency_ms
+        stats['round_trips'] += query_context.round_trips
+        stats['input_tokens'] += query_context.tokens['input']
+        stats['output_tokens'] += query_context.tokens['output']
+        stats['retries'] += query_context.retries
+        stats['hedges'] += query_context.hedges
+        self._observe_latency('query', latency_ms)
+        self._record_usage(query_context)
+        for span in query_context.spans:
+            self._observe_latency(span.name, span.duration_ms)
+        self.prompt_tokens['estimated'] += query_context.prompt_tokens['estimated']
+        self.prompt_tokens['actual'] += query_context.prompt_tokens['actual']
+        
+        self.log_interaction('query_completed', {
+            'mode': mode,
+            'latency_ms': round(latency_ms, 1),
+            'round_trips': query_context.round_trips,
+            'retries': query_context.retries,
+            'hedges': query_context.hedges,
+            'intent': query_context.intent,
+            'tokens': query_context.tokens,
+            'cost': round(self._token_cost(query_context.tokens['input'], query_context.tokens['output']), 6),
+            'model_usage': query_context.model_usage,
+            'stage_usage': query_context.stage_usage,
+            'estimated_prompt_tokens': query_context.prompt_tokens['estimated'],
+            'trace_id': query_context.trace_id,
+            **({'spans': query_context.span_records()} if Config.TRACE_LOG_SPANS else {})
+        })
+    
+    def _record_usage(self, query_context):
+        """Add a query's LLM calls, tokens and cost to the totals of its intent and model"""
+        intent_stats = self.usage_by_intent.setdefault(query_context.intent or 'none', {
+            'queries': 0, 'models': {}
+        })
+        intent_stats['queries'] += 1
+        for model, usage in query_context.model_usage.items():
+            stats = intent_stats['models'].setdefault(model, {
+                'calls': 0, 'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0
+            })
+            stats['calls'] += usage['calls']
+            stats['input_tokens'] += usage['input']
+            stats['output_tokens'] += usage['output']
+            stats['cost'] += self._token_cost(usage['input'], usage['output'])
+    
+    def _observe_latency(self, stage: str, latency_ms: float):
+        histogram = self.stage_latency.get(stage)
+        if histogram is None:
+            histogram = self.stage_latency.setdefault(stage, LatencyHistogram())
+        histogram.observe(latency_ms)
+    
+    def _fast_path_summary(self) -> Optional[Dict]:
+        """Share of queries answered without the LLM and the latency that saved"""
+        fast = self.response_modes.get('fast_path')
+        if fast is None:
+            return None
+        total = sum(stats['queries'] for stats in self.response_modes.values())
+        # Baseline: average latency of queries that went through the LLM
+        llm_modes = [stats for mode, stats in self.response_modes.items()
+                     if mode in ('serial', 'fused', 'stream')]
+        llm_queries = sum(stats['queries'] for stats in llm_modes)
+        saved_ms = None
+        if llm_queries:
+            baseline_ms = sum(stats['latency_ms'] for stats in llm_modes) / llm_queries
+            saved_ms = round(baseline_ms * fast['queries'] - fast['latency_ms'], 1)
+        return {
+            'queries': fast['queries'],
+            'rate': round(fast['queries'] / total, 4),
+            'avg_latency_ms': round(fast['latency_ms'] / fast['queries'], 1),
+            'latency_saved_ms': saved_ms
+        }
+    
+    def register_cache(self, name: str, cache):
+        """Register a cache whose stats() are reported in the session summary"""
+        self.caches[name] = cache
+    
     def log_safety_check(self, input_safe: bool, output_filtered: bool, messages: str):
         """Log safety guard results"""
+        if not input_safe:
+            self.safety['blocked_inputs'] += 1
+        else:
+            self.safety['output_checks'] += 1
+            self.safety['filtered_outputs'] += output_filtered
         self.log_interaction('safety_check', {
             'input_safe': input_safe,
             'output_filtered': output_filtered,
@@ -86,9 +220,49 @@ class Observer:
             'sources': sources
         })
     
+    def log_prompt_packing(self, context_report: Optional[Dict], history_report: Dict):
+        """Log how retrieved context and history were fitted into their token budgets"""
+        packing = self.prompt_packing
+        if context_report:
+            packing['context_tokens'] += context_report['tokens']
+            packing['deduped'] += context_report['deduped']
+            packing['truncated'] += context_report['truncated']
+            packing['dropped_faqs'] += context_report['dropped']
+        packing['history_tokens'] += history_report['tokens']
+        packing['condensed_turns'] += history_report['condensed']
+        packing['dropped_turns'] += history_report['dropped']
+        
+        self.log_interaction('prompt_packing', {
+            'context': context_report,
+            'history': history_report
+        })
+    
+    def _prompt_token_summary(self) -> Dict:
+        estimated, actual = self.prompt_tokens['estimated'], self.prompt_tokens['actual']
+        return {
+            'estimated': estimated,
+            'actual': actual,
+            'estimate_error': round((estimated - actual) / actual, 3) if actual else None,
+            'packing': self.prompt_packing
+        }
+    
+    def log_profile(self, report: Dict):
+        """Log where a profiled query's output went"""
+        self.log_interaction('query_profiled', report)
+    
+    def log_kb_reload(self, snapshot_version: int, num_faqs: int, duration_ms: float):
+        """Log a knowledge base hot reload"""
+        self.log_interaction('kb_reload', {
+            'snapshot_version': snapshot_version,
+            'num_faqs': num_faqs,
+            'duration_ms': round(duration_ms, 1)
+        })
+    
     def log_response(self, query: str, response: str, sources: list, 
                     validation_passed: bool):
         """Log final response"""
+        self.validation['responses'] += 1
+        self.validation['passed'] += validation_passed
         self.log_interaction('response', {
             'query': query,
             'response': response[:200] + '...' if len(response) > 200 else response,
@@ -96,14 +270,52 @@ class Observer:
             'validation_passed': validation_passed
         })
     
+    @staticmethod
+    def _rate(count: int, total: int) -> Optional[float]:
+        return round(count / total, 4) if total else None
+    
     def get_session_summary(self) -> Dict:
         """Get summary of current session"""
         return {
-            'total_interactions': len(self.session_logs),
+            'total_interactions': self.total_interactions,
             'total_cost': round(self.total_cost, 4),
             'total_tokens': self.total_tokens,
-            'session_start': self.session_logs[0]['timestamp'] if self.session_logs else None,
-            'session_end': self.session_logs[-1]['timestamp'] if self.session_logs else None
+            'session_start': self.session_start,
+            'session_end': self.session_end,
+            'event_counts': dict(self.event_counts),
+            'usage_by_intent': {
+                intent: {
+                    'queries': stats['queries'],
+                    'models': {model: dict(usage, cost=round(usage['cost'], 4))
+                               for model, usage in stats['models'].items()}
+                }
+                for intent, stats in list(self.usage_by_intent.items())
+            },
+            'validation': dict(self.validation, pass_rate=self._rate(
+                self.validation['passed'], self.validation['responses']
+            )),
+            'safety': dict(self.safety, filter_rate=self._rate(
+                self.safety['filtered_outputs'], self.safety['output_checks']
+            )),
+            'caches': {name: self._cache_stats(cache) for name, cache in self.caches.items()},
+            'response_modes': {
+                mode: {
+                    'queries': stats['queries'],
+                    'avg_latency_ms': round(stats['latency_ms'] / stats['queries'], 1),
+                    'avg_round_trips': round(stats['round_trips'] / stats['queries'], 2),
+                    'avg_tokens': round(
+                        (stats['input_tokens'] + stats['output_tokens']) / stats['queries'], 1
+                    ),
+                    'retries': stats['retries'],
+                    'hedges': stats['hedges']
+                }
+                for mode, stats in self.response_modes.items()
+            },
+            'fast_path': self._fast_path_summary(),
+            'prompt_tokens': self._prompt_token_summary(),
+            'stage_latency': {stage: histogram.summary()
+                              for stage, histogram in list(self.stage_latency.items())},
+            'log_writer': self.log_writer.stats() if self.log_writer is not None else None
         }
     
     def print_summary(self):
@@ -116,4 +328,102 @@ class Observer:
         print(f"Total Cost: ${summary['total_cost']:.4f}")
         print(f"Input Tokens: {summary['total_tokens']['input']}")
         print(f"Output Tokens: {summary['total_tokens']['output']}")
+        validation, safety = summary['validation'], summary['safety']
+        if validation['pass_rate'] is not None:
+            print(f"Validation: {validation['passed']}/{validation['responses']} passed "
+                  f"({validation['pass_rate']:.0%})")
+        if safety['filter_rate'] is not None or safety['blocked_inputs']:
+            print(f"Safety: {safety['blocked_inputs']} inputs blocked, "
+                  f"{safety['filtered_outputs']}/{safety['output_checks']} outputs filtered")
+        for intent, stats in summary['usage_by_intent'].items():
+            for model, usage in stats['models'].items():
+                print(f"Intent [{intent}] {model}: {usage['calls']} calls, "
+                      f"{usage['input_tokens']} input / {usage['output_tokens']} output tokens "
+                      f"(${usage['cost']:.4f})")
+        for name, stats in summary['caches'].items():
+            print(f"Cache [{name}]: {stats['hits']} hits / {stats['misses']} misses "
+                  f"({stats['hit_rate']:.0%}), {stats['evictions']} evictions, "
+                  f"size {stats['size']}/{stats['max_size']}")
+            if 'saved_tokens' in stats:
+                saved = stats['saved_tokens']
+                print(f"  saved {saved['input']} input / {saved['output']} output tokens "
+                      f"(${stats['saved_cost']:.4f})")
+        for mode, stats in summary['response_modes'].items():
+            print(f"Mode [{mode}]: {stats['queries']} queries, "
+                  f"avg {stats['avg_latency_ms']:.0f} ms, "
+                  f"{stats['avg_round_trips']:.2f} LLM calls, "
+                  f"{stats['avg_tokens']:.0f} tokens per query"
+                  + (f", {stats['retries']} retries" if stats['retries'] else "")
+                  + (f", {stats['hedges']} hedged" if stats['hedges'] else ""))
+        fast_path = summary['fast_path']
+        if fast_path:
+            saved = fast_path['latency_saved_ms']
+            print(f"Fast Path: {fast_path['rate']:.0%} of queries, "
+                  f"avg {fast_path['avg_latency_ms']:.1f} ms"
+                  + (f", ~{saved / 1000:.1f} s latency saved" if saved is not None else ""))
+        if summary['stage_latency']:
+            print("Stage Latency (p50 / p95 / p99 ms):")
+            for stage, stats in summary['stage_latency'].items():
+                print(f"  {stage:<16} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+                      f"{stats['p99_ms']:>9.1f}  ({stats['count']} spans)")
+        log_writer = summary['log_writer']
+        if log_writer and (log_writer['dropped'] or log_writer['errors']):
+            print(f"Log Writer: {log_writer['dropped']} entries dropped, {log_writer['errors']} write errors")
+        prompt = summary['prompt_tokens']
+        packing = prompt['packing']
+        if prompt['estimate_error'] is not None:
+            print(f"Prompt Tokens: ~{prompt['estimated']} estimated / {prompt['actual']} actual "
+                  f"({prompt['estimate_error']:+.0%})")
+        if any(packing[key] for key in ('deduped', 'truncated', 'dropped_faqs',
+                                         'condensed_turns', 'dropped_turns')):
+            print(f"Prompt Packing: {packing['deduped']} duplicate / {packing['dropped_faqs']} "
+                  f"dropped / {packing['truncated']} truncated FAQs, "
+                  f"{packing['condensed_turns']} condensed / {packing['dropped_turns']} dropped turns")
         print("="*50 + "\n")
+    
+    def export_prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        modes = list(self.response_modes.items())
+        return format_prometheus(
+            histograms={
+                'agent_stage_latency_seconds': {
+                    (('stage', stage),): histogram
+                    for stage, histogram in list(self.stage_latency.items())
+                }
+            },
+            counters={
+                'agent_queries_total': {(('mode', mode),): stats['queries'] for mode, stats in modes},
+                'agent_llm_round_trips_total': {(('mode', mode),): stats['round_trips'] for mode, stats in modes},
+                'agent_llm_tokens_total': {
+                    (('direction', 'input'),): self.total_tokens['input'],
+                    (('direction', 'output'),): self.total_tokens['output']
+                },
+                'agent_llm_cost_total': {(): round(self.total_cost, 6)}
+            },
+            help_texts={
+                'agent_stage_latency_seconds': "Latency of pipeline stages (spans); stage=\"query\" is end-to-end",
+                'agent_queries_total': "Queries answered, by response mode",
+                'agent_llm_round_trips_total': "LLM requests, by response mode",
+                'agent_llm_tokens_total': "LLM tokens used",
+                'agent_llm_cost_total': "Estimated LLM cost in USD"
+            }
+        )
+    
+    def write_metrics(self, path: str = None):
+        """Write Prometheus metrics to path (default Config.METRICS_FILE)"""
+        path = path or Config.METRICS_FILE
+        if not path:
+            return
+        try:
+            write_metrics_file(path, self.export_prometheus())
+        except OSError as e:
+            print(f"Warning: Could not write metrics file: {e}")
+    
+    def close(self):
+        """Flush the log, write the metrics file and stop the metrics endpoint"""
+        if self.log_writer is not None:
+            self.log_writer.close()
+        self.write_metrics()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
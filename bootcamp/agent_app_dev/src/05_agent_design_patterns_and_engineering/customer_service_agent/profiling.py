@@ -0,0 +1,166 @@
+"""
+Query Profiling
+On-demand cProfile (and optionally tracemalloc) around single queries.
+Writes collapsed stacks for flamegraph tools (flamegraph.pl, speedscope,
+inferno), the raw pstats dump and the top allocation sites to PROFILE_DIR
+"""
+
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+
+
+MAX_STACK_DEPTH = 128
+MIN_STACK_SECONDS = 1e-6  # Paths below this are dropped from the collapsed output
+
+
+def should_profile(requested: Optional[bool] = None) -> bool:
+    """Explicit per-query request, otherwise sample at PROFILE_SAMPLE_RATE"""
+    if requested is not None:
+        return requested
+    rate = Config.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def _frame_name(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == '~':  # Built-in function
+        return name.strip('<>').replace(' ', '_')
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(';', ':')
+
+
+def collapsed_stacks(stats: pstats.Stats) -> List[str]:
+    """
+    Rebuild 'root;caller;callee microseconds' lines from cProfile's caller
+    graph. cProfile keeps call edges, not full stacks, so a function's time
+    is split across its callers in proportion to the time spent under each
+    """
+    raw = stats.stats
+    callees: Dict[Tuple, List[Tuple]] = {}
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller in callers:
+            callees.setdefault(caller, []).append(func)
+    roots = [func for func, (_, _, _, _, callers) in raw.items()
+             if not callers or all(caller not in raw for caller in callers)]
+    
+    folded: Dict[str, float] = {}
+    
+    def visit(func: Tuple, stack: List[str], path: set, share: float):
+        _, _, self_time, total_time, _ = raw[func]
+        stack.append(_frame_name(func))
+        path.add(func)
+        key = ";".join(stack)
+        folded[key] = folded.get(key, 0.0) + self_time * share
+        if len(stack) < MAX_STACK_DEPTH:
+            for callee in callees.get(func, ()):
+                if callee in path:
+                    continue  # Recursion: its time is already counted at the outer call
+                edge_time = raw[callee][4][func][3] * share
+                callee_total = raw[callee][3]
+                if callee_total > 0 and edge_time >= MIN_STACK_SECONDS:
+                    visit(callee, stack, path, edge_time / callee_total)
+        stack.pop()
+        path.discard(func)
+    
+    for root in roots:
+        visit(root, [], set(), 1.0)
+    return [f"{stack} {round(seconds * 1e6)}"
+            for stack, seconds in sorted(folded.items()) if seconds >= MIN_STACK_SECONDS]
+
+
+class QueryProfiler:
+    def __init__(self, out_dir: str = None):
+        self.out_dir = out_dir or Config.PROFILE_DIR
+        # cProfile and tracemalloc are process/thread-wide: one profile at a time
+        self._lock = threading.Lock()
+        self.profiles = 0
+        self.skipped = 0
+    
+    @contextmanager
+    def profile(self, trace_id: str) -> Iterator[Dict]:
+        """
+        Profile the enclosed code; yields a dict that gets the output paths
+        (empty if another profile was already running)
+        Everything running on this thread while active is included (other
+        asyncio tasks interleaved with the query too)
+        """
+        report: Dict = {}
+        if not self._lock.acquire(blocking=False):
+            self.skipped += 1
+            yield report
+            return
+        
+        profiler = cProfile.Profile()
+        start_tracemalloc = Config.PROFILE_MEMORY and not tracemalloc.is_tracing()
+        try:
+            if start_tracemalloc:
+                tracemalloc.start(Config.PROFILE_MEMORY_FRAMES)
+            started = time.perf_counter()
+            try:
+                profiler.enable()
+            except ValueError:  # Another profiler is active on this thread
+                self.skipped += 1
+                profiler = None
+            try:
+                yield report
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                duration_ms = (time.perf_counter() - started) * 1000
+                snapshot = peak = None
+                if Config.PROFILE_MEMORY:
+                    snapshot = tracemalloc.take_snapshot()
+                    peak = tracemalloc.get_traced_memory()[1]
+                if start_tracemalloc:
+                    tracemalloc.stop()
+                if profiler is not None:
+                    report.update(self._write(trace_id, profiler, snapshot, peak, duration_ms))
+                    self.profiles += 1
+        finally:
+            self._lock.release()
+    
+    def _write(self, trace_id: str, profiler: cProfile.Profile,
+               snapshot: Optional[tracemalloc.Snapshot], peak: Optional[int],
+               duration_ms: float) -> Dict:
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(
+            self.out_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{trace_id[:12]}"
+        )
+        stats = pstats.Stats(profiler)
+        report = {'duration_ms': round(duration_ms, 1),
+                  'pstats': base + ".prof", 'collapsed': base + ".collapsed"}
+        
+        stats.dump_stats(report['pstats'])
+        with open(report['collapsed'], 'w', encoding='utf-8') as f:
+            f.write("\n".join(collapsed_stacks(stats)) + "\n")
+        
+        if snapshot is not None:
+            report['allocations'] = base + ".alloc.txt"
+            self._write_allocations(report['allocations'], snapshot, peak)
+        return report
+    
+    @staticmethod
+    def _write_allocations(path: str, snapshot: tracemalloc.Snapshot, peak: int):
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        top = snapshot.statistics('traceback')[:Config.PROFILE_TOP_ALLOCATIONS]
+        total = sum(stat.size for stat in snapshot.statistics('filename'))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"Traced memory: {total / 1024:.1f} KiB live at the end of the query, "
+                    f"{peak / 1024:.1f} KiB peak\n")
+            f.write(f"Top {len(top)} allocation sites:\n")
+            for rank, stat in enumerate(top, 1):
+                f.write(f"\n#{rank}: {stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+                for line in stat.traceback.format(most_recent_first=True):
+                    f.write(f"    {line}\n")
@@ -0,0 +1,178 @@
+"""
+Prompt Builder Module
+Keeps input tokens under control: packs retrieved FAQs by relevance and
+condenses older conversation turns to fit configurable token budgets,
+using a local approximate tokenizer (no model-specific vocabulary needed)
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from bm25_index import tokenize
+
+
+# Roughly how BPE tokenizers split text: short words are one token, long
+# words a few, digits go in groups of three, CJK characters and punctuation
+# are about one token each
+_TOKEN_PATTERN = re.compile(r'[A-Za-z]+|\d+|[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|[^\sA-Za-z\d]')
+_SENTENCE_END = re.compile(r'[.!?。！？](?=\s|$)')
+
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators of each chat message
+REPLY_PRIMING_TOKENS = 3  # Every reply is primed with the assistant role
+TRUNCATION_MARKER = " ..."
+
+
+def _piece_tokens(piece: str) -> int:
+    if piece[0].isdigit():
+        return (len(piece) + 2) // 3
+    if piece[0].isascii() and piece[0].isalpha():
+        return 1 + (len(piece) - 1) // 6
+    return 1
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of tokens in text"""
+    if not text:
+        return 0
+    return sum(_piece_tokens(piece) for piece in _TOKEN_PATTERN.findall(text))
+
+
+def estimate_messages_tokens(messages: list) -> int:
+    """Approximate prompt tokens of a chat completion request"""
+    return REPLY_PRIMING_TOKENS + sum(
+        MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get('content') or '')
+        for message in messages
+    )
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut text to about max_tokens, preferring a sentence boundary
+    Returns text unchanged if it already fits
+    """
+    if max_tokens <= 0:
+        return ""
+    used = 0
+    cut = None
+    for match in _TOKEN_PATTERN.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            cut = match.start()
+            break
+    if cut is None:
+        return text
+    
+    head = text[:cut]
+    sentence_ends = [m.end() for m in _SENTENCE_END.finditer(head)]
+    # Keep whole sentences unless that throws away most of the allowance
+    if sentence_ends and sentence_ends[-1] >= len(head) // 2:
+        return head[:sentence_ends[-1]]
+    return head.rstrip() + TRUNCATION_MARKER
+
+
+def _first_sentence(text: str) -> str:
+    match = _SENTENCE_END.search(text)
+    return text[:match.end()] if match else text
+
+
+# Formatting cost of one context entry besides its question and answer,
+# see RAGRetriever.format_context()
+_ENTRY_OVERHEAD_TOKENS = estimate_tokens("10. [Source: FAQ-100, Relevance: 0.00]\n   Q: \n   A: \n\n")
+
+
+class PromptBuilder:
+    def __init__(self, context_budget: Optional[int] = None,
+                 history_budget: Optional[int] = None,
+                 dedupe_threshold: float = None):
+        self.context_budget = context_budget if context_budget is not None else Config.PROMPT_CONTEXT_TOKENS
+        self.history_budget = history_budget if history_budget is not None else Config.PROMPT_HISTORY_TOKENS
+        self.dedupe_threshold = dedupe_threshold or Config.PROMPT_DEDUPE_THRESHOLD
+    
+    @staticmethod
+    def _overlap(words: set, other: set) -> float:
+        if not words or not other:
+            return 0.0
+        return len(words & other) / len(words | other)
+    
+    def pack_context(self, retrieved_items: List[Tuple[Dict, float]]) -> Tuple[List[Tuple[Dict, float]], Dict]:
+        """
+        Select FAQs for the prompt: most relevant first, skipping near-duplicates
+        of an entry already selected, truncating the answer of the entry that
+        crosses the budget and leaving out what does not fit
+        Returns: (selected items in relevance order, packing report)
+        """
+        report = {'retrieved': len(retrieved_items), 'deduped': 0,
+                  'truncated': 0, 'dropped': 0, 'tokens': 0}
+        selected = []
+        selected_words = []
+        remaining = self.context_budget
+        
+        for faq, score in sorted(retrieved_items, key=lambda item: item[1], reverse=True):
+            words = set(tokenize(f"{faq['question']} {faq['answer']}"))
+            if any(self._overlap(words, other) >= self.dedupe_threshold for other in selected_words):
+                report['deduped'] += 1
+                continue
+            
+            cost = _ENTRY_OVERHEAD_TOKENS + estimate_tokens(faq['question']) + estimate_tokens(faq['answer'])
+            if remaining is not None and cost > remaining:
+                # Truncate the answer if a useful part of it still fits
+                answer_room = remaining - (cost - estimate_tokens(faq['answer']))
+                if answer_room < Config.PROMPT_MIN_ANSWER_TOKENS:
+                    report['dropped'] += 1
+                    continue
+                faq = dict(faq, answer=truncate_to_tokens(faq['answer'], answer_room))
+                cost = _ENTRY_OVERHEAD_TOKENS + estimate_tokens(faq['question']) + estimate_tokens(faq['answer'])
+                report['truncated'] += 1
+            
+            selected.append((faq, score))
+            selected_words.append(words)
+            report['tokens'] += cost
+            if remaining is not None:
+                remaining -= cost
+        
+        return selected, report
+    
+    @staticmethod
+    def _turn_tokens(turn: Dict) -> int:
+        return estimate_tokens(turn['user']) + estimate_tokens(turn['assistant']) + 4
+    
+    @staticmethod
+    def _condense(turn: Dict) -> Dict:
+        """Short form of an older turn: the question and the gist of the answer"""
+        return {
+            'user': truncate_to_tokens(turn['user'], Config.PROMPT_CONDENSED_TURN_TOKENS),
+            'assistant': truncate_to_tokens(
+                _first_sentence(turn['assistant']), Config.PROMPT_CONDENSED_TURN_TOKENS
+            )
+        }
+    
+    def pack_history(self, history: List[Dict]) -> Tuple[List[Dict], Dict]:
+        """
+        Fit conversation history into the budget: the newest
+        PROMPT_VERBATIM_TURNS turns are kept as they are if they fit, older
+        ones are condensed, and turns before the first one that does not fit
+        are left out
+        Returns: (turns in chronological order, packing report)
+        """
+        report = {'turns': len(history), 'condensed': 0, 'dropped': 0, 'tokens': 0}
+        packed = []
+        remaining = self.history_budget
+        
+        for age, turn in enumerate(reversed(history)):
+            cost = self._turn_tokens(turn)
+            condensed = False
+            if age >= Config.PROMPT_VERBATIM_TURNS or (remaining is not None and cost > remaining):
+                short = self._condense(turn)
+                if short != turn:
+                    turn, cost, condensed = short, self._turn_tokens(short), True
+            if remaining is not None and cost > remaining:
+                report['dropped'] = len(history) - len(packed)
+                break
+            packed.append(turn)
+            report['condensed'] += condensed
+            report['tokens'] += cost
+            if remaining is not None:
+                remaining -= cost
+        
+        packed.reverse()
+        return packed, report
@@ -0,0 +1,135 @@
+"""
+Per-query Context
+Request-scoped state (LLM round-trips, token usage, timing, trace spans)
+carried through the pipeline with contextvars, so it works across threads
+and asyncio tasks
+"""
+
+import itertools
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+
+class Span:
+    """Timing of one pipeline step (monotonic clock), nested by parent_id"""
+    __slots__ = ('name', 'span_id', 'parent_id', 'start', 'end')
+    
+    def __init__(self, name: str, span_id: int, parent_id: Optional[int]):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+    
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+
+class QueryContext:
+    def __init__(self, mode: str, budget: Optional[float] = None):
+        self.mode = mode
+        self.started = time.perf_counter()
+        # Latency budget: every stage sizes its timeouts to what is left
+        self.deadline = self.started + budget if budget else None
+        self.round_trips = 0
+        self.retries = 0
+        self.hedges = 0
+        self.tokens = {'input': 0, 'output': 0}
+        # Local prompt token estimates vs the API's counts, for calls that report usage
+        self.prompt_tokens = {'estimated': 0, 'actual': 0}
+        self.cache_hits = 0
+        self.failed_calls = 0
+        self.kb_version: Optional[str] = None  # Content version of the KB used for this query
+        self.intent: Optional[str] = None
+        self.model_usage: Dict[str, Dict[str, int]] = {}  # Model -> calls and tokens
+        self.stage_usage: Dict[str, Dict[str, int]] = {}  # Pipeline stage -> calls and tokens
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []  # Finished spans
+        self.profiling = False  # Under QueryProfiler: CPU steps run inline so they are captured
+        self._span_ids = itertools.count(1)
+    
+    def record_llm_call(self, usage: Optional[Dict] = None, estimated_prompt_tokens: int = None,
+                        model: Optional[str] = None, stage: Optional[str] = None):
+        """Count one LLM round-trip and its token usage"""
+        self.round_trips += 1
+        breakdowns = (
+            self.model_usage.setdefault(model or 'unknown', {'calls': 0, 'input': 0, 'output': 0}),
+            self.stage_usage.setdefault(stage or 'default', {'calls': 0, 'input': 0, 'output': 0})
+        )
+        for breakdown in breakdowns:
+            breakdown['calls'] += 1
+        if usage:
+            self.tokens['input'] += usage.get('prompt_tokens', 0)
+            self.tokens['output'] += usage.get('completion_tokens', 0)
+            for breakdown in breakdowns:
+                breakdown['input'] += usage.get('prompt_tokens', 0)
+                breakdown['output'] += usage.get('completion_tokens', 0)
+            if estimated_prompt_tokens is not None and 'prompt_tokens' in usage:
+                self.prompt_tokens['estimated'] += estimated_prompt_tokens
+                self.prompt_tokens['actual'] += usage['prompt_tokens']
+    
+    def record_llm_error(self):
+        """A call failed and a fallback text was used; the answer must not be cached"""
+        self.failed_calls += 1
+    
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+    
+    def remaining(self) -> float:
+        """Seconds left in the latency budget (infinite without one)"""
+        if self.deadline is None:
+            return float('inf')
+        return self.deadline - time.perf_counter()
+    
+    def span_records(self) -> List[Dict]:
+        """Finished spans with times relative to the start of the query"""
+        return [{
+            'name': span.name,
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+            'start_ms': round((span.start - self.started) * 1000, 2),
+            'duration_ms': round(span.duration_ms, 2)
+        } for span in sorted(self.spans, key=lambda span: span.start)]
+
+
+_current: ContextVar[Optional[QueryContext]] = ContextVar('query_context', default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar('query_span', default=None)
+
+
+def start_query(mode: str, budget: Optional[float] = None) -> QueryContext:
+    """Start tracking a query in the current context (thread or asyncio task)"""
+    context = QueryContext(mode, budget)
+    _current.set(context)
+    _current_span.set(None)
+    return context
+
+
+def current_query() -> Optional[QueryContext]:
+    """Context of the query being processed, if any"""
+    return _current.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[Optional[Span]]:
+    """
+    Time a pipeline step as a span of the current query's trace, nested under
+    the enclosing span (does nothing outside a query)
+    """
+    context = _current.get()
+    if context is None:
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(name, next(context._span_ids), parent.span_id if parent else None)
+    _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        context.spans.append(current)
+        # Not reset(token): an async generator may resume in another task's context
+        _current_span.set(parent)
@@ -3,55 +3,83 @@ RAG (Retrieval Augmented Generation) Module
 Implements vector-based similarity search
 """
 
+import threading
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from knowledge_base import KnowledgeBase
+from embedder import HashingEmbedder
+from cache import LRUCache
+from ann_index import IVFIndex
 from config import Config
 
 
+class RetrievalSnapshot:
+    """A knowledge base together with the retrieval state derived from it"""
+    def __init__(self, knowledge_base: KnowledgeBase, version: int = 0):
+        self.kb = knowledge_base
+        self.version = version
+        # FAQ-side embeddings are pinned (question -> row of the FAQ matrix)
+        self.pinned_rows: Dict[str, int] = {}
+        self.ann_index: Optional[IVFIndex] = None
+        self.layout_version = knowledge_base.layout_version
+
+
 class RAGRetriever:
     def __init__(self, knowledge_base: KnowledgeBase):
-        self.kb = knowledge_base
-        self.embeddings_cache = {}
+        # Every query reads self._snapshot once, so a reload can swap in a new
+        # snapshot while in-flight queries finish on the old one
+        self._snapshot = RetrievalSnapshot(knowledge_base)
+        self.embedder = HashingEmbedder()
+        # Query-side embeddings are bounded; FAQ-side embeddings are pinned
+        # in the snapshot and never evicted
+        self.embeddings_cache = LRUCache(
+            Config.EMBEDDING_CACHE_SIZE, Config.EMBEDDING_CACHE_TTL
+        )
+        # Per-thread score buffer, reused across queries
+        self._local = threading.local()
+        # Serializes lazy builds of the FAQ matrix and ANN index (queries run
+        # on a thread pool); the up-to-date case is checked without it
+        self._build_lock = threading.Lock()
+    
+    @property
+    def kb(self) -> KnowledgeBase:
+        return self._snapshot.kb
+    
+    @property
+    def ann_index(self) -> Optional[IVFIndex]:
+        return self._snapshot.ann_index
     
-    def _simple_embedding(self, text: str) -> np.ndarray:
+    @property
+    def snapshot_version(self) -> int:
+        return self._snapshot.version
+    
+    def _simple_embedding(self, text: str, snapshot: RetrievalSnapshot = None) -> np.ndarray:
         """
         Simple embedding using character n-grams and word frequency
         In production, use OpenAI embeddings or sentence-transformers
         """
+        snapshot = snapshot or self._snapshot
+        # Embeddings are case-insensitive, so key the caches on lowercased text
+        key = text.lower()
+        row = snapshot.pinned_rows.get(key)
+        if row is not None and self._is_pinned_row_current(snapshot.kb, row, key):
+            return snapshot.kb.embeddings[row]
+        
         # Check cache
-        if text in self.embeddings_cache:
-            return self.embeddings_cache[text]
-        
-        # Normalize text
-        text = text.lower()
-        words = text.split()
-        
-        # Create a simple bag-of-words vector (300 dimensions)
-        vector = np.zeros(300)
-        
-        # Word-level features
-        for i, word in enumerate(words[:100]):  # Limit to first 100 words
-            # Hash word to dimension
-            hash_val = hash(word) % 300
-            vector[hash_val] += 1.0 / (i + 1)  # Weight by position
-        
-        # Character n-gram features
-        for n in [2, 3]:
-            for i in range(len(text) - n + 1):
-                ngram = text[i:i+n]
-                hash_val = hash(ngram) % 300
-                vector[hash_val] += 0.5
-        
-        # Normalize
-        norm = np.linalg.norm(vector)
-        if norm > 0:
-            vector = vector / norm
+        vector = self.embeddings_cache.get(key)
+        if vector is not None:
+            return vector
+        
+        vector = self.embedder.embed(text)
         
         # Cache the result
-        self.embeddings_cache[text] = vector
+        self.embeddings_cache.put(key, vector)
         return vector
     
+    def embed_query(self, query: str) -> np.ndarray:
+        """Unit-norm query embedding (served from the caches when possible)"""
+        return self._simple_embedding(query)
+    
     def compute_similarity(self, text1: str, text2: str) -> float:
         """Compute cosine similarity between two texts"""
         emb1 = self._simple_embedding(text1)
@@ -61,35 +89,274 @@ class RAGRetriever:
         similarity = np.dot(emb1, emb2)
         return float(similarity)
     
-    def retrieve(self, query: str, top_k: int = None) -> List[Tuple[Dict, float]]:
+    @staticmethod
+    def _is_pinned_row_current(kb: KnowledgeBase, row: int, key: str) -> bool:
+        """A pinned row is valid while it is embedded and still holds that question"""
+        return (kb.embeddings is not None and row < len(kb.embeddings)
+                and row not in kb.stale_rows and kb.faqs[row]['question'].lower() == key)
+    
+    @staticmethod
+    def _pin_rows(snapshot: RetrievalSnapshot, rows):
+        for row in rows:
+            snapshot.pinned_rows[snapshot.kb.faqs[row]['question'].lower()] = row
+    
+    def _get_faq_matrix(self, snapshot: RetrievalSnapshot) -> np.ndarray:
+        """
+        Get the (N x D) matrix of FAQ question embeddings
+        Kept on the knowledge base; only new or changed FAQs are embedded
+        """
+        kb = snapshot.kb
+        if (snapshot.layout_version == kb.layout_version and kb.embeddings is not None
+                and len(kb.embeddings) == len(kb.faqs) and not kb.stale_rows):
+            return kb.embeddings
+        with self._build_lock:
+            return self._update_faq_matrix(snapshot)
+    
+    def _update_faq_matrix(self, snapshot: RetrievalSnapshot) -> np.ndarray:
+        """Bring the FAQ matrix up to date (call with _build_lock held)"""
+        kb = snapshot.kb
+        if snapshot.layout_version != kb.layout_version:
+            # Rows were deleted: row numbers in derived indexes are no longer valid
+            snapshot.ann_index = None
+            snapshot.pinned_rows = {}
+            if kb.embeddings is not None:
+                self._pin_rows(snapshot, range(len(kb.embeddings)))
+            snapshot.layout_version = kb.layout_version
+        
+        if kb.embeddings is None:
+            # Cold start: reuse the persisted matrix (or a prefix of it) when it matches
+            signature = self.embedder.signature
+            if not (Config.PERSIST_EMBEDDINGS and kb.load_embeddings(signature)):
+                kb.embeddings = self.embedder.embed_batch(kb.get_all_questions())
+                if Config.PERSIST_EMBEDDINGS:
+                    kb.save_embeddings(signature)
+            snapshot.pinned_rows = {}
+            self._pin_rows(snapshot, range(len(kb.embeddings)))
+            snapshot.ann_index = None
+        
+        # FAQs added since the last call
+        start = len(kb.embeddings)
+        if start < len(kb.faqs):
+            questions = [faq['question'] for faq in kb.faqs[start:]]
+            kb.append_embeddings(self.embedder.embed_batch(questions))
+            self._pin_rows(snapshot, range(start, len(kb.faqs)))
+            if Config.PERSIST_EMBEDDINGS:
+                kb.save_embedding_rows(self.embedder.signature, range(start, len(kb.faqs)))
+        
+        # FAQs whose question was edited since the last call
+        if kb.stale_rows:
+            rows = sorted(kb.stale_rows)
+            vectors = self.embedder.embed_batch([kb.faqs[row]['question'] for row in rows])
+            kb.set_embeddings(rows, vectors)
+            self._pin_rows(snapshot, rows)
+            if Config.PERSIST_EMBEDDINGS:
+                kb.save_embedding_rows(self.embedder.signature, rows)
+            if snapshot.ann_index is not None:
+                snapshot.ann_index.update_vectors(rows, vectors)
+        return kb.embeddings
+    
+    def refresh(self):
+        """Bring FAQ embeddings and derived indexes up to date with the knowledge base"""
+        self._warm(self._snapshot)
+    
+    def _warm(self, snapshot: RetrievalSnapshot):
+        """Build everything a query on this snapshot would otherwise build lazily"""
+        self._get_ann_index(snapshot, self._get_faq_matrix(snapshot))
+    
+    def swap_knowledge_base(self, knowledge_base: KnowledgeBase) -> int:
+        """
+        Build retrieval indexes for a new knowledge base, then swap it in atomically
+        Call off the request path; queries never wait for the build
+        Returns: the new snapshot version
+        """
+        snapshot = RetrievalSnapshot(knowledge_base, self._snapshot.version + 1)
+        self._warm(snapshot)
+        self._snapshot = snapshot
+        return snapshot.version
+    
+    def _get_ann_index(self, snapshot: RetrievalSnapshot,
+                       matrix: np.ndarray) -> Optional[IVFIndex]:
+        """
+        Get the approximate index if enabled and the corpus is large enough
+        Returns None when exact search should be used
+        """
+        if Config.RAG_INDEX_TYPE != 'ivf' or matrix.shape[0] < Config.ANN_MIN_VECTORS:
+            return None
+        index = snapshot.ann_index
+        if index is not None and self._ann_tail_ok(index, matrix):
+            return index
+        with self._build_lock:
+            return self._update_ann_index(snapshot, matrix)
+    
+    @staticmethod
+    def _ann_tail_ok(index: IVFIndex, matrix: np.ndarray) -> bool:
+        """Rows added after the build are scanned exactly until the tail gets too long"""
+        return matrix.shape[0] - index.num_indexed <= Config.ANN_REBUILD_FRACTION * index.num_indexed
+    
+    def _update_ann_index(self, snapshot: RetrievalSnapshot, matrix: np.ndarray) -> IVFIndex:
+        """Load or build the ANN index (call with _build_lock held)"""
+        if snapshot.ann_index is not None:
+            # Another thread may have rebuilt it while we waited for the lock
+            if self._ann_tail_ok(snapshot.ann_index, matrix):
+                return snapshot.ann_index
+            snapshot.ann_index = None
+        
+        kb = snapshot.kb
+        nlist = Config.ANN_NLIST or IVFIndex.default_nlist(matrix.shape[0])
+        path = kb.artifact_path(f"{self.embedder.signature}.ivf{nlist}.npz")
+        try:
+            index, meta = IVFIndex.load(path, matrix, nprobe=Config.ANN_NPROBE)
+            if (self._ann_tail_ok(index, matrix) and
+                    meta.get('fingerprint') == kb.questions_fingerprint(index.num_indexed)):
+                snapshot.ann_index = index
+                return index
+        except (FileNotFoundError, ValueError, OSError, KeyError):
+            pass
+        
+        print(f"Building IVF index ({nlist} lists) over {matrix.shape[0]} FAQs...")
+        index = IVFIndex(nlist, nprobe=Config.ANN_NPROBE)
+        index.build(matrix, iterations=Config.ANN_KMEANS_ITERATIONS)
+        if Config.PERSIST_EMBEDDINGS:
+            index.save(path, {'fingerprint': kb.questions_fingerprint()})
+        snapshot.ann_index = index
+        return index
+    
+    def _score_buffer(self, size: int) -> np.ndarray:
+        """Reusable float32 buffer for one score per FAQ"""
+        buffer = getattr(self._local, 'scores', None)
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(max(size, 2 * (0 if buffer is None else buffer.size)), dtype=np.float32)
+            self._local.scores = buffer
+        return buffer[:size]
+    
+    def _top_k(self, scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Select top_k rows above the similarity threshold from a score vector"""
+        candidates = np.flatnonzero(scores >= Config.RAG_SIMILARITY_THRESHOLD)
+        if candidates.size == 0 or top_k <= 0:
+            return candidates, scores[candidates]
+        
+        if candidates.size > top_k:
+            part = np.argpartition(scores[candidates], -top_k)[-top_k:]
+            candidates = candidates[part]
+        
+        # Sort only the selected rows by similarity (stable for equal scores)
+        order = np.argsort(-scores[candidates], kind='stable')
+        candidates = candidates[order]
+        return candidates, scores[candidates]
+    
+    @staticmethod
+    def _to_items(kb: KnowledgeBase, rows: np.ndarray,
+                  scores: np.ndarray) -> List[Tuple[Dict, float]]:
+        return [(kb.faqs[row], float(score)) for row, score in zip(rows, scores)]
+    
+    def _vector_search(self, snapshot: RetrievalSnapshot, matrix: np.ndarray,
+                       query_vector: np.ndarray, top_k: int,
+                       excluded: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k FAQ rows by cosine similarity above the threshold, best first"""
+        index = self._get_ann_index(snapshot, matrix)
+        if index is not None:
+            rows, scores = index.search(query_vector, top_k, exclude=excluded)
+            start = index.num_indexed
+            if start < matrix.shape[0]:
+                # Exact scan of the rows added since the index was built
+                tail_scores = matrix[start:] @ query_vector
+                tail_scores[excluded[start:]] = -np.inf
+                tail_rows, tail_scores = self._top_k(tail_scores, top_k)
+                rows = np.concatenate([rows, tail_rows + start])
+                scores = np.concatenate([scores, tail_scores])
+                order = np.argsort(-scores, kind='stable')[:top_k]
+                rows, scores = rows[order], scores[order]
+            keep = scores >= Config.RAG_SIMILARITY_THRESHOLD
+            return rows[keep], scores[keep]
+        
+        # One matrix-vector product scores every FAQ, written into a reused buffer;
+        # filtered-out rows are masked in place
+        scores = np.matmul(matrix, query_vector, out=self._score_buffer(matrix.shape[0]))
+        np.putmask(scores, excluded, -np.inf)
+        return self._top_k(scores, top_k)
+    
+    @staticmethod
+    def _keyword_search(kb: KnowledgeBase, query: str, top_k: int,
+                        excluded: np.ndarray) -> np.ndarray:
+        """Top-k searchable FAQ rows by BM25 score"""
+        rows, _ = kb.keyword_index.search(query)
+        return rows[~excluded[rows]][:top_k]
+    
+    @staticmethod
+    def _reciprocal_rank_fusion(rankings: List[np.ndarray], top_k: int) -> np.ndarray:
+        """Fuse ranked row lists: score(row) = sum of 1 / (k + rank)"""
+        fused: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, row in enumerate(ranking.tolist()):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (Config.RAG_RRF_K + rank + 1)
+        best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        return np.asarray(best, dtype=np.int64)
+    
+    def retrieve(self, query: str, top_k: int = None, retrieval_mode: str = None,
+                 category: str = None, verified_only: bool = None) -> List[Tuple[Dict, float]]:
         """
         Retrieve relevant FAQs based on query
+        retrieval_mode: 'vector', 'keyword' or 'hybrid' (default: Config.RAG_RETRIEVAL_MODE)
+        category: only search FAQs of this category
+        verified_only: True/False, or None for verified FAQs unless none are verified
         Returns: List of (faq, similarity_score) tuples
         """
         if top_k is None:
             top_k = Config.RAG_TOP_K
+        mode = retrieval_mode or Config.RAG_RETRIEVAL_MODE
+        
+        snapshot = self._snapshot
+        kb = snapshot.kb
+        matrix = self._get_faq_matrix(snapshot)
+        if matrix.shape[0] == 0:
+            return []
+        
+        query_vector = self._simple_embedding(query, snapshot)
+        excluded = kb.excluded_rows_mask(category, verified_only)
         
-        # Get all FAQs
-        faqs = self.kb.get_verified_faqs()
-        if not faqs:
-            faqs = self.kb.faqs
+        if mode == 'vector':
+            rows, scores = self._vector_search(snapshot, matrix, query_vector, top_k, excluded)
+            return self._to_items(kb, rows, scores)
         
-        # Compute similarities
-        similarities = []
-        for faq in faqs:
-            score = self.compute_similarity(query, faq['question'])
-            similarities.append((faq, score))
+        depth = top_k * Config.RAG_FUSION_DEPTH
+        keyword_rows = self._keyword_search(kb, query, depth, excluded)
+        if mode == 'keyword':
+            rows = keyword_rows[:top_k]
+        elif mode == 'hybrid':
+            vector_rows, _ = self._vector_search(snapshot, matrix, query_vector, depth, excluded)
+            rows = self._reciprocal_rank_fusion([vector_rows, keyword_rows], top_k)
+        else:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        
+        # Report cosine similarity as the relevance score in every mode
+        return self._to_items(kb, rows, matrix[rows] @ query_vector)
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = None, retrieval_mode: str = None,
+                       category: str = None,
+                       verified_only: bool = None) -> List[List[Tuple[Dict, float]]]:
+        """
+        Retrieve relevant FAQs for many queries with a single matmul
+        Returns: one list of (faq, similarity_score) tuples per query
+        """
+        if top_k is None:
+            top_k = Config.RAG_TOP_K
+        mode = retrieval_mode or Config.RAG_RETRIEVAL_MODE
         
-        # Sort by similarity
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        snapshot = self._snapshot
+        kb = snapshot.kb
+        matrix = self._get_faq_matrix(snapshot)
+        if matrix.shape[0] == 0 or not queries:
+            return [[] for _ in queries]
+        if mode != 'vector' or self._get_ann_index(snapshot, matrix) is not None:
+            return [self.retrieve(query, top_k, mode, category, verified_only) for query in queries]
         
-        # Filter by threshold and return top_k
-        results = [
-            (faq, score) for faq, score in similarities 
-            if score >= Config.RAG_SIMILARITY_THRESHOLD
-        ]
+        query_matrix = np.vstack([
+            self._simple_embedding(query, snapshot) for query in queries
+        ])
+        scores = query_matrix @ matrix.T
+        scores[:, kb.excluded_rows_mask(category, verified_only)] = -np.inf
         
-        return results[:top_k]
+        return [self._to_items(kb, *self._top_k(row_scores, top_k)) for row_scores in scores]
     
     def format_context(self, retrieved_items: List[Tuple[Dict, float]]) -> str:
         """Format retrieved FAQs as context for LLM"""
@@ -8,9 +8,17 @@ from typing import Tuple, List
 from config import Config
 
 
+# Data leakage patterns applied to model output
+EMAIL_PATTERN = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+PHONE_PATTERN = re.compile(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b')
+
+
 class SafetyGuard:
     def __init__(self):
         self.sensitive_words = self._load_sensitive_words()
+        self.word_patterns = [
+            re.compile(re.escape(word), re.IGNORECASE) for word in self.sensitive_words
+        ]
         self.prompt_injection_patterns = [
             r'ignore\s+(previous|above|all)\s+instructions',
             r'you\s+are\s+now',
@@ -62,27 +70,28 @@ class SafetyGuard:
         was_filtered = False
         
         # Remove sensitive words from output
-        for word in self.sensitive_words:
-            pattern = re.compile(re.escape(word), re.IGNORECASE)
+        for pattern in self.word_patterns:
             if pattern.search(text):
                 text = pattern.sub('[FILTERED]', text)
                 was_filtered = True
         
         # Check for potential data leakage patterns
         # Email addresses
-        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        if re.search(email_pattern, text):
-            text = re.sub(email_pattern, '[EMAIL]', text)
+        if EMAIL_PATTERN.search(text):
+            text = EMAIL_PATTERN.sub('[EMAIL]', text)
             was_filtered = True
         
         # Phone numbers (simple pattern)
-        phone_pattern = r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b'
-        if re.search(phone_pattern, text):
-            text = re.sub(phone_pattern, '[PHONE]', text)
+        if PHONE_PATTERN.search(text):
+            text = PHONE_PATTERN.sub('[PHONE]', text)
             was_filtered = True
         
         return text, was_filtered
     
+    def stream_filter(self) -> 'OutputStreamFilter':
+        """Incremental output filter for one streamed response"""
+        return OutputStreamFilter(self)
+    
     def sanitize_input(self, text: str) -> str:
         """Remove potentially harmful characters"""
         # Remove null bytes
@@ -90,3 +99,76 @@ class SafetyGuard:
         # Normalize whitespace
         text = ' '.join(text.split())
         return text.strip()
+
+
+class OutputStreamFilter:
+    """
+    Incremental version of SafetyGuard.filter_output() for streamed text.
+    Only the tail that could still grow into a sensitive word, email or phone
+    match is held back; everything before it is filtered and released.
+    """
+    
+    # Characters an email or phone match can consist of (ASCII only); a
+    # trailing run of them may still be extended by the next chunk, and a
+    # match may start anywhere in it, so the whole run is held back until a
+    # character outside the set ends it
+    _TAIL_RUN = re.compile(r'[A-Za-z0-9._%+@|-]+$')
+    
+    def __init__(self, guard: SafetyGuard):
+        self.guard = guard
+        self._words = [word.lower() for word in guard.sensitive_words]
+        self._pending = ""
+        self._released: List[str] = []
+        self.was_filtered = False
+    
+    def _safe_cut(self, text: str) -> int:
+        """Index up to which text can no longer be part of an unfinished match"""
+        cut = len(text)
+        run = self._TAIL_RUN.search(text)
+        if run:
+            cut = run.start()
+        
+        # Longest suffix that is still a proper prefix of a sensitive word
+        lower = text.lower()
+        for word in self._words:
+            for n in range(min(len(word) - 1, len(lower)), 0, -1):
+                if word.startswith(lower[-n:]):
+                    cut = min(cut, len(text) - n)
+                    break
+        
+        # Never split a complete match
+        patterns = self.guard.word_patterns + [EMAIL_PATTERN, PHONE_PATTERN]
+        moved = True
+        while moved:
+            moved = False
+            for pattern in patterns:
+                for match in pattern.finditer(text):
+                    if match.start() < cut < match.end():
+                        cut = match.start()
+                        moved = True
+        return cut
+    
+    def _release(self, text: str) -> str:
+        if not text:
+            return ""
+        filtered, was_filtered = self.guard.filter_output(text)
+        self.was_filtered = self.was_filtered or was_filtered
+        self._released.append(filtered)
+        return filtered
+    
+    def feed(self, chunk: str) -> str:
+        """Add streamed text; returns the filtered text that is safe to show"""
+        text = self._pending + chunk
+        cut = self._safe_cut(text)
+        self._pending = text[cut:]
+        return self._release(text[:cut])
+    
+    def flush(self) -> str:
+        """End of stream: filter and release whatever is held back"""
+        text, self._pending = self._pending, ""
+        return self._release(text)
+    
+    @property
+    def text(self) -> str:
+        """Everything released so far"""
+        return "".join(self._released)
@@ -0,0 +1,120 @@
+"""
+Semantic Answer Cache
+Reuses final (validated, filtered) answers for queries whose embedding is
+close to an earlier query that retrieved exactly the same FAQs
+"""
+
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+
+class SemanticAnswerCache:
+    def __init__(self, dim: int, max_size: int = None, threshold: float = None):
+        self.max_size = max_size or Config.SEMANTIC_CACHE_SIZE
+        self.threshold = threshold if threshold is not None else Config.SEMANTIC_CACHE_THRESHOLD
+        # Fixed-size slot storage: one embedding row, entry and LRU tick per slot
+        self.vectors = np.zeros((self.max_size, dim), dtype=np.float32)
+        self.entries: List[Optional[Dict]] = [None] * self.max_size
+        self.last_used = np.zeros(self.max_size, dtype=np.int64)
+        self._free = list(range(self.max_size - 1, -1, -1))
+        # Only queries that retrieved the same FAQ set are compared
+        self._slots_by_faqs: Dict[Tuple, List[int]] = {}
+        self._tick = 0
+        self._lock = threading.Lock()
+        self.kb_version: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_tokens = {'input': 0, 'output': 0}
+    
+    @staticmethod
+    def faq_key(faq_ids) -> Tuple:
+        return tuple(sorted(str(faq_id) for faq_id in faq_ids))
+    
+    def _check_kb_version(self, kb_version: str):
+        """Drop everything once the KB content changes (caller holds the lock)"""
+        if kb_version != self.kb_version:
+            if self.kb_version is not None and len(self):
+                self.invalidations += 1
+            self.kb_version = kb_version
+            self.entries = [None] * self.max_size
+            self._free = list(range(self.max_size - 1, -1, -1))
+            self._slots_by_faqs.clear()
+    
+    def lookup(self, query_vector: np.ndarray, faq_ids,
+               kb_version: str) -> Tuple[Optional[Dict], float]:
+        """
+        Nearest cached answer for the same FAQ set
+        Returns: (entry or None, similarity)
+        """
+        key = self.faq_key(faq_ids)
+        with self._lock:
+            self._check_kb_version(kb_version)
+            slots = self._slots_by_faqs.get(key)
+            if not slots:
+                self.misses += 1
+                return None, 0.0
+            
+            scores = self.vectors[slots] @ query_vector
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None, similarity
+            
+            slot = slots[best]
+            self._tick += 1
+            self.last_used[slot] = self._tick
+            entry = self.entries[slot]
+            self.hits += 1
+            self.saved_tokens['input'] += entry['tokens']['input']
+            self.saved_tokens['output'] += entry['tokens']['output']
+            return entry, similarity
+    
+    def store(self, query_vector: np.ndarray, faq_ids, kb_version: str,
+              answer: str, was_filtered: bool, tokens: Dict):
+        """Cache a final answer; evicts the least recently used entry when full"""
+        key = self.faq_key(faq_ids)
+        with self._lock:
+            self._check_kb_version(kb_version)
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = int(np.argmin(self.last_used))
+                old_key = self.entries[slot]['faq_key']
+                self._slots_by_faqs[old_key].remove(slot)
+                if not self._slots_by_faqs[old_key]:
+                    del self._slots_by_faqs[old_key]
+                self.evictions += 1
+            
+            self.vectors[slot] = query_vector
+            self.entries[slot] = {
+                'faq_key': key,
+                'answer': answer,
+                'was_filtered': was_filtered,
+                'tokens': dict(tokens)
+            }
+            self._tick += 1
+            self.last_used[slot] = self._tick
+            self._slots_by_faqs.setdefault(key, []).append(slot)
+    
+    def __len__(self) -> int:
+        return self.max_size - len(self._free)
+    
+    def stats(self) -> Dict:
+        """Counters for observability (same core keys as LRUCache.stats())"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.invalidations,
+            'saved_tokens': dict(self.saved_tokens)
+        }
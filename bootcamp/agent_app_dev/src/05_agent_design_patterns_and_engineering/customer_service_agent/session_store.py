@@ -0,0 +1,283 @@
+"""
+Session Store
+Conversation history for many concurrent users of one shared agent:
+- a bounded ring of turns per session
+- idle-TTL expiry and LRU eviction by session count and memory use
+- optional SQLite spill, so evicted (but not expired) sessions can resume
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    last_active REAL NOT NULL,
+    turns TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions(last_active);
+"""
+
+# Rough fixed costs of the Python objects behind a session and a turn
+_SESSION_OVERHEAD = 700
+_TURN_OVERHEAD = 250
+
+
+class Session:
+    __slots__ = ('turns', 'last_active', 'size_bytes')
+    
+    def __init__(self, max_turns: int, turns: List[Dict] = (), last_active: float = None):
+        self.turns = deque(maxlen=max_turns)
+        self.last_active = last_active or time.time()
+        self.size_bytes = _SESSION_OVERHEAD
+        for turn in turns:
+            self.append(turn)
+    
+    @staticmethod
+    def turn_size(turn: Dict) -> int:
+        return _TURN_OVERHEAD + sys.getsizeof(turn['user']) + sys.getsizeof(turn['assistant'])
+    
+    def append(self, turn: Dict) -> int:
+        """Add a turn (dropping the oldest when full); returns the change in size"""
+        before = self.size_bytes
+        if len(self.turns) == self.turns.maxlen:
+            self.size_bytes -= self.turn_size(self.turns[0])
+        self.turns.append(turn)
+        self.size_bytes += self.turn_size(turn)
+        return self.size_bytes - before
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = None, max_turns: int = None,
+                 idle_ttl: Optional[float] = None, max_memory_mb: float = None,
+                 spill_file: Optional[str] = None):
+        self.max_sessions = max_sessions or Config.SESSION_MAX_SESSIONS
+        self.max_turns = max_turns or Config.SESSION_MAX_TURNS
+        self.idle_ttl = idle_ttl if idle_ttl is not None else Config.SESSION_IDLE_TTL
+        self.max_memory_bytes = int((max_memory_mb or Config.SESSION_MAX_MEMORY_MB) * 1024 * 1024)
+        self.spill_file = spill_file if spill_file is not None else Config.SESSION_SPILL_FILE
+        # Least recently active first
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        # Evicted sessions whose spill has not been written yet; a request for
+        # one takes it back from here instead of reading the disk
+        self._spilling: Dict[str, Session] = {}
+        # _lock guards the in-memory state and is never held during SQLite
+        # I/O; _io_lock orders the I/O (take it first if both are needed)
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.spills = 0
+        self.restores = 0
+        
+        if self.spill_file:
+            os.makedirs(os.path.dirname(self.spill_file) or '.', exist_ok=True)
+            with self.conn:
+                self.conn.executescript(_SCHEMA)
+                if self.idle_ttl:
+                    self.conn.execute("DELETE FROM sessions WHERE last_active < ?",
+                                      (time.time() - self.idle_ttl,))
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection for the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.spill_file, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def _expired(self, session: Session, now: float) -> bool:
+        return bool(self.idle_ttl) and session.last_active < now - self.idle_ttl
+    
+    def _lookup(self, session_id: str, now: float) -> Optional[Session]:
+        """In-memory session for session_id, or None (caller holds the lock)"""
+        session = self._sessions.get(session_id)
+        if session is not None and self._expired(session, now):
+            self._remove(session_id)
+            self.expirations += 1
+            session = None
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return session
+        
+        session = self._spilling.pop(session_id, None)
+        if session is None:
+            return None
+        if self._expired(session, now):
+            self.expirations += 1
+            return None
+        self._insert(session_id, session)
+        self.hits += 1
+        return session
+    
+    def _insert(self, session_id: str, session: Session):
+        self._sessions[session_id] = session
+        self.memory_bytes += session.size_bytes
+    
+    def _touch(self, session_id: str, turn: Optional[Dict] = None) -> Tuple[List[Dict], list]:
+        """
+        Mark a session active (restoring it from disk or creating it) and
+        optionally append a turn; call without holding either lock
+        Returns: (copy of its turns, evicted sessions to write)
+        """
+        now = time.time()
+        with self._lock:
+            session = self._lookup(session_id, now)
+            if session is not None:
+                return self._use(session, now, turn)
+        
+        # The I/O lock keeps a concurrent miss for the same session from
+        # creating an empty one while this one is being restored
+        with self._io_lock:
+            restored = self._restore(session_id, now)
+            with self._lock:
+                session = self._lookup(session_id, now)
+                if session is None:
+                    self.misses += 1
+                    session = restored or Session(self.max_turns)
+                    self._insert(session_id, session)
+                return self._use(session, now, turn)
+    
+    def _use(self, session: Session, now: float, turn: Optional[Dict]) -> Tuple[List[Dict], list]:
+        """Second half of _touch() (caller holds the lock)"""
+        session.last_active = now
+        if turn is not None:
+            self.memory_bytes += session.append(turn)
+        return list(session.turns), self._evict(now)
+    
+    def _remove(self, session_id: str) -> Session:
+        session = self._sessions.pop(session_id)
+        self.memory_bytes -= session.size_bytes
+        return session
+    
+    def _evict(self, now: float) -> List[Tuple[str, Session]]:
+        """
+        Expire idle sessions, then evict the least recently active ones over the
+        limits (caller holds the lock)
+        Returns: evicted sessions to pass to _write_spills() once the lock is released
+        """
+        spills = []
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if self._expired(session, now):
+                self._remove(session_id)
+                self.expirations += 1
+            elif (len(self._sessions) > self.max_sessions
+                    or (self.memory_bytes > self.max_memory_bytes and len(self._sessions) > 1)):
+                session = self._remove(session_id)
+                self.evictions += 1
+                if self.spill_file:
+                    self._spilling[session_id] = session
+                    spills.append((session_id, session))
+            else:
+                break
+        return spills
+    
+    def _write_spills(self, spills: List[Tuple[str, Session]]):
+        """Write evicted sessions to disk, skipping any taken back in the meantime"""
+        for session_id, session in spills:
+            with self._io_lock:
+                with self._lock:
+                    if self._spilling.get(session_id) is not session:
+                        continue
+                    row = (session_id, session.last_active,
+                           json.dumps(list(session.turns), ensure_ascii=False))
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO sessions (session_id, last_active, turns) "
+                        "VALUES (?, ?, ?)", row
+                    )
+                with self._lock:
+                    if self._spilling.get(session_id) is session:
+                        del self._spilling[session_id]
+                    self.spills += 1
+    
+    def _restore(self, session_id: str, now: float) -> Optional[Session]:
+        """Read and remove a spilled session (caller holds _io_lock)"""
+        if not self.spill_file:
+            return None
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT last_active, turns FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        session = Session(self.max_turns, json.loads(row[1]), row[0])
+        with self._lock:
+            if self._expired(session, now):
+                self.expirations += 1
+                return None
+            self.restores += 1
+        return session
+    
+    def history(self, session_id: str, last: int = None) -> List[Dict]:
+        """
+        Copy of the most recent turns of a session (oldest first)
+        Blocking when spilling is on (see spill_file): call off the event loop
+        """
+        turns, spills = self._touch(session_id)
+        self._write_spills(spills)
+        return turns[-last:] if last else turns
+    
+    def append(self, session_id: str, user: str, assistant: str):
+        """Record a finished turn (blocking when spilling is on, like history())"""
+        _, spills = self._touch(session_id, {'user': user, 'assistant': assistant})
+        self._write_spills(spills)
+    
+    def reset(self, session_id: str):
+        """Forget a session's history"""
+        with self._io_lock:
+            with self._lock:
+                if session_id in self._sessions:
+                    self._remove(session_id)
+                self._spilling.pop(session_id, None)
+            if self.spill_file:
+                with self.conn:
+                    self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+    
+    def flush(self):
+        """Spill all in-memory sessions to disk (e.g. on shutdown)"""
+        with self._lock:
+            spills = list(self._sessions.items())
+            self._spilling.update(spills)
+        self._write_spills(spills)
+    
+    def __len__(self) -> int:
+        return len(self._sessions)
+    
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+    
+    def stats(self) -> Dict:
+        """Counters for observability (same core keys as LRUCache.stats())"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._sessions),
+            'max_size': self.max_sessions,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'memory_mb': round(self.memory_bytes / (1024 * 1024), 2),
+            'spills': self.spills,
+            'restores': self.restores
+        }
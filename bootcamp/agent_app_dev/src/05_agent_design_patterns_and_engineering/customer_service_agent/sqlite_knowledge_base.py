@@ -0,0 +1,265 @@
+"""
+SQLite Knowledge Base Backend
+Same interface as KnowledgeBase, stored in a SQLite database (WAL mode)
+- FTS5 table for keyword search
+- embeddings stored as BLOBs next to each FAQ
+- several processes can read while one writes
+"""
+
+import os
+import sqlite3
+import threading
+import numpy as np
+from typing import Dict, List
+
+from config import Config
+from knowledge_base import KnowledgeBase
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS faqs (
+    id INTEGER PRIMARY KEY,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    category TEXT,
+    verified INTEGER NOT NULL DEFAULT 0,
+    embedding BLOB,
+    embedding_signature TEXT
+);
+CREATE INDEX IF NOT EXISTS faqs_category ON faqs(category);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# External-content FTS5 index kept in sync by triggers
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS faqs_fts USING fts5(
+    question, answer, content='faqs', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS faqs_ai AFTER INSERT ON faqs BEGIN
+    INSERT INTO faqs_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer);
+END;
+CREATE TRIGGER IF NOT EXISTS faqs_ad AFTER DELETE ON faqs BEGIN
+    INSERT INTO faqs_fts(faqs_fts, rowid, question, answer)
+    VALUES ('delete', old.id, old.question, old.answer);
+END;
+CREATE TRIGGER IF NOT EXISTS faqs_au AFTER UPDATE OF question, answer ON faqs BEGIN
+    INSERT INTO faqs_fts(faqs_fts, rowid, question, answer)
+    VALUES ('delete', old.id, old.question, old.answer);
+    INSERT INTO faqs_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer);
+END;
+"""
+
+
+class SQLiteKnowledgeBase(KnowledgeBase):
+    def __init__(self, db_file: str = None):
+        db_file = db_file or Config.KB_SQLITE_FILE
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        self.db_file = db_file
+        # sqlite3 connections must not be shared between threads
+        self._local = threading.local()
+        self.has_fts = self._init_schema()
+        super().__init__(db_file)
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection for the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def _init_schema(self) -> bool:
+        """Create tables; returns False if this SQLite build lacks FTS5"""
+        with self.conn:
+            self.conn.executescript(_SCHEMA)
+            try:
+                self.conn.executescript(_FTS_SCHEMA)
+                return True
+            except sqlite3.OperationalError:
+                print("SQLite FTS5 not available, using the in-memory keyword index")
+                return False
+    
+    def _load_faqs(self):
+        """Load FAQs from the database"""
+        rows = self.conn.execute(
+            "SELECT id, question, answer, category, verified FROM faqs ORDER BY id"
+        ).fetchall()
+        self.faqs = [
+            {'id': faq_id, 'question': question, 'answer': answer,
+             'category': category, 'verified': bool(verified)}
+            for faq_id, question, answer, category, verified in rows
+        ]
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        self._next_id = int(row[0]) if row else 1
+        if self.faqs:
+            print(f"Loaded {len(self.faqs)} FAQs from {self.db_file}")
+        else:
+            print(f"No FAQs in database: {self.db_file}")
+            self._create_default_faqs()
+    
+    def storage_signature(self) -> tuple:
+        """
+        FAQ content version from the meta table, bumped by every commit
+        (file mtimes also change on checkpoints and embedding writes)
+        """
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+        return (int(row[0]) if row else 0,)
+    
+    def _replay_log(self):
+        """Changes are committed straight to the database, there is no log to replay"""
+    
+    def save_faqs(self):
+        """Replace the database contents with the in-memory FAQs"""
+        with self.conn:
+            self.conn.execute("DELETE FROM faqs")
+            self.conn.executemany(
+                "INSERT INTO faqs (id, question, answer, category, verified) VALUES (?, ?, ?, ?, ?)",
+                [self._row_values(faq) for faq in self.faqs]
+            )
+            self._save_next_id()
+            self._bump_data_version()
+        self._pending_log = []
+        self.synced_signature = self.storage_signature()
+        if self.embedding_signature and self.embeddings is not None:
+            self.save_embeddings(self.embedding_signature)
+    
+    @staticmethod
+    def _row_values(faq: Dict) -> tuple:
+        return (faq['id'], faq['question'], faq['answer'],
+                faq.get('category'), int(bool(faq.get('verified', False))))
+    
+    def _save_next_id(self):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)", (str(self._next_id),)
+        )
+    
+    def _bump_data_version(self):
+        """Mark a change of FAQ content (call inside the writing transaction)"""
+        self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', '0')")
+        self.conn.execute(
+            "UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'data_version'"
+        )
+    
+    def commit(self):
+        """Apply pending changes to the database in one transaction"""
+        if not self._pending_log:
+            return
+        with self.conn:
+            for entry in self._pending_log:
+                if entry['op'] == 'add':
+                    self.conn.execute(
+                        "INSERT INTO faqs (id, question, answer, category, verified) VALUES (?, ?, ?, ?, ?)",
+                        self._row_values(entry['faq'])
+                    )
+                elif entry['op'] == 'update':
+                    fields = dict(entry['fields'])
+                    if 'verified' in fields:
+                        fields['verified'] = int(bool(fields['verified']))
+                    assignments = [f"{column} = ?" for column in fields]
+                    if 'question' in fields:
+                        # The stored embedding no longer matches the question
+                        assignments.append("embedding = NULL")
+                    if not assignments:
+                        continue
+                    self.conn.execute(
+                        f"UPDATE faqs SET {', '.join(assignments)} WHERE id = ?",
+                        [*fields.values(), entry['id']]
+                    )
+                elif entry['op'] == 'delete':
+                    self.conn.executemany(
+                        "DELETE FROM faqs WHERE id = ?", [(faq_id,) for faq_id in entry['ids']]
+                    )
+            self._save_next_id()
+            self._bump_data_version()
+        self._pending_log = []
+        self.synced_signature = self.storage_signature()
+    
+    def import_faqs(self, faqs: List[Dict], next_id: int = 1):
+        """Bulk load FAQs keeping their ids (used for migration)"""
+        validated = [{'id': int(faq['id']), **self.validate_record(faq)} for faq in faqs]
+        self.faqs = sorted(validated, key=lambda faq: faq['id'])
+        self._next_id = next_id
+        self._build_indexes()
+        self.embeddings = None
+        self.layout_version += 1
+        self.version += 1
+        self.save_faqs()
+    
+    def load_embeddings(self, signature: str) -> bool:
+        """
+        Load stored embeddings; rows without one for this signature are marked stale
+        so the retriever re-embeds only those
+        """
+        rows = self.conn.execute(
+            "SELECT embedding, embedding_signature FROM faqs ORDER BY id"
+        ).fetchall()
+        if len(rows) != len(self.faqs):
+            # Another process changed the table since we loaded it
+            return False
+        dim = next((len(blob) // 4 for blob, stored in rows
+                    if blob is not None and stored == signature), None)
+        if dim is None:
+            return False
+        
+        matrix = np.zeros((len(rows), dim), dtype=np.float32)
+        missing = set()
+        for row, (blob, stored_signature) in enumerate(rows):
+            if blob is None or stored_signature != signature:
+                missing.add(row)
+            else:
+                matrix[row] = np.frombuffer(blob, dtype=np.float32)
+        self.embeddings = matrix
+        self.stale_rows = missing
+        self.embedding_signature = signature
+        return True
+    
+    def save_embeddings(self, signature: str):
+        """Store each embedded row's vector as a BLOB"""
+        if self.embeddings is None:
+            return
+        self._write_embeddings(signature, range(len(self.embeddings)))
+        self.embedding_signature = signature
+        self.synced_signature = self.storage_signature()
+    
+    def save_embedding_rows(self, signature: str, rows):
+        """Store the BLOBs of freshly embedded rows (added or edited FAQs)"""
+        if self.embeddings is not None:
+            self._write_embeddings(signature, rows)
+    
+    def _write_embeddings(self, signature: str, rows):
+        # Matching on the question too skips rows another process edited meanwhile
+        embeddings = self.embeddings
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE faqs SET embedding = ?, embedding_signature = ? WHERE id = ? AND question = ?",
+                [(np.asarray(embeddings[row], dtype=np.float32).tobytes(), signature,
+                  self.faqs[row]['id'], self.faqs[row]['question'])
+                 for row in rows if row not in self.stale_rows]
+            )
+    
+    def get_faqs_by_category(self, category: str) -> List[Dict]:
+        """Get FAQs of one category (uses the category index)"""
+        ids = self.conn.execute(
+            "SELECT id FROM faqs WHERE category = ? ORDER BY id", (category,)
+        ).fetchall()
+        return [faq for faq in (self.get_faq_by_id(faq_id) for (faq_id,) in ids) if faq]
+    
+    def search_ranked(self, query: str) -> List[Dict]:
+        """Full-text search through FTS5: FAQs containing every term, best BM25 rank first"""
+        if not self.has_fts:
+            return super().search_ranked(query)
+        terms = query.split()
+        if not terms:
+            return []
+        # Quote each term so user input is never parsed as FTS5 query syntax
+        match = ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+        ids = self.conn.execute(
+            "SELECT rowid FROM faqs_fts WHERE faqs_fts MATCH ? ORDER BY rank", (match,)
+        ).fetchall()
+        return [faq for faq in (self.get_faq_by_id(faq_id) for (faq_id,) in ids) if faq]
@@ -5,51 +5,61 @@ This helps reduce AI hallucination (课程中的"白脸"角色)
 """
 
 import json
-import httpx
 from typing import Dict, Tuple
 from config import Config
+from llm_client import LLMTransport
+from observer import Observer
+from query_context import current_query
 
 
 class ValidatorAgent:
-    def __init__(self):
-        self.api_url = Config.LLM_API_URL
-        self.api_key = Config.LLM_API_KEY
+    def __init__(self, transport: LLMTransport = None, observer: Observer = None):
         self.model = Config.LLM_MODEL
+        self.llm = transport or LLMTransport.shared()
+        self.observer = observer  # Validator calls count towards the same token/cost totals
     
-    def _call_llm(self, messages: list) -> str:
+    def _call_llm(self, messages: list, stage: str = 'validate') -> str:
         """Call LLM API"""
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        payload = {
-            "model": self.model,
-            "messages": messages,
-            "temperature": Config.VALIDATOR_TEMPERATURE,
-            "max_tokens": 500
-        }
-        
         try:
-            response = httpx.post(
-                self.api_url, 
-                json=payload, 
-                headers=headers,
-                timeout=30.0
+            result = self.llm.chat(
+                messages, Config.VALIDATOR_TEMPERATURE, 500,
+                stage=stage, model=self.model
             )
-            response.raise_for_status()
-            result = response.json()
-            return result['choices'][0]['message']['content']
+            return self._content(result)
         except Exception as e:
             print(f"Validator LLM call error: {e}")
+            self._record_error()
             return ""
     
-    def validate_response(self, query: str, response: str, 
-                         context: str, sources: list) -> Tuple[bool, str, Dict]:
-        """
-        Validate if the response is accurate and grounded in context
-        Returns: (is_valid, feedback, validation_details)
-        """
+    async def _call_llm_async(self, messages: list, stage: str = 'validate') -> str:
+        """Call LLM API without blocking the event loop"""
+        try:
+            result = await self.llm.achat(
+                messages, Config.VALIDATOR_TEMPERATURE, 500,
+                stage=stage, model=self.model
+            )
+            return self._content(result)
+        except Exception as e:
+            print(f"Validator LLM call error: {e}")
+            self._record_error()
+            return ""
+    
+    def _content(self, result: Dict) -> str:
+        # Track in observer (cache hits cost nothing; the cache reports the savings)
+        if self.observer is not None and not result.get('cached'):
+            usage = result.get('usage', {})
+            self.observer.track_llm_call(self.model, usage.get('prompt_tokens', 0),
+                                         usage.get('completion_tokens', 0))
+        return result['choices'][0]['message']['content']
+    
+    @staticmethod
+    def _record_error():
+        context = current_query()
+        if context is not None:
+            context.record_llm_error()
+    
+    def _validation_messages(self, query: str, response: str,
+                             context: str, sources: list) -> list:
         validation_prompt = f"""You are a strict validator agent. Your job is to check if the answer is accurate and grounded in the provided knowledge base.
 
 User Query: {query}
@@ -81,9 +91,10 @@ Respond in JSON format:
             {"role": "system", "content": "You are a validation agent that checks answer accuracy."},
             {"role": "user", "content": validation_prompt}
         ]
-        
-        validation_result = self._call_llm(messages)
-        
+        return messages
+    
+    @staticmethod
+    def _parse_validation(validation_result: str) -> Tuple[bool, str, Dict]:
         try:
             # Parse JSON response
             validation_data = json.loads(validation_result)
@@ -96,9 +107,24 @@ Respond in JSON format:
             is_valid = 'false' not in validation_result.lower()
             return is_valid, validation_result, {'is_valid': is_valid}
     
-    def suggest_improvement(self, query: str, original_response: str, 
-                           validation_feedback: str) -> str:
-        """Suggest improved response based on validation feedback"""
+    def validate_response(self, query: str, response: str, 
+                         context: str, sources: list) -> Tuple[bool, str, Dict]:
+        """
+        Validate if the response is accurate and grounded in context
+        Returns: (is_valid, feedback, validation_details)
+        """
+        messages = self._validation_messages(query, response, context, sources)
+        return self._parse_validation(self._call_llm(messages))
+    
+    async def validate_response_async(self, query: str, response: str,
+                                      context: str, sources: list) -> Tuple[bool, str, Dict]:
+        """Async version of validate_response()"""
+        messages = self._validation_messages(query, response, context, sources)
+        return self._parse_validation(await self._call_llm_async(messages))
+    
+    @staticmethod
+    def _improvement_messages(query: str, original_response: str,
+                              validation_feedback: str) -> list:
         improvement_prompt = f"""The following answer was found to have issues:
 
 Original Answer: {original_response}
@@ -114,6 +140,16 @@ Please provide an improved answer that addresses the validation issues. If you c
             {"role": "system", "content": "You are a helpful assistant that provides accurate information."},
             {"role": "user", "content": improvement_prompt}
         ]
-        
-        improved_response = self._call_llm(messages)
-        return improved_response
+        return messages
+    
+    def suggest_improvement(self, query: str, original_response: str, 
+                           validation_feedback: str) -> str:
+        """Suggest improved response based on validation feedback"""
+        messages = self._improvement_messages(query, original_response, validation_feedback)
+        return self._call_llm(messages, stage='improve')
+    
+    async def suggest_improvement_async(self, query: str, original_response: str,
+                                        validation_feedback: str) -> str:
+        """Async version of suggest_improvement()"""
+        messages = self._improvement_messages(query, original_response, validation_feedback)
+        return await self._call_llm_async(messages, stage='improve')